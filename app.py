@@ -5,21 +5,291 @@ Sistema completo de IA conversacional especializada en DLLs
 """
 
 import os
+import re
 import json
+import math
+import gc
+import time
+import queue
+import random
+import atexit
+import asyncio
+import bisect
+import cProfile
+import contextvars
+import gzip
+import heapq
+import hashlib
+import hmac
 import logging
+import logging.handlers
+import mimetypes
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from functools import partial
 from datetime import datetime
-from typing import Dict, List, Optional
-from flask import Flask, request, jsonify, send_from_directory
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-# Configuración de logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import aiohttp  # Solo necesario para el camino async (asgi.py)
+except ImportError:
+    aiohttp = None
+
+_import_started = time.monotonic()
+
+# Configuración de logging: la petición solo encola, un hilo de fondo formatea y escribe
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')                 # json (una línea JSON por registro) | text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))     # Registros en cola; con la cola llena se descartan
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))   # Fracción escrita de los eventos info por petición
+
+_log_context = contextvars.ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields):
+    """Añade campos (request_id, session_id) a los logs del hilo o tarea asyncio actual"""
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Un objeto JSON por línea: ts, level, logger, msg, campos de contexto y traceback"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "context", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BackgroundLogHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler con cola acotada y un QueueListener que escribe en `target`. Con la cola llena
+    el registro se descarta y se cuenta: el hilo de la petición nunca espera a la E/S.
+    Los info marcados con extra={"sampled": True} (uno o más por petición) se escriben con
+    probabilidad LOG_SAMPLE_RATE.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int = LOG_QUEUE_SIZE, sample_rate: float = LOG_SAMPLE_RATE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+        self.listener = None
+        self.start()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Escribe lo pendiente y detiene el hilo escritor"""
+        if self.listener is not None:
+            try:
+                self.listener.stop()
+            except queue.Full:
+                pass
+            self.listener = None
+
+    def _after_fork(self):
+        # El hilo escritor no sobrevive al fork (workers de gunicorn): cola y escritor propios
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = self.sampled_out = 0
+        self.start()
+
+    def emit(self, record: logging.LogRecord):
+        if self.sample_rate < 1.0 and getattr(record, "sampled", False) and record.levelno <= logging.INFO \
+                and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # En el hilo de la petición solo lo barato: el mensaje (los args podrían cambiar) y el contexto
+        record.msg = record.getMessage()
+        record.args = None
+        record.context = _log_context.get()
+        return record
+
+    def stats(self) -> Dict:
+        return {
+            "format": LOG_FORMAT,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out
+        }
+
+
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json'
+                         else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_handler = BackgroundLogHandler(_log_output)
+atexit.register(log_handler.stop)
+logging.basicConfig(level=LOG_LEVEL, handlers=[log_handler])
 logger = logging.getLogger(__name__)
 
 # Configuración de MiniMax API
 MINIMAX_API_KEY = os.environ.get('MINIMAX_API_KEY')
-MINIMAX_API_URL = 'https://api.minimax.chat/v1/text/chatcompletion_v2'
+MINIMAX_API_URL = os.environ.get('MINIMAX_API_URL', 'https://api.minimax.chat/v1/text/chatcompletion_v2')
+MINIMAX_API_TIMEOUT = float(os.environ.get('MINIMAX_API_TIMEOUT', 30))
+
+# Configuración del pool de conexiones hacia MiniMax
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 4))   # Hosts distintos en caché
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 32))          # Conexiones máximas por host
+UPSTREAM_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', '1') == '1'           # Esperar si el host está al límite
+UPSTREAM_KEEPALIVE_TIMEOUT = float(os.environ.get('UPSTREAM_KEEPALIVE_TIMEOUT', 60))  # 0 = sin keep-alive
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 2000))  # Camino async (asgi.py)
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', 4))     # Conexiones keep-alive abiertas por worker al arrancar
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT', 5))           # Timeout de cada conexión de calentamiento
+
+# Caché de respuestas de MiniMax
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))             # Segundos
+RESPONSE_CACHE_DISK_PATH = os.environ.get('RESPONSE_CACHE_DISK_PATH')              # SQLite; vacío = solo memoria
+
+# Caché por similitud (MinHash + LSH) para preguntas sin contexto casi idénticas
+SIMILARITY_CACHE_ENABLED = os.environ.get('SIMILARITY_CACHE_ENABLED', '1') == '1'
+SIMILARITY_CACHE_THRESHOLD = float(os.environ.get('SIMILARITY_CACHE_THRESHOLD', 0.85))  # Jaccard estimado mínimo
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.environ.get('SIMILARITY_CACHE_MAX_ENTRIES', 100000))
+SIMILARITY_CACHE_TTL = float(os.environ.get('SIMILARITY_CACHE_TTL', RESPONSE_CACHE_TTL))
+
+# Almacén de sesiones (historial de conversación)
+CONTEXT_TURNS = 5                                                                    # Turnos enviados como contexto
+SESSION_MAX_TURNS = int(os.environ.get('SESSION_MAX_TURNS', 50))                     # Ring buffer por sesión
+SESSION_MAX_SESSIONS = int(os.environ.get('SESSION_MAX_SESSIONS', 50000))
+SESSION_MAX_BYTES = int(os.environ.get('SESSION_MAX_BYTES', 256 * 1024 * 1024))
+SESSION_IDLE_TTL = float(os.environ.get('SESSION_IDLE_TTL', 6 * 3600))              # Segundos sin actividad
+SESSION_ARCHIVE_PATH = os.environ.get('SESSION_ARCHIVE_PATH')                        # JSONL con el historial expulsado
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')                        # memory | sqlite
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.sqlite3')              # Compartido entre workers
+SESSION_DB_BATCH_SIZE = int(os.environ.get('SESSION_DB_BATCH_SIZE', 128))            # Turnos por commit
+SESSION_DB_FLUSH_INTERVAL = float(os.environ.get('SESSION_DB_FLUSH_INTERVAL', 0.05))  # Segundos máximos en cola
+SESSION_DB_QUEUE_SIZE = int(os.environ.get('SESSION_DB_QUEUE_SIZE', 10000))          # Turnos máximos en cola de escritura
+SESSION_DB_QUEUE_TIMEOUT = float(os.environ.get('SESSION_DB_QUEUE_TIMEOUT', 5))      # Espera con la cola llena antes de descartar
+SESSION_DB_MAX_RETRIES = int(os.environ.get('SESSION_DB_MAX_RETRIES', 3))            # Reintentos de un commit fallido
+SESSION_LOCK_STRIPES = int(os.environ.get('SESSION_LOCK_STRIPES', 64))               # Stripes de la tabla de locks
+SESSION_PAGE_MAX = int(os.environ.get('SESSION_PAGE_MAX', 100))                       # Turnos máximos por página de /api/sessions
+SESSION_EXPORT_CHUNK = 64                                                            # Turnos leídos por bloque en la exportación NDJSON
+
+# /api/chat/batch
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))                       # Mensajes por lote como máximo
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 16))                     # Hilos compartidos por todos los lotes
+
+# Circuit breaker hacia MiniMax
+CIRCUIT_BREAKER_ENABLED = os.environ.get('CIRCUIT_BREAKER_ENABLED', '1') == '1'
+CIRCUIT_WINDOW_SECONDS = float(os.environ.get('CIRCUIT_WINDOW_SECONDS', 30))       # Ventana móvil de errores/latencia
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', 10))                    # Llamadas mínimas para abrir
+CIRCUIT_ERROR_RATE = float(os.environ.get('CIRCUIT_ERROR_RATE', 0.5))               # Fracción de fallos que abre
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', 10))  # Más lentas cuentan como fallo
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 15))            # Tiempo abierto antes de sondear
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', 2))       # Sondas simultáneas / éxitos para cerrar
+
+# Sondeo de MiniMax en segundo plano (estado para /api/health)
+HEALTH_PROBE_ENABLED = os.environ.get('HEALTH_PROBE_ENABLED', '1') == '1'
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 15))         # Segundos entre sondas (±20% de jitter)
+HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 5))            # Más lenta cuenta como fallo
+HEALTH_PROBE_WINDOW = int(os.environ.get('HEALTH_PROBE_WINDOW', 20))               # Sondas recientes retenidas
+HEALTH_PROBE_MAX_BACKOFF = float(os.environ.get('HEALTH_PROBE_MAX_BACKOFF', 120))  # Intervalo máximo mientras falla
+HEALTH_PROBE_FAILURES = int(os.environ.get('HEALTH_PROBE_FAILURES', 2))            # Fallos seguidos para marcarlo caído
+
+# Coalescencia de peticiones idénticas en vuelo (single-flight)
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1'
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', MINIMAX_API_TIMEOUT + 5))  # Espera máxima de cada waiter
+
+# Control de admisión: llamadas simultáneas a MiniMax, cola justa entre sesiones y límites de ritmo
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', 64))       # Llamadas simultáneas por worker (0 = sin límite)
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))       # Espera máxima en cola antes de 429
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 1000))               # Peticiones en cola como máximo
+SESSION_RATE_LIMIT = float(os.environ.get('SESSION_RATE_LIMIT', 0))                  # Peticiones/s por sesión (0 = sin límite)
+SESSION_RATE_BURST = int(os.environ.get('SESSION_RATE_BURST', 10))
+IP_RATE_LIMIT = float(os.environ.get('IP_RATE_LIMIT', 0))                            # Peticiones/s por IP (0 = sin límite)
+IP_RATE_BURST = int(os.environ.get('IP_RATE_BURST', 30))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))             # Buckets retenidos (LRU)
+# Proxies propios delante de la app (Render: 1). La IP del cliente es la entrada de X-Forwarded-For que
+# añadió el más externo, contando desde la derecha como ProxyFix(x_for=N); las de la izquierda las pone el cliente
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', os.environ.get('TRUST_PROXY_HEADERS', 0)))
+
+# Respuestas locales de la base de conocimientos (sin llamar a MiniMax)
+LOCAL_ANSWERS = os.environ.get('LOCAL_ANSWERS', 'fallback')                         # off | fallback | always
+LOCAL_ANSWER_MAX_WORDS = int(os.environ.get('LOCAL_ANSWER_MAX_WORDS', 12))           # Solo preguntas cortas en modo always
+
+# Recuperación (BM25) de pasajes de la base de conocimientos para el prompt
+KNOWLEDGE_RETRIEVAL_ENABLED = os.environ.get('KNOWLEDGE_RETRIEVAL_ENABLED', '1') == '1'
+KNOWLEDGE_TOP_K = int(os.environ.get('KNOWLEDGE_TOP_K', 3))                          # Pasajes inyectados por mensaje
+KNOWLEDGE_MIN_SCORE = float(os.environ.get('KNOWLEDGE_MIN_SCORE', 1.0))              # Puntuación BM25 mínima
+KNOWLEDGE_BASE_PATH = os.environ.get('KNOWLEDGE_BASE_PATH')                          # JSON que amplía/reemplaza secciones
+KNOWLEDGE_RELOAD_INTERVAL = float(os.environ.get('KNOWLEDGE_RELOAD_INTERVAL', 5))   # Segundos entre comprobaciones del archivo
+KNOWLEDGE_CACHE_CONTROL = os.environ.get('KNOWLEDGE_CACHE_CONTROL', 'no-cache')       # /api/knowledge: revalidar con ETag
+
+# Frontend: archivos cargados en memoria al arrancar (sin acceso al disco por petición)
+STATIC_CACHE_CONTROL = os.environ.get('STATIC_CACHE_CONTROL', 'no-cache')              # URLs sin huella: revalidar con ETag
+STATIC_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'                  # URLs con huella (nombre.<hash>.ext)
+# Lista explícita: nunca se publica nada más de la raíz del proyecto (código, .env, venv/, bases SQLite...)
+STATIC_FILES = tuple(
+    name.strip() for name in os.environ.get('STATIC_FILES', 'index.html,script.js,styles.css').split(',') if name.strip()
+)
+
+# Métricas en formato Prometheus (/api/metrics)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Trazas por petición (/api/debug/traces) y perfiles cProfile de peticiones lentas
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '0') == '1'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))                  # Fracción de peticiones trazadas
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 200))                    # Últimas trazas retenidas
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))              # Fracción perfilada (además de X-Profile)
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))            # Perfiles muestreados: solo se guardan si es más lenta
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')                              # Archivos .pstats
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')                                  # X-Profile: <token> fuerza un perfil; vacío = cabecera ignorada
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))                     # .pstats retenidos en PROFILE_DIR; se borran los más antiguos
+
+# Presupuesto de tokens del prompt enviado a MiniMax
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))            # System + contexto + mensaje
+CONTEXT_FULL_TURNS = int(os.environ.get('CONTEXT_FULL_TURNS', 1))                   # Turnos recientes con código completo
+CONTEXT_CHARS_PER_TOKEN = float(os.environ.get('CONTEXT_CHARS_PER_TOKEN', 3.5))     # Estimación inicial (se autocalibra)
+
+# Prompt de sistema enviado en cada llamada a MiniMax
+SYSTEM_PROMPT = """Eres 'stealth-manager-ai', un asistente especializado en creación, optimización y debugging de DLLs (Dynamic Link Libraries). 
+
+Tus especialidades incluyen:
+- Generación de DLLs en C++, C#, Rust, Assembly, Python extensions
+- Optimizaciones SIMD, memory pooling, multi-threading
+- Debugging avanzado (memory leaks, buffer overflows, stack corruption)
+- Soporte multiplataforma (Windows .dll, Linux .so, macOS .dylib, Android .so)
+- Calling conventions (__stdcall, __cdecl, __fastcall)
+- Técnicas de bypass y stealth para software development
+
+Siempre proporciona:
+- Código de ejemplo funcional cuando sea relevante
+- Explicaciones técnicas precisas
+- Soluciones a problemas específicos
+- Mejores prácticas de desarrollo
+- Consideraciones de seguridad y performance
+
+Responde en español y sé experto, técnico y práctico."""
 
 # Crear aplicación Flask
 app = Flask(__name__, static_folder='.')
@@ -126,39 +396,3066 @@ for (int i = 0; i + 3 < size; i += 4) {
     }
 }
 
-class DLLAssistantAI:
+class MetricsRegistry:
     """
-    IA especializada en DLLs con capacidades conversacionales reales
+    Contadores, gauges e histogramas de buckets fijos con shards por hilo: cada hilo escribe
+    en su propio dict sin locks, y /api/metrics suma los shards al exportar. Los shards de
+    hilos terminados se funden en uno solo para que no crezcan con el servidor threaded.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []    # (hilo, shard); shard: (nombre, labels) -> valor o [buckets..., +Inf, suma]
+        self._retired = {}   # Valores acumulados de hilos terminados
+        self._families = {}  # nombre -> (tipo, ayuda, buckets o función)
+
+    def counter(self, name: str, help_text: str):
+        self._families[name] = ("counter", help_text, None)
+
+    def gauge(self, name: str, help_text: str, collect=None):
+        """Gauge sumado desde los shards (inc/dec) o leído al exportar con `collect()` (número o {labels: valor})"""
+        self._families[name] = ("gauge", help_text, collect)
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self._families[name] = ("histogram", help_text, tuple(buckets))
+
+    def _shard(self) -> Dict:
+        shard = {}
+        self._local.shard = shard
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        key = (name, labels)
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0] * (len(self._families[name][2]) + 2)
+        series[bisect.bisect_left(self._families[name][2], value)] += 1
+        series[-1] += value
+
+    @staticmethod
+    def _merge(total: Dict, shard: Dict):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                merged = total.get(key)
+                total[key] = list(value) if merged is None else [a + b for a, b in zip(merged, value)]
+            else:
+                total[key] = total.get(key, 0) + value
+
+    def collect(self) -> Dict:
+        """Suma de todos los shards: (nombre, labels) -> valor"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in alive:
+                self._merge(total, shard.copy())
+        return total
+
+    LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+    @classmethod
+    def _labels(cls, labels: tuple, le: str = None) -> str:
+        parts = [f'{k}="{str(v).translate(cls.LABEL_ESCAPES)}"' for k, v in labels]
+        if le is not None:
+            parts.append(f'le="{le}"')
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """Formato de texto de Prometheus (version 0.0.4)"""
+        values = self.collect()
+        series = {}
+        for (name, labels), value in values.items():
+            series.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, extra) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "gauge" and extra is not None:
+                try:
+                    collected = extra()
+                except Exception as e:
+                    logger.error("Error leyendo la métrica %s: %s", name, e)
+                    continue
+                items = collected.items() if isinstance(collected, dict) else [((), collected)]
+                for labels, value in items:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, value in sorted(series.get(name, ()), key=lambda item: item[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(extra + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry() if METRICS_ENABLED else None
+if metrics is not None:
+    metrics.counter("http_requests_total", "Peticiones HTTP atendidas por ruta, método y estado")
+    metrics.histogram("http_request_duration_seconds", "Latencia por ruta hasta enviar los headers")
+    metrics.gauge("http_requests_in_flight", "Peticiones HTTP en curso")
+    metrics.counter("http_request_bytes_total", "Bytes recibidos en el cuerpo de las peticiones, por ruta")
+    metrics.counter("http_response_bytes_total", "Bytes enviados en el cuerpo de las respuestas, por ruta (en Flask solo las de tamaño conocido)")
+    metrics.histogram("minimax_upstream_duration_seconds",
+                      "Latencia de las llamadas a MiniMax (hasta el primer byte en streaming) por estado")
+    metrics.counter("minimax_fallback_responses_total", "Respuestas servidas sin MiniMax (base de conocimientos o genérica)")
+    metrics.counter("admission_rejections_total", "Peticiones rechazadas con 429 por el control de admisión, por motivo")
+    metrics.counter("session_turns_dropped_total", "Turnos que el backend sqlite no llegó a guardar, por motivo")
+
+
+class _Trace:
+    """Traza de una petición: spans (nombre, profundidad, inicio y duración relativos)"""
+
+    __slots__ = ("trace_id", "name", "attrs", "wall", "started", "duration", "spans", "depth", "profile")
+
+    def __init__(self, trace_id: int, name: str, attrs: Dict):
+        self.trace_id = trace_id
+        self.name = name
+        self.attrs = attrs
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []  # [nombre, profundidad, inicio, fin]
+        self.depth = 0
+        self.profile = None
+
+    def to_dict(self) -> Dict:
+        started = self.started
+        return {
+            "trace_id": f"{self.trace_id:x}",
+            "name": self.name,
+            "attrs": self.attrs,
+            "start": datetime.fromtimestamp(self.wall).isoformat(),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "spans": [
+                {
+                    "name": name,
+                    "depth": depth,
+                    "start_ms": round((start - started) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3) if end is not None else None
+                }
+                for name, depth, start, end in self.spans
+            ],
+            "profile": self.profile
+        }
+
+
+class _Span:
+    """Context manager de un span dentro de la traza actual"""
+
+    __slots__ = ("trace", "record")
+
+    def __init__(self, trace: _Trace, name: str):
+        self.trace = trace
+        self.record = [name, 0, 0.0, None]
+
+    def __enter__(self):
+        trace = self.trace
+        self.record[1] = trace.depth
+        self.record[2] = time.perf_counter()
+        trace.spans.append(self.record)
+        trace.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.record[3] = time.perf_counter()
+        self.trace.depth -= 1
+        return False
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_NO_SPAN = nullcontext()
+
+
+def trace_span(name: str):
+    """Span alrededor de una etapa; sin traza activa (trazado deshabilitado o no muestreado) no hace nada"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class Tracer:
+    """
+    Trazas muestreadas por petición en un ring buffer. La traza activa vive en un ContextVar,
+    así que funciona igual en hilos (Flask) y en tareas de asyncio (asgi.py).
+    """
+
+    def __init__(self, buffer_size: int = TRACE_BUFFER_SIZE, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=buffer_size)
+        self._ids = random.getrandbits(32) << 32
+        self._lock = threading.Lock()
+        self.sampled = 0
+
+    def start(self, name: str, force: bool = False, **attrs):
+        """Abre una traza y la marca como actual; devuelve (traza, token) o None si no se muestrea"""
+        if not force and random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            self._ids += 1
+            trace_id = self._ids
+            self.sampled += 1
+        trace = _Trace(trace_id, name, attrs)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, started, **attrs):
+        """Cierra la traza devuelta por start() y la guarda en el ring buffer"""
+        trace, token = started
+        trace.duration = time.perf_counter() - trace.started
+        trace.attrs.update(attrs)
+        _current_trace.reset(token)
+        self.traces.append(trace)
+
+    def recent(self, limit: int = 50, min_ms: float = 0.0) -> List[Dict]:
+        """Trazas más recientes primero"""
+        traces = list(self.traces)
+        traces.reverse()
+        return [t.to_dict() for t in traces if t.duration * 1000 >= min_ms][:limit]
+
+    def stats(self) -> Dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "buffered": len(self.traces),
+            "capacity": self.traces.maxlen,
+            "sampled": self.sampled
+        }
+
+
+class RequestProfiler:
+    """
+    Perfiles cProfile por petición (con X-Profile: <PROFILE_TOKEN> o por muestreo). Los muestreados
+    solo se guardan como .pstats si la petición supera el umbral. Uno a la vez por proceso, y como
+    mucho max_files archivos en el directorio.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 slow_seconds: float = PROFILE_SLOW_SECONDS, token: str = PROFILE_TOKEN,
+                 max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.token = token.encode("utf-8")
+        self.max_files = max_files
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.saved = 0
+        self.pruned = 0
+        self.skipped_busy = 0
+        self.denied = 0
+
+    def authorized(self, header: Optional[str]) -> bool:
+        """¿Puede esta cabecera X-Profile forzar un perfil? Sin PROFILE_TOKEN, nunca"""
+        if header is None:
+            return False
+        if self.token and hmac.compare_digest(header.encode("utf-8"), self.token):
+            return True
+        self.denied += 1
+        return False
+
+    def start(self, forced: bool) -> Optional[cProfile.Profile]:
+        if not forced and (not self.sample_rate or random.random() >= self.sample_rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            self.skipped_busy += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Otro profiler activo en el proceso
+            self._busy.release()
+            self.skipped_busy += 1
+            return None
+        self.profiled += 1
+        return profile
+
+    def finish(self, profile: cProfile.Profile, forced: bool, elapsed: float, name: str) -> Optional[str]:
+        """Detiene el perfil; devuelve la ruta del .pstats si se guardó"""
+        try:
+            profile.disable()
+            if not forced and elapsed < self.slow_seconds:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory,
+                f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}-{int(elapsed * 1000)}ms.pstats"
+            )
+            profile.dump_stats(path)
+            self.saved += 1
+            logger.warning("⏱️ Perfil guardado (%.0f ms): %s", elapsed * 1000, path)
+            self._prune()
+            return path
+        except Exception as e:
+            logger.error("Error guardando el perfil: %s", e)
+            return None
+        finally:
+            self._busy.release()
+
+    def _prune(self):
+        """Borra los .pstats más antiguos por encima de max_files (el nombre empieza por la fecha)"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".pstats"))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+                self.pruned += 1
+            except OSError:
+                pass  # Otro worker lo borró antes
+
+    def stats(self) -> Dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_seconds": self.slow_seconds,
+            "directory": self.directory,
+            "header_enabled": bool(self.token),
+            "max_files": self.max_files,
+            "profiled": self.profiled,
+            "saved": self.saved,
+            "pruned": self.pruned,
+            "skipped_busy": self.skipped_busy,
+            "denied": self.denied
+        }
+
+
+tracer = Tracer() if TRACING_ENABLED else None
+profiler = RequestProfiler() if PROFILING_ENABLED else None
+
+
+class UpstreamPoolStats:
+    """Contadores thread-safe del pool de conexiones hacia MiniMax"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def record_checkout(self, wait: float):
+        with self._lock:
+            self.requests += 1
+            self.checkout_wait_total += wait
+            if wait > self.checkout_wait_max:
+                self.checkout_wait_max = wait
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            requests_count = self.requests
+            new_connections = self.new_connections
+            wait_total = self.checkout_wait_total
+            wait_max = self.checkout_wait_max
+
+        reused = max(requests_count - new_connections, 0)
+        return {
+            "requests": requests_count,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / requests_count, 4) if requests_count else 0.0,
+            "checkout_wait_avg_ms": round(wait_total / requests_count * 1000, 3) if requests_count else 0.0,
+            "checkout_wait_max_ms": round(wait_max * 1000, 3)
+        }
+
+
+class _InstrumentedPoolMixin:
+    """Mide la espera de checkout y expira conexiones keep-alive inactivas"""
+
+    upstream_stats: UpstreamPoolStats = None
+    keepalive_timeout: float = 0.0
+
+    def _new_conn(self):
+        self.upstream_stats.record_new_connection()
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        self.upstream_stats.record_checkout(time.perf_counter() - start)
+
+        # Cerrar conexiones que llevan demasiado tiempo inactivas; urllib3 reconecta solo
+        idle_since = getattr(conn, '_idle_since', None)
+        if idle_since is not None and time.monotonic() - idle_since > self.keepalive_timeout:
+            conn.close()
+            self.upstream_stats.record_new_connection()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._idle_since = time.monotonic()
+        super()._put_conn(conn)
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter que usa los pools instrumentados"""
+
+    def __init__(self, stats: UpstreamPoolStats, keepalive_timeout: float, **kwargs):
+        attrs = {"upstream_stats": stats, "keepalive_timeout": keepalive_timeout}
+        self._pool_classes = {
+            "http": type("UpstreamHTTPConnectionPool", (_InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("UpstreamHTTPSConnectionPool", (_InstrumentedPoolMixin, HTTPSConnectionPool), attrs)
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class UpstreamClient:
+    """
+    Cliente HTTP compartido y thread-safe hacia MiniMax con pool de conexiones keep-alive
+    """
+
+    def __init__(self,
+                 pool_connections: int = UPSTREAM_POOL_CONNECTIONS,
+                 pool_maxsize: int = UPSTREAM_POOL_MAXSIZE,
+                 pool_block: bool = UPSTREAM_POOL_BLOCK,
+                 keepalive_timeout: float = UPSTREAM_KEEPALIVE_TIMEOUT):
+        self.stats = UpstreamPoolStats()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keepalive_timeout = keepalive_timeout
+
+        adapter = _PooledAdapter(
+            self.stats,
+            keepalive_timeout,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if keepalive_timeout <= 0:
+            self.session.headers["Connection"] = "close"
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST reutilizando conexiones del pool"""
+        kwargs.setdefault("timeout", MINIMAX_API_TIMEOUT)
+        return self.session.post(url, **kwargs)
+
+    def warm(self, url: str, connections: int, timeout: float = WARMUP_TIMEOUT) -> int:
+        """
+        Abre hasta `connections` conexiones keep-alive con HEADs en paralelo (sin coste de tokens)
+        para que las primeras peticiones no paguen TCP + TLS; devuelve cuántas respondieron
+        """
+        def head(_) -> bool:
+            try:
+                self.session.head(url, timeout=timeout).content  # Consumir la respuesta devuelve la conexión al pool
+                return True
+            except requests.exceptions.RequestException:
+                return False
+
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="upstream-warmup") as pool:
+            return sum(pool.map(head, range(connections)))
+
+    def pool_stats(self) -> Dict:
+        """Estadísticas del pool: reutilización y tiempo de espera de checkout"""
+        stats = self.stats.snapshot()
+        stats.update({
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "pool_block": self.pool_block,
+            "keepalive_timeout": self.keepalive_timeout
+        })
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """
+    Cliente HTTP async hacia MiniMax (aiohttp) para el camino ASGI: miles de llamadas
+    en vuelo sin ocupar un hilo cada una. Debe crearse dentro del event loop.
+    """
+
+    def __init__(self,
+                 max_connections: int = ASYNC_UPSTREAM_MAX_CONNECTIONS,
+                 keepalive_timeout: float = UPSTREAM_KEEPALIVE_TIMEOUT):
+        if aiohttp is None:
+            raise RuntimeError("El camino async requiere aiohttp (pip install aiohttp)")
+
+        self.max_connections = max_connections
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            keepalive_timeout=keepalive_timeout if keepalive_timeout > 0 else None,
+            force_close=keepalive_timeout <= 0
+        )
+        # Mismo significado que el timeout de requests: conexión y cada lectura, no el total
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=MINIMAX_API_TIMEOUT, sock_read=MINIMAX_API_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def post_json(self, url: str, **kwargs) -> Dict:
+        """POST y devuelve el JSON de la respuesta (lanza aiohttp.ClientResponseError si no es 2xx)"""
+        async with self.session.post(url, raise_for_status=True, **kwargs) as response:
+            return await response.json(content_type=None)
+
+    def stream(self, url: str, **kwargs):
+        """Context manager async para leer la respuesta línea a línea (response.content)"""
+        return self.session.post(url, raise_for_status=True, **kwargs)
+
+    async def warm(self, url: str, connections: int, timeout: float = WARMUP_TIMEOUT) -> int:
+        """Versión async de UpstreamClient.warm"""
+        async def head() -> bool:
+            try:
+                async with self.session.head(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    await response.read()
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        return sum(await asyncio.gather(*(head() for _ in range(connections))))
+
+    async def aclose(self):
+        await self.session.close()
+
+
+class UpstreamProber:
+    """
+    Sondeo periódico de MiniMax en un hilo de fondo: HEAD al endpoint (sin coste de tokens) con
+    su propia conexión, alcanzable si responde con estado < 500 antes del timeout. Guarda las
+    últimas `window` sondas y un resumen ya calculado: /api/health nunca espera al upstream.
+    Intervalo con jitter (los workers no sondean a la vez) y backoff exponencial mientras falla.
+    """
+
+    def __init__(self,
+                 url: str = MINIMAX_API_URL,
+                 interval: float = HEALTH_PROBE_INTERVAL,
+                 timeout: float = HEALTH_PROBE_TIMEOUT,
+                 window: int = HEALTH_PROBE_WINDOW,
+                 max_backoff: float = HEALTH_PROBE_MAX_BACKOFF,
+                 failure_threshold: int = HEALTH_PROBE_FAILURES):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self._results = deque(maxlen=window)  # (ok, latencia)
+        self._lock = threading.Lock()
+        self._thread_pid = None
+        self._session = None
+        self.probes = 0
+        self.consecutive_failures = 0
+        self.last_success = None  # time.monotonic()
+        self._summary = {"reachable": None, "success_rate": None, "p50_ms": None}
+
+    @property
+    def down(self) -> bool:
+        return self.consecutive_failures >= self.failure_threshold
+
+    def ensure_started(self):
+        """Arranca el hilo de sondeo de este proceso (también tras un fork de gunicorn)"""
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread_pid = pid
+            self._session = requests.Session()
+            threading.Thread(target=self._loop, name="upstream-prober", daemon=True).start()
+
+    def _next_delay(self) -> float:
+        # Exponente acotado: con caídas muy largas 2 ** fallos desbordaría el float
+        delay = min(self.interval * 2 ** min(self.consecutive_failures, 16), max(self.max_backoff, self.interval))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _loop(self):
+        time.sleep(random.uniform(0, self.interval * 0.2))
+        while True:
+            # Un error inesperado no puede matar el hilo: /api/health quedaría con el último estado para siempre
+            delay = self.interval
+            try:
+                self.probe()
+                delay = self._next_delay()
+            except Exception as e:
+                logger.error("Error en el sondeo de MiniMax: %s", e)
+            time.sleep(delay)
+
+    def probe(self) -> bool:
+        started = time.monotonic()
+        try:
+            response = self._session.head(self.url, timeout=self.timeout)
+            response.content
+            ok = response.status_code < 500
+        except requests.exceptions.RequestException:
+            ok = False
+        self._record(ok, time.monotonic() - started)
+        return ok
+
+    def _record(self, ok: bool, latency: float):
+        with self._lock:
+            self._results.append((ok, latency))
+            self.probes += 1
+            if ok:
+                self.last_success = time.monotonic()
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+            latencies = sorted(latency for success, latency in self._results if success)
+            # Se reemplaza entero: status() lo lee sin lock
+            self._summary = {
+                "reachable": ok,
+                "success_rate": round(sum(success for success, _ in self._results) / len(self._results), 3),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None
+            }
+
+    def status(self) -> Dict:
+        """Estado en caché; tiempo constante"""
+        last_success = self.last_success
+        return dict(
+            self._summary,
+            down=self.down,
+            last_success_age_s=round(time.monotonic() - last_success, 1) if last_success is not None else None,
+            consecutive_failures=self.consecutive_failures,
+            probes=self.probes,
+            interval_s=self.interval
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados (closed / open / half_open) para las llamadas a MiniMax.
+    Se abre cuando, dentro de la ventana móvil, la fracción de fallos (errores o llamadas más
+    lentas que slow_call) supera error_rate; abierto rechaza sin esperar, y tras open_seconds
+    deja pasar hasta half_open_probes sondas: si todas salen bien se cierra, si una falla
+    vuelve a abrirse. Cada cambio de estado abre una generación nueva: el resultado de una
+    llamada permitida en una generación anterior solo entra en la ventana móvil.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self,
+                 window: float = CIRCUIT_WINDOW_SECONDS,
+                 min_calls: int = CIRCUIT_MIN_CALLS,
+                 error_rate: float = CIRCUIT_ERROR_RATE,
+                 slow_call: float = CIRCUIT_SLOW_CALL_SECONDS,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._calls = deque()  # (instante, fallo, latencia)
+        self._failures = 0
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._generation = 1      # Sube en cada cambio de estado; es el token que devuelve allow()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _trim(self, now: float):
+        calls = self._calls
+        while calls and now - calls[0][0] > self.window:
+            self._failures -= calls.popleft()[1]
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._generation += 1
+
+    def _open(self, now: float):
+        self._set_state(self.OPEN)
+        self._opened_at = now
+        self.times_opened += 1
+        logger.warning("Circuit breaker de MiniMax abierto durante %ss", self.open_seconds)
+
+    def allow(self) -> Optional[int]:
+        """
+        ¿Puede salir una llamada al upstream? None si no; si sí, un token (la generación actual)
+        que debe devolverse a record() con el resultado
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return None
+                self._set_state(self.HALF_OPEN)
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return None
+                self._probes_in_flight += 1
+            return self._generation
+
+    def record(self, latency: Optional[float], token: int):
+        """Resultado de una llamada: latencia en segundos, o None si falló; `token` es el de allow()"""
+        failed = latency is None or latency > self.slow_call
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._calls.append((now, failed, latency))
+            self._failures += failed
+
+            if token != self._generation:
+                # Permitida antes del último cambio de estado (p. ej. en vuelo al abrirse): no es una sonda
+                return
+            if self.state == self.HALF_OPEN:
+                self._probes_in_flight -= 1
+                if failed:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._set_state(self.CLOSED)
+                        self._calls.clear()
+                        self._failures = 0
+                        logger.info("Circuit breaker de MiniMax cerrado")
+            elif self.state == self.CLOSED and len(self._calls) >= self.min_calls \
+                    and self._failures / len(self._calls) >= self.error_rate:
+                self._open(now)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._calls)
+            latencies = sorted(latency for _, _, latency in self._calls if latency is not None)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "error_rate": round(self._failures / calls, 3) if calls else 0.0,
+                "latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                "latency_p99_ms": round(latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.99) - 1)] * 1000, 1)
+                                  if latencies else 0.0,
+                "open_remaining_s": round(max(self.open_seconds - (time.monotonic() - self._opened_at), 0.0), 1)
+                                    if self.state == self.OPEN else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected
+            }
+
+
+class CircuitOpenError(Exception):
+    """El circuit breaker no deja salir la llamada a MiniMax"""
+
+
+class _Flight:
+    """Llamada en vuelo de SingleFlight"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas idénticas en vuelo (camino con hilos): el primer hilo con una
+    clave hace la llamada y los que llegan mientras tanto esperan su resultado o su excepción,
+    cada uno con su propio timeout.
+    """
+
+    def __init__(self, wait_timeout: float = SINGLE_FLIGHT_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._flights = {}  # clave -> _Flight
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"Sin respuesta de la llamada idéntica en vuelo tras {self.wait_timeout}s")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "wait_timeouts": self.timeouts
+        }
+
+
+class AsyncSingleFlight:
+    """
+    Equivalente de SingleFlight para el camino async. La llamada corre en su propia tarea,
+    así que si el cliente que la inició se desconecta los demás siguen recibiendo el resultado.
+    """
+
+    def __init__(self, wait_timeout: float = SINGLE_FLIGHT_WAIT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self._tasks = {}  # clave -> asyncio.Task
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    async def do(self, key: str, factory):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.leaders += 1
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            if not task.done():
+                self.timeouts += 1
+            raise
+
+    def _finished(self, key: str, task: "asyncio.Task"):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Evita el aviso "exception was never retrieved" si nadie esperaba
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "wait_timeouts": self.timeouts
+        }
+
+
+class Overloaded(Exception):
+    """Petición rechazada por el control de admisión; `retry_after` en segundos"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Servicio saturado ({reason}), reintentar en {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """Límite de ritmo por clave (sesión o IP) con token buckets; buckets en LRU acotado"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # clave -> [tokens, última actualización]
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def take(self, key: str) -> float:
+        """Consume un token; devuelve 0 si hay, o los segundos hasta el próximo"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.max_keys:
+                    # El bucket olvidado vuelve lleno: como mucho un burst extra
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            self.limited += 1
+            return (1.0 - bucket[0]) / self.rate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets), "limited": self.limited}
+
+
+class _SlotWaiter:
+    """Petición en cola esperando un hueco hacia MiniMax"""
+
+    __slots__ = ("signal", "granted", "cancelled")
+
+    def __init__(self, signal):
+        self.signal = signal  # threading.Event o asyncio.Future
+        self.granted = False
+        self.cancelled = False
+
+
+class FairScheduler:
+    """
+    Límite global de llamadas simultáneas a MiniMax con cola de weighted fair queuing entre
+    sesiones: cada petición en cola recibe una etiqueta de fin virtual
+    max(tiempo virtual, fin de la anterior de su sesión) + 1/peso, y el hueco libre va a la
+    menor. Una sesión ruidosa solo alarga su propia cola. Si la espera estimada (posición en
+    cola × tiempo medio de servicio / capacidad) supera el límite, se rechaza al instante.
+    El camino async usa la subclase AsyncFairScheduler con futures en lugar de Events.
     """
+
+    ALPHA = 0.2  # Peso de cada llamada en la media móvil del tiempo de servicio
+
+    def __init__(self, capacity: int = UPSTREAM_MAX_CONCURRENCY, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 max_queue: int = ADMISSION_MAX_QUEUE):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._heap = []          # (fin virtual, secuencia, sesión, waiter)
+        self._last_finish = {}   # sesión -> fin virtual de su última petición en cola
+        self._queued = {}        # sesión -> peticiones en cola
+        self._seq = 0
+        self.virtual_time = 0.0
+        self.in_use = 0
+        self.depth = 0
+        self.service_time = None  # Media móvil de segundos por llamada
+        self.admitted = 0
+        self.queued = 0
+        self.shed = {"queue_full": 0, "predicted_wait": 0, "queue_timeout": 0}
+
+    def _shed(self, reason: str, retry_after: float) -> Overloaded:
+        self.shed[reason] += 1
+        if metrics is not None:
+            metrics.inc("admission_rejections_total", (("reason", reason),))
+        return Overloaded(reason, max(retry_after, 1.0))
+
+    def _estimated_wait(self, ahead: int) -> float:
+        return (ahead + 1) / self.capacity * (self.service_time or 0.0)
+
+    def _enter(self, session_id: str, weight: float, signal_factory) -> Optional[_SlotWaiter]:
+        """Con el lock tomado: None si hay hueco libre, o el waiter encolado; lanza Overloaded"""
+        if self.in_use < self.capacity and not self.depth:
+            self.in_use += 1
+            self.admitted += 1
+            return None
+        if self.depth >= self.max_queue:
+            raise self._shed("queue_full", self._estimated_wait(self.depth))
+
+        finish = max(self.virtual_time, self._last_finish.get(session_id, 0.0)) + 1.0 / weight
+        ahead = sum(1 for entry in self._heap if entry[0] <= finish and not entry[3].cancelled)
+        estimated = self._estimated_wait(ahead)
+        if estimated > self.queue_timeout:
+            raise self._shed("predicted_wait", estimated)
+
+        waiter = _SlotWaiter(signal_factory())
+        self._seq += 1
+        heapq.heappush(self._heap, (finish, self._seq, session_id, waiter))
+        self._last_finish[session_id] = finish
+        self._queued[session_id] = self._queued.get(session_id, 0) + 1
+        self.depth += 1
+        self.queued += 1
+        return waiter
+
+    def _dequeued(self, session_id: str):
+        self.depth -= 1
+        remaining = self._queued[session_id] - 1
+        if remaining:
+            self._queued[session_id] = remaining
+        else:
+            del self._queued[session_id]
+            # Sin peticiones en cola su etiqueta ya no adelanta a nadie: se olvida al quedar atrás
+            if self._last_finish.get(session_id, 0.0) <= self.virtual_time:
+                self._last_finish.pop(session_id, None)
+        if len(self._last_finish) > 2 * len(self._queued) + 1024:
+            self._last_finish = {k: v for k, v in self._last_finish.items() if v > self.virtual_time or k in self._queued}
+
+    def _give_up(self, waiter: _SlotWaiter, session_id: str) -> bool:
+        """Con el lock tomado: retira de la cola un waiter que dejó de esperar; False si ya tenía hueco"""
+        if waiter.granted:
+            return False
+        waiter.cancelled = True
+        self._dequeued(session_id)
+        return True
+
+    def _release(self, held: float):
+        """Con el lock tomado: pasa el hueco a la siguiente petición en orden de fin virtual"""
+        self.service_time = held if self.service_time is None else (
+            self.service_time + self.ALPHA * (held - self.service_time)
+        )
+        while self._heap:
+            finish, _, session_id, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            self.virtual_time = finish
+            self._dequeued(session_id)
+            waiter.granted = True
+            self.admitted += 1
+            return waiter
+        self.in_use -= 1
+        return None
+
+    @contextmanager
+    def slot(self, session_id: str, weight: float = 1.0):
+        """Ocupa un hueco hacia MiniMax durante el bloque; lanza Overloaded si no llega a tiempo"""
+        with self._lock:
+            waiter = self._enter(session_id, weight, threading.Event)
+        if waiter is not None and not waiter.signal.wait(self.queue_timeout):
+            with self._lock:
+                if self._give_up(waiter, session_id):
+                    raise self._shed("queue_timeout", self._estimated_wait(self.depth))
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                successor = self._release(time.monotonic() - started)
+            if successor is not None:
+                successor.signal.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_use": self.in_use,
+                "queue_depth": self.depth,
+                "queued_sessions": len(self._queued),
+                "service_time_ms": round(self.service_time * 1000, 1) if self.service_time is not None else None,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shed": dict(self.shed)
+            }
+
+
+class AsyncFairScheduler(FairScheduler):
+    """FairScheduler para el camino async: la espera es un future del event loop"""
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, weight: float = 1.0):
+        with self._lock:
+            waiter = self._enter(session_id, weight, asyncio.get_running_loop().create_future)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.signal), self.queue_timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if self._give_up(waiter, session_id):
+                        raise self._shed("queue_timeout", self._estimated_wait(self.depth))
+            except asyncio.CancelledError:
+                # Cliente desconectado: dejar la cola, o devolver el hueco si ya se le había dado
+                with self._lock:
+                    successor = None if self._give_up(waiter, session_id) else self._release(0.0)
+                if successor is not None and not successor.signal.done():
+                    successor.signal.set_result(None)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                successor = self._release(time.monotonic() - started)
+            if successor is not None and not successor.signal.done():
+                successor.signal.set_result(None)
+
+
+class ResponseCache:
+    """
+    Caché LRU de respuestas de MiniMax con presupuesto en bytes, TTL por entrada
+    y una capa opcional en disco (SQLite) que sobrevive a reinicios
+    """
+
+    # Bytes aproximados de cada entrada además de clave y valor
+    ENTRY_OVERHEAD = 128
+
+    def __init__(self,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl: float = RESPONSE_CACHE_TTL,
+                 disk_path: Optional[str] = RESPONSE_CACHE_DISK_PATH):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+
+        self._disk = None
+        self._disk_pid = None
+        self._disk_lock = threading.Lock()
+        if disk_path:
+            # Esquema y purga con una conexión de usar y tirar: con preload_app esto corre en el master
+            conn = sqlite3.connect(disk_path, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+            finally:
+                conn.close()
+
+    def _disk_connection(self) -> Optional[sqlite3.Connection]:
+        """Conexión al disco de este proceso: una conexión SQLite no puede cruzar un fork"""
+        if not self.disk_path:
+            return None
+        pid = os.getpid()
+        if self._disk_pid != pid:
+            with self._lock:
+                if self._disk_pid != pid:
+                    self._disk_lock = threading.Lock()
+                    self._disk = sqlite3.connect(self.disk_path, check_same_thread=False, isolation_level=None)
+                    self._disk_pid = pid
+        return self._disk
+
+    @staticmethod
+    def make_key(message: str, context: List[Dict]) -> str:
+        """Clave: mensaje normalizado + hash del contexto recortado de la conversación"""
+        normalized = " ".join(message.split()).casefold()
+        context_hash = hashlib.sha256(
+            json.dumps([(turn["user"], turn["assistant"]) for turn in context], ensure_ascii=False).encode("utf-8", "surrogatepass")
+        ).hexdigest()
+        return hashlib.sha256(f"{normalized}\0{context_hash}".encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # Entrada caducada
+                del self._entries[key]
+                self.current_bytes -= size
+                self.expirations += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        # Promover a memoria con el TTL restante del disco
+        self._memory_put(key, value[0], value[1])
+        return value[0]
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, value, expires_at)
+        disk = self._disk_connection()
+        if disk is not None:
+            with self._disk_lock:
+                disk.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+
+    def _memory_put(self, key: str, value: str, expires_at: float):
+        size = len(key) + len(value.encode("utf-8", "surrogatepass")) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+
+            # Expulsar las entradas menos usadas hasta volver al presupuesto
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def _disk_get(self, key: str, now: float):
+        disk = self._disk_connection()
+        if disk is None:
+            return None
+        with self._disk_lock:
+            row = disk.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_enabled": bool(self.disk_path),
+                "disk_hits": self.disk_hits
+            }
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza acentos, mayúsculas y puntuación (conserva + y # por C++ / C#)"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return " ".join(re.sub(r"[^\w+#]+", " ", text).split())
+
+
+class SimilarityCache:
+    """
+    Caché de respuestas por similitud para preguntas sin contexto: firmas MinHash de
+    shingles de caracteres (one-permutation hashing con densificación) e índice LSH por bandas.
+    La búsqueda solo compara contra los candidatos del índice, así que es sublineal.
+    """
+
+    SHINGLE_SIZE = 3
+    NUM_BINS = 64          # Longitud de la firma MinHash
+    BANDS = 8              # Bandas LSH (NUM_BINS = BANDS * ROWS)
+    ROWS = 8
+    MAX_VERIFY = 8         # Candidatos verificados: los que más bandas comparten
+    LATENCY_SAMPLES = 1024
+
+    _BIN_BITS = 6          # log2(NUM_BINS)
+    _HASH_MASK = (1 << 64) - 1
+    _DENSIFY_OFFSET = 1 << 58
+
+    def __init__(self,
+                 threshold: float = SIMILARITY_CACHE_THRESHOLD,
+                 max_entries: int = SIMILARITY_CACHE_MAX_ENTRIES,
+                 ttl: float = SIMILARITY_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # id -> (firma, tokens guardia, respuesta, expires_at, texto)
+        self._by_text = {}              # texto normalizado -> id
+        self._buckets = [dict() for _ in range(self.BANDS)]  # banda -> {hash de banda: set(ids)}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._latency_max = 0.0
+
+    def _signature(self, text: str) -> tuple:
+        """Firma MinHash con una sola función hash: cada shingle cae en un bin y se guarda el mínimo"""
+        k = self.SHINGLE_SIZE
+        shingles = {text[i:i + k] for i in range(max(len(text) - k + 1, 1))}
+
+        bins = [None] * self.NUM_BINS
+        low_mask = self.NUM_BINS - 1
+        for shingle in shingles:
+            h = hash(shingle) & self._HASH_MASK
+            index = h & low_mask
+            value = h >> self._BIN_BITS
+            current = bins[index]
+            if current is None or value < current:
+                bins[index] = value
+
+        # Densificación: los bins vacíos copian el siguiente bin lleno (con desplazamiento)
+        if None in bins:
+            filled = list(bins)
+            for i in range(self.NUM_BINS):
+                if bins[i] is None:
+                    distance = 1
+                    while bins[(i + distance) % self.NUM_BINS] is None:
+                        distance += 1
+                    filled[i] = bins[(i + distance) % self.NUM_BINS] + distance * self._DENSIFY_OFFSET
+            bins = filled
+        return tuple(bins)
+
+    @staticmethod
+    def _guard_tokens(text: str) -> frozenset:
+        """Tokens con dígitos o símbolos (c++, c#, x64, win32): deben coincidir exactamente"""
+        return frozenset(token for token in text.split() if not token.isalpha())
+
+    def _band_keys(self, signature: tuple) -> List[int]:
+        rows = self.ROWS
+        return [hash(signature[band * rows:(band + 1) * rows]) for band in range(self.BANDS)]
+
+    def get(self, message: str) -> Optional[str]:
+        start = time.perf_counter()
+        text = normalize_text(message)
+        signature = self._signature(text)
+        guard = self._guard_tokens(text)
+        band_keys = self._band_keys(signature)
+        now = time.time()
+
+        best_id, best_score = None, 0.0
+        with self._lock:
+            # Cuantas más bandas comparte un candidato, más probable es que sea similar
+            band_hits = {}
+            for band, key in enumerate(band_keys):
+                bucket = self._buckets[band].get(key)
+                if bucket:
+                    for entry_id in bucket:
+                        band_hits[entry_id] = band_hits.get(entry_id, 0) + 1
+            if len(band_hits) > self.MAX_VERIFY:
+                candidates = sorted(band_hits, key=band_hits.get, reverse=True)[:self.MAX_VERIFY]
+            else:
+                candidates = band_hits
+
+            for entry_id in candidates:
+                entry_signature, entry_guard, _, expires_at, _ = self._entries[entry_id]
+                if entry_guard != guard or expires_at <= now:
+                    continue
+                score = sum(1 for a, b in zip(signature, entry_signature) if a == b) / self.NUM_BINS
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                answer = self._entries[best_id][2]
+            else:
+                self.misses += 1
+                answer = None
+
+            elapsed = time.perf_counter() - start
+            self._latencies.append(elapsed)
+            if elapsed > self._latency_max:
+                self._latency_max = elapsed
+        return answer
+
+    def put(self, message: str, answer: str):
+        text = normalize_text(message)
+        signature = self._signature(text)
+        guard = self._guard_tokens(text)
+        band_keys = self._band_keys(signature)
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            old_id = self._by_text.get(text)
+            if old_id is not None:
+                self._remove(old_id)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, guard, answer, expires_at, text)
+            self._by_text[text] = entry_id
+            for band, key in enumerate(band_keys):
+                self._buckets[band].setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id: int):
+        """Quita una entrada del LRU y de los buckets LSH (con el lock tomado)"""
+        signature, _, _, _, text = self._entries.pop(entry_id)
+        self._by_text.pop(text, None)
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = sorted(self._latencies)
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "lookup_avg_us": round(sum(latencies) / len(latencies) * 1e6, 1) if latencies else 0.0,
+                "lookup_p99_us": round(latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.99) - 1)] * 1e6, 1)
+                                 if latencies else 0.0,
+                "lookup_max_us": round(self._latency_max * 1e6, 1)
+            }
+
+
+class _Session:
+    """Historial de una sesión: ring buffer de turnos + bytes aproximados"""
+
+    __slots__ = ("turns", "bytes", "last_access")
+
+    def __init__(self, max_turns: int):
+        self.turns = deque(maxlen=max_turns)
+        self.bytes = 0
+        self.last_access = time.monotonic()
+
+
+def public_turn(turn: Dict) -> Dict:
+    """Turno sin los campos internos en caché (claves que empiezan por "_")"""
+    return {k: v for k, v in turn.items() if not k.startswith("_")}
+
+
+def jsonl_archive_hook(path: str):
+    """Hook de archivo que agrega el historial expulsado a un archivo JSONL"""
+    lock = threading.Lock()
+
+    def archive(session_id: str, turns: List[Dict], reason: str):
+        turns = [public_turn(turn) for turn in turns]
+        record = json.dumps({"session_id": session_id, "reason": reason, "turns": turns}, ensure_ascii=False)
+        with lock, open(path, "a", encoding="utf-8") as f:
+            f.write(record + "\n")
+
+    return archive
+
+
+class SessionStore:
+    """
+    Almacén de sesiones en memoria y acotado: ring buffer de turnos por sesión, expiración
+    por inactividad y límite global de sesiones/bytes con expulsión LRU.
+    El historial expulsado puede enviarse a un hook de archivo (session_id, turnos, motivo).
+    """
+
+    # Bytes aproximados de un turno además del texto (dict, timestamp, entrada del deque)
+    TURN_OVERHEAD = 400
+    SESSION_OVERHEAD = 800
+    SWEEP_EVERY = 256  # Cada cuántas escrituras se barren sesiones inactivas
+
+    def __init__(self,
+                 max_turns: int = SESSION_MAX_TURNS,
+                 max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_bytes: int = SESSION_MAX_BYTES,
+                 idle_ttl: float = SESSION_IDLE_TTL,
+                 archive_hook=None):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.archive_hook = archive_hook
+        self._sessions = OrderedDict()  # session_id -> _Session, de menos a más reciente
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._seq = 0  # Cursor global de turnos: creciente, nunca se reutiliza aunque la sesión se recree
+        self.current_bytes = 0
+        self.evicted_sessions = 0
+        self.expired_sessions = 0
+        self.dropped_turns = 0
+
+    @classmethod
+    def _turn_size(cls, turn: Dict) -> int:
+        size = len(turn["user"].encode("utf-8", "surrogatepass")) + len(turn["assistant"].encode("utf-8", "surrogatepass")) + cls.TURN_OVERHEAD
+        # Mensajes ya codificados para MiniMax (RequestEncoder)
+        return size + sum(len(fragment) for fragment in turn.get("_encoded", {}).values())
+
+    def append(self, session_id: str, turn: Dict):
+        """Agrega un turno; puede expulsar turnos antiguos o sesiones enteras"""
+        archived = []
+        size = self._turn_size(turn)
+        now = time.monotonic()
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_turns)
+                self.current_bytes += self.SESSION_OVERHEAD
+            else:
+                self._sessions.move_to_end(session_id)
+
+            # Ring buffer lleno: el turno más antiguo sale del historial
+            if len(session.turns) == session.turns.maxlen:
+                dropped = session.turns[0]
+                dropped_size = self._turn_size(dropped)
+                session.bytes -= dropped_size
+                self.current_bytes -= dropped_size
+                self.dropped_turns += 1
+                archived.append((session_id, [dropped], "ring_buffer"))
+
+            self._seq += 1
+            turn["_seq"] = self._seq
+            session.turns.append(turn)
+            session.bytes += size
+            session.last_access = now
+            self.current_bytes += size
+
+            self._writes += 1
+            if self._writes % self.SWEEP_EVERY == 0:
+                archived.extend(self._expire_idle(now))
+
+            # Límites globales: expulsar las sesiones menos recientes (nunca la actual)
+            while len(self._sessions) > 1 and (
+                    len(self._sessions) > self.max_sessions or self.current_bytes > self.max_bytes):
+                oldest_id = next(iter(self._sessions))
+                archived.append((oldest_id, list(self._pop(oldest_id).turns), "evicted"))
+                self.evicted_sessions += 1
+
+        self._archive(archived)
+
+    def recent(self, session_id: str, count: int) -> List[Dict]:
+        """Últimos `count` turnos de la sesión"""
+        session = self._touch(session_id)
+        if session is None:
+            return []
+        with self._lock:
+            return list(session.turns)[-count:]
+
+    def history(self, session_id: str) -> List[Dict]:
+        """Historial completo retenido de la sesión"""
+        session = self._touch(session_id)
+        if session is None:
+            return []
+        with self._lock:
+            return list(session.turns)
+
+    def version(self, session_id: str) -> int:
+        """Cursor del último turno de la sesión (0 si no existe); cambia con cada turno nuevo"""
+        session = self._touch(session_id)
+        if session is None:
+            return 0
+        with self._lock:
+            return session.turns[-1]["_seq"] if session.turns else 0
+
+    def page(self, session_id: str, before: int = None, after: int = None, limit: int = SESSION_PAGE_MAX):
+        """
+        Página de turnos en orden cronológico como [(cursor, turno)] y si quedan más:
+        con `after`, los primeros `limit` posteriores a ese cursor; si no, los últimos
+        `limit` anteriores a `before` (o a todo el historial).
+        """
+        session = self._touch(session_id)
+        if session is None:
+            return [], False
+        with self._lock:
+            turns = [(turn["_seq"], turn) for turn in session.turns]
+        if after is not None:
+            turns = [entry for entry in turns if entry[0] > after]
+            return turns[:limit], len(turns) > limit
+        if before is not None:
+            turns = [entry for entry in turns if entry[0] < before]
+        return turns[-limit:], len(turns) > limit
+
+    def _touch(self, session_id: str) -> Optional[_Session]:
+        """Devuelve la sesión marcándola como usada; None si no existe o caducó"""
+        archived = []
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_access > self.idle_ttl:
+                archived.append((session_id, list(self._pop(session_id).turns), "expired"))
+                self.expired_sessions += 1
+                session = None
+            elif session is not None:
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+        self._archive(archived)
+        return session
+
+    def _expire_idle(self, now: float) -> List:
+        """Quita sesiones inactivas desde la más antigua (con el lock tomado)"""
+        archived = []
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_access <= self.idle_ttl:
+                break
+            archived.append((oldest_id, list(self._pop(oldest_id).turns), "expired"))
+            self.expired_sessions += 1
+        return archived
+
+    def _pop(self, session_id: str) -> _Session:
+        session = self._sessions.pop(session_id)
+        self.current_bytes -= session.bytes + self.SESSION_OVERHEAD
+        return session
+
+    def _archive(self, archived: List):
+        """Llama al hook fuera del lock; un hook que falla no afecta a la petición"""
+        if not self.archive_hook:
+            return
+        for session_id, turns, reason in archived:
+            if not turns:
+                continue
+            try:
+                self.archive_hook(session_id, turns, reason)
+            except Exception as e:
+                logger.error("Error archivando sesión %s: %s", session_id, e)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "max_turns": self.max_turns,
+                "idle_ttl": self.idle_ttl,
+                "evicted_sessions": self.evicted_sessions,
+                "expired_sessions": self.expired_sessions,
+                "dropped_turns": self.dropped_turns
+            }
+
+
+class SQLiteSessionStore:
+    """
+    Almacén de sesiones persistente en SQLite (modo WAL) compartido por todos los workers
+    de gunicorn. Cada worker agrupa sus escrituras en un hilo que hace group-commit; las
+    lecturas de los últimos N turnos usan el índice (session_id, id). Mismo interfaz que SessionStore.
+    """
+
+    # Sentencias fijas: sqlite3 las compila una vez y las reutiliza desde su caché por conexión
+    SQL_SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS session_turns ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " session_id TEXT NOT NULL,"
+        " user TEXT NOT NULL,"
+        " assistant TEXT NOT NULL,"
+        " timestamp TEXT NOT NULL,"
+        " created_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_session_turns_session ON session_turns (session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_turns_created ON session_turns (created_at)"
+    )
+    SQL_INSERT = "INSERT INTO session_turns (session_id, user, assistant, timestamp, created_at) VALUES (?, ?, ?, ?, ?)"
+    SQL_RECENT = "SELECT user, assistant, timestamp FROM session_turns WHERE session_id = ? ORDER BY id DESC LIMIT ?"
+    SQL_EXISTS = "SELECT 1 FROM session_turns WHERE session_id = ? LIMIT 1"
+    SQL_VERSION = "SELECT MAX(id) FROM session_turns WHERE session_id = ?"
+    SQL_PAGE_BEFORE = (
+        "SELECT id, user, assistant, timestamp FROM session_turns"
+        " WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+    )
+    SQL_PAGE_AFTER = (
+        "SELECT id, user, assistant, timestamp FROM session_turns"
+        " WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?"
+    )
+    SQL_TRIM = (
+        "DELETE FROM session_turns WHERE session_id = ? AND id <= "
+        "(SELECT id FROM session_turns WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)"
+    )
+    SQL_EXPIRE = (
+        "DELETE FROM session_turns WHERE session_id IN ("
+        " SELECT session_id FROM session_turns WHERE created_at < ?"
+        " EXCEPT SELECT session_id FROM session_turns WHERE created_at >= ?)"
+    )
+    SQL_COUNT = "SELECT COUNT(DISTINCT session_id) FROM session_turns"
+
+    SWEEP_INTERVAL = 60.0  # Segundos entre barridos de sesiones inactivas
+    COUNT_TTL = 30.0       # Segundos que se reutiliza el recuento de sesiones (recorre todo el índice)
+
+    # Las lecturas bloquean: el camino async las ejecuta en un hilo
+    blocking = True
+
+    def __init__(self,
+                 path: str = SESSION_DB_PATH,
+                 max_turns: int = SESSION_MAX_TURNS,
+                 idle_ttl: float = SESSION_IDLE_TTL,
+                 batch_size: int = SESSION_DB_BATCH_SIZE,
+                 flush_interval: float = SESSION_DB_FLUSH_INTERVAL,
+                 queue_size: int = SESSION_DB_QUEUE_SIZE,
+                 queue_timeout: float = SESSION_DB_QUEUE_TIMEOUT,
+                 max_retries: int = SESSION_DB_MAX_RETRIES):
+        self.path = path
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._pending = {}        # session_id -> turnos aún no confirmados (read-your-writes)
+        self._settled = threading.Condition(self._pending_lock)  # Avisa cada vez que se confirman turnos
+        self._enqueued = 0        # Turnos encolados por este worker
+        self._processed = 0       # Turnos que el escritor ya ha confirmado (o descartado)
+        self._generation = 0      # Impar mientras un COMMIT está en curso; detecta lecturas que lo cruzan
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._last_sweep = time.monotonic()
+        self._count = (0.0, 0)    # (caduca, sesiones): len() lo consulta cada scrape de /api/metrics
+        self.commits = 0
+        self.written_turns = 0
+        self.retries = 0
+        self.dropped_turns = {"queue_full": 0, "commit_failed": 0}
+
+        conn = self._connection()
+        for statement in self.SQL_SCHEMA:
+            conn.execute(statement)
+        atexit.register(self.flush, 10.0)  # Al salir, sin colgarse si SQLite está bloqueada
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexión por hilo y por proceso (las conexiones no sobreviven a un fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_writer(self):
+        """Arranca el hilo escritor de este worker (también tras un fork de gunicorn)"""
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return
+        with self._pending_lock:
+            if self._writer_pid == pid:
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._pending = {}
+            self._enqueued = self._processed = 0
+            self._writer = threading.Thread(target=self._writer_loop, name="session-writer", daemon=True)
+            self._writer_pid = pid
+            self._writer.start()
+
+    def append(self, session_id: str, turn: Dict):
+        self._ensure_writer()
+        with self._pending_lock:
+            self._pending.setdefault(session_id, []).append(turn)
+            self._enqueued += 1
+        try:
+            # Cola llena = SQLite no da abasto: frenar al que escribe, y si no basta, descartar
+            self._queue.put((session_id, turn, time.time()), timeout=self.queue_timeout)
+        except queue.Full:
+            logger.error("Cola de escritura de sesiones llena: se descarta un turno de %s", session_id)
+            self._discard([(session_id, turn, None)], "queue_full")
+
+    def _discard(self, batch: List, reason: str):
+        """Quita de pendientes unos turnos que no se van a guardar"""
+        with self._settled:
+            self._forget(batch)
+            self.dropped_turns[reason] += len(batch)
+        if metrics is not None:
+            metrics.inc("session_turns_dropped_total", (("reason", reason),), len(batch))
+
+    def _forget(self, batch: List):
+        """Con _pending_lock tomado: saca los turnos de pendientes y despierta a quien espere"""
+        for session_id, turn, _ in batch:
+            pending = self._pending.get(session_id)
+            if pending:
+                pending.remove(turn)
+                if not pending:
+                    del self._pending[session_id]
+        self._processed += len(batch)
+        self._settled.notify_all()
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Agrupar hasta batch_size turnos o flush_interval segundos
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._commit(batch)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.error("Error guardando sesiones en SQLite, se descartan %s turnos: %s", len(batch), e)
+                        self._discard(batch, "commit_failed")
+                    else:
+                        logger.warning("Error guardando sesiones en SQLite (intento %s): %s", attempt + 1, e)
+                        self.retries += 1
+                        time.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+    def _commit(self, batch: List):
+        conn = self._connection()
+        rows = [
+            (session_id, turn["user"], turn["assistant"], turn["timestamp"], created_at)
+            for session_id, turn, created_at in batch
+        ]
+        session_ids = {session_id for session_id, _, _ in batch}
+
+        # La transacción puede esperar hasta el busy timeout: fuera de _pending_lock para no frenar a los lectores
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self.SQL_INSERT, rows)
+            for session_id in session_ids:
+                conn.execute(self.SQL_TRIM, (session_id, session_id, self.max_turns))
+            with self._settled:
+                self._generation += 1
+            committed = False
+            try:
+                conn.execute("COMMIT")
+                committed = True
+            finally:
+                with self._settled:
+                    # El turno pasa de pendientes a la base en el mismo paso que cierra la generación
+                    if committed:
+                        self._forget(batch)
+                    self._generation += 1
+                    self._settled.notify_all()
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        self.commits += 1
+        self.written_turns += len(rows)
+
+        now = time.monotonic()
+        if now - self._last_sweep > self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            cutoff = time.time() - self.idle_ttl
+            conn.execute(self.SQL_EXPIRE, (cutoff, cutoff))
+
+    def flush(self, timeout: float = None):
+        """
+        Espera a que se confirmen los turnos encolados hasta ahora por este worker. Los que
+        lleguen después no cuentan: con tráfico continuo la cola nunca llega a vaciarse.
+        """
+        if self._writer_pid != os.getpid():
+            return
+        with self._settled:
+            target = self._enqueued
+            self._settled.wait_for(lambda: self._processed >= target, timeout)
+
+    def recent(self, session_id: str, count: int) -> List[Dict]:
+        conn = self._connection()
+        while True:
+            with self._settled:
+                self._settled.wait_for(lambda: self._generation % 2 == 0)
+                pending = list(self._pending.get(session_id, ()))
+                generation = self._generation
+            rows = conn.execute(self.SQL_RECENT, (session_id, count)).fetchall()
+            # Si un commit se cruzó con la lectura, el turno podría estar en las dos listas: repetir
+            with self._pending_lock:
+                if generation == self._generation:
+                    break
+        turns = [{"user": u, "assistant": a, "timestamp": ts} for u, a, ts in reversed(rows)]
+        return (turns + pending)[-count:]
+
+    def history(self, session_id: str) -> List[Dict]:
+        return self.recent(session_id, self.max_turns)
+
+    def _settle(self, session_id: str):
+        """Los cursores son ids de fila: espera a que los turnos pendientes de la sesión tengan el suyo"""
+        with self._settled:
+            self._settled.wait_for(lambda: session_id not in self._pending)
+
+    def version(self, session_id: str) -> int:
+        self._settle(session_id)
+        return self._connection().execute(self.SQL_VERSION, (session_id,)).fetchone()[0] or 0
+
+    def page(self, session_id: str, before: int = None, after: int = None, limit: int = SESSION_PAGE_MAX):
+        self._settle(session_id)
+        if after is not None:
+            rows = self._connection().execute(self.SQL_PAGE_AFTER, (session_id, after, limit + 1)).fetchall()
+        else:
+            before = before if before is not None else 2 ** 63 - 1
+            rows = self._connection().execute(self.SQL_PAGE_BEFORE, (session_id, before, limit + 1)).fetchall()
+            rows.reverse()
+        has_more = len(rows) > limit
+        rows = rows[:limit] if after is not None else rows[-limit:]
+        return [(seq, {"user": u, "assistant": a, "timestamp": ts}) for seq, u, a, ts in rows], has_more
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._pending_lock:
+            if session_id in self._pending:
+                return True
+        return self._connection().execute(self.SQL_EXISTS, (session_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        """Sesiones en la base; el COUNT(DISTINCT) crece con el historial, así que se cachea COUNT_TTL segundos"""
+        expires, count = self._count
+        now = time.monotonic()
+        if now >= expires:
+            count = self._connection().execute(self.SQL_COUNT).fetchone()[0]
+            self._count = (now + self.COUNT_TTL, count)
+        return count
+
+    def stats(self) -> Dict:
+        with self._pending_lock:
+            pending = sum(len(turns) for turns in self._pending.values())
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "max_turns": self.max_turns,
+            "idle_ttl": self.idle_ttl,
+            "pending_turns": pending,
+            "commits": self.commits,
+            "written_turns": self.written_turns,
+            "queued_turns": self._queue.qsize() if self._queue is not None else 0,
+            "retries": self.retries,
+            "dropped_turns": dict(self.dropped_turns),
+            "avg_batch": round(self.written_turns / self.commits, 2) if self.commits else 0.0
+        }
+
+
+class _SessionTurnstile:
+    """Cola FIFO por tickets de los mensajes en vuelo de una sesión"""
+
+    __slots__ = ("condition", "next_ticket", "serving")
+
+    def __init__(self, stripe_lock: threading.Lock):
+        self.condition = threading.Condition(stripe_lock)
+        self.next_ticket = 0
+        self.serving = 0
+
+
+class SessionLocks:
+    """
+    Serializa los mensajes de una misma sesión en orden de llegada, de modo que cada turno
+    ve la respuesta del anterior. La tabla de sesiones activas está dividida en stripes
+    por hash de session_id: sesiones distintas nunca esperan entre sí, y solo comparten
+    un lock de stripe durante unas pocas instrucciones.
+    """
+
+    def __init__(self, stripes: int = SESSION_LOCK_STRIPES):
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    @contextmanager
+    def hold(self, session_id: str):
+        stripe_lock, table = self._stripes[hash(session_id) % len(self._stripes)]
+
+        with stripe_lock:
+            turnstile = table.get(session_id)
+            if turnstile is None:
+                turnstile = table[session_id] = _SessionTurnstile(stripe_lock)
+            ticket = turnstile.next_ticket
+            turnstile.next_ticket += 1
+            while turnstile.serving != ticket:
+                turnstile.condition.wait()
+
+        try:
+            yield
+        finally:
+            with stripe_lock:
+                turnstile.serving += 1
+                if turnstile.serving == turnstile.next_ticket:
+                    # Nadie más esperando: liberar la entrada
+                    del table[session_id]
+                else:
+                    turnstile.condition.notify_all()
+
+    def active_sessions(self) -> int:
+        return sum(len(table) for _, table in self._stripes)
+
+
+class AsyncSessionLocks:
+    """Equivalente de SessionLocks para el camino async (asyncio.Lock ya es FIFO)"""
+
+    def __init__(self):
+        self._locks = {}  # session_id -> [asyncio.Lock, usuarios]
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+
+def create_session_store():
+    """Crea el almacén de sesiones configurado en SESSION_BACKEND"""
+    if SESSION_BACKEND == 'sqlite':
+        return SQLiteSessionStore()
+    return SessionStore(
+        archive_hook=jsonl_archive_hook(SESSION_ARCHIVE_PATH) if SESSION_ARCHIVE_PATH else None
+    )
+
+
+class TokenEstimator:
+    """
+    Estimación barata de tokens (caracteres × tokens por carácter). El factor se
+    autocalibra con los prompt_tokens que MiniMax devuelve en `usage`.
+    """
+
+    MESSAGE_OVERHEAD = 4             # Tokens de formato por mensaje (rol, separadores)
+    ALPHA = 0.2                      # Peso de cada observación en la media móvil
+    MIN_RATIO, MAX_RATIO = 0.1, 1.0  # Límites de tokens por carácter
+
+    def __init__(self, chars_per_token: float = CONTEXT_CHARS_PER_TOKEN):
+        self.tokens_per_char = 1.0 / chars_per_token
+        self._lock = threading.Lock()
+        self.observations = 0
+        self.last_error = 0.0  # (real - estimado) / real en la última observación
+
+    def tokens(self, chars: int, messages: int = 0) -> int:
+        return int(chars * self.tokens_per_char + 0.5) + messages * self.MESSAGE_OVERHEAD
+
+    def chars(self, tokens: int) -> int:
+        """Caracteres que caben en `tokens`"""
+        return int(max(tokens, 0) / self.tokens_per_char)
+
+    def observe(self, chars: int, messages: int, prompt_tokens: int):
+        """Ajusta el factor con el tamaño real de un prompt ya enviado"""
+        content_tokens = prompt_tokens - messages * self.MESSAGE_OVERHEAD
+        if chars <= 0 or content_tokens <= 0:
+            return
+        ratio = min(max(content_tokens / chars, self.MIN_RATIO), self.MAX_RATIO)
+        with self._lock:
+            estimated = self.tokens(chars, messages)
+            self.tokens_per_char += self.ALPHA * (ratio - self.tokens_per_char)
+            self.observations += 1
+            self.last_error = (prompt_tokens - estimated) / prompt_tokens
+
+    def stats(self) -> Dict:
+        return {
+            "chars_per_token": round(1.0 / self.tokens_per_char, 3),
+            "observations": self.observations,
+            "last_error": round(self.last_error, 4)
+        }
+
+
+class ContextBuilder:
+    """
+    Arma la lista de mensajes para MiniMax dentro de un presupuesto de tokens.
+    Recorre el historial del turno más reciente al más antiguo: los CONTEXT_FULL_TURNS
+    más recientes van completos, en los anteriores se omiten los bloques de código largos,
+    y el primer turno que no cabe se trunca (o se descarta) y corta el recorrido.
+    El tamaño de cada turno y su versión compactada se calculan una vez y se guardan
+    en el propio turno (claves "_" que public_turn no expone).
+    """
+
+    CODE_BLOCK = re.compile(r"```([^\n`]*)\n(.*?)```", re.S)
+    ELIDE_MIN_LINES = 6        # Bloques más cortos se conservan
+    MIN_TRUNCATED_CHARS = 200  # Por debajo de esto no vale la pena enviar un turno truncado
+    TRUNCATED_MARK = "\n[…respuesta truncada]"
+
+    def __init__(self,
+                 estimator: TokenEstimator,
+                 budget: int = CONTEXT_TOKEN_BUDGET,
+                 full_turns: int = CONTEXT_FULL_TURNS):
+        self.estimator = estimator
+        self.budget = budget
+        self.full_turns = full_turns
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.estimated_tokens = 0
+        self.elided_turns = 0
+        self.truncated_turns = 0
+        self.dropped_turns = 0
+
+    @classmethod
+    def _elide_code(cls, text: str) -> str:
+        def replace(match):
+            lines = match.group(2).count("\n")
+            if lines < cls.ELIDE_MIN_LINES:
+                return match.group(0)
+            return f"```{match.group(1)}\n[código omitido: {lines} líneas]\n```"
+        return cls.CODE_BLOCK.sub(replace, text)
+
+    @classmethod
+    def prepare(cls, turn: Dict):
+        """(chars usuario, chars asistente, respuesta compactada, chars compactada), en caché en el turno"""
+        sizes = turn.get("_context")
+        if sizes is None:
+            elided = cls._elide_code(turn["assistant"]) if "```" in turn["assistant"] else turn["assistant"]
+            sizes = turn["_context"] = (len(turn["user"]), len(turn["assistant"]), elided, len(elided))
+        return sizes
+
+    def select(self, message: str, context: List[Dict], knowledge_chars: int = 0):
+        """
+        Elige qué parte del historial entra en el prompt. Devuelve (turnos, caracteres enviados),
+        con turnos = [(turno, respuesta a enviar, variante)] del más antiguo al más reciente;
+        variante es "assistant", "compact" o None si la respuesta se truncó.
+        knowledge_chars: tamaño del mensaje con pasajes de la base de conocimientos, si lo hay.
+        """
+        estimator = self.estimator
+        chars = len(SYSTEM_PROMPT) + len(message) + knowledge_chars
+        fixed_messages = 3 if knowledge_chars else 2
+        remaining = self.budget - estimator.tokens(chars, fixed_messages)
+
+        selected = []  # Del más reciente al más antiguo
+        elided = truncated = 0
+        for age, turn in enumerate(reversed(context)):
+            user_chars, assistant_chars, compact, compact_chars = self.prepare(turn)
+            assistant, variant = turn["assistant"], "assistant"
+            compacted = age >= self.full_turns and compact_chars < assistant_chars
+            if compacted:
+                assistant, assistant_chars, variant = compact, compact_chars, "compact"
+
+            cost = estimator.tokens(user_chars + assistant_chars, 2)
+            if cost > remaining:
+                available = estimator.chars(remaining - estimator.tokens(user_chars, 2)) - len(self.TRUNCATED_MARK)
+                if available >= self.MIN_TRUNCATED_CHARS:
+                    assistant = assistant[:available] + self.TRUNCATED_MARK
+                    chars += user_chars + len(assistant)
+                    selected.append((turn, assistant, None))
+                    truncated = 1
+                break
+            remaining -= cost
+            chars += user_chars + assistant_chars
+            selected.append((turn, assistant, variant))
+            elided += compacted
+
+        selected.reverse()
+        with self._lock:
+            self.builds += 1
+            self.estimated_tokens += estimator.tokens(chars, fixed_messages + 2 * len(selected))
+            self.elided_turns += elided
+            self.truncated_turns += truncated
+            self.dropped_turns += len(context) - len(selected)
+        return selected, chars
+
+    def stats(self) -> Dict:
+        return {
+            "budget_tokens": self.budget,
+            "builds": self.builds,
+            "avg_prompt_tokens": round(self.estimated_tokens / self.builds, 1) if self.builds else 0.0,
+            "elided_turns": self.elided_turns,
+            "truncated_turns": self.truncated_turns,
+            "dropped_turns": self.dropped_turns,
+            "estimator": self.estimator.stats()
+        }
+
+
+class RequestEncoder:
+    """
+    Serializa el payload de chat completion directamente a bytes. Los headers y el prefijo
+    estático (modelo, parámetros y prompt de sistema) se construyen una sola vez; cada turno
+    del historial guarda sus mensajes ya escapados ("_encoded") y por llamada solo se
+    escapa el mensaje nuevo.
+    """
+
+    USER = b',{"role":"user","content":'
+    ASSISTANT = b',{"role":"assistant","content":'
+    KNOWLEDGE = b',{"role":"system","content":"' + json.dumps(
+        "Información relevante de la base de conocimientos:\n\n")[1:-1].encode("ascii")
+    KNOWLEDGE_SEPARATOR = b"\\n\\n"
+    SUFFIX = b"]}"
+
+    def __init__(self,
+                 model: str = "minimax-m2",
+                 max_tokens: int = 2000,
+                 temperature: float = 0.7,
+                 system_prompt: str = SYSTEM_PROMPT,
+                 api_key: Optional[str] = MINIMAX_API_KEY):
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        # "messages" va al final: el prefijo es el JSON completo sin el "]}" de cierre
+        self._prefix = {
+            stream: json.dumps({
+                "model": model,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "stream": stream,
+                "messages": [{"role": "system", "content": system_prompt}]
+            }).encode("ascii")[:-len(self.SUFFIX)]
+            for stream in (False, True)
+        }
+
+    @staticmethod
+    def _message(role: bytes, content: str) -> bytes:
+        # ASCII escapado, igual que json= de requests (admite surrogates sueltos del cliente)
+        return role + json.dumps(content).encode("ascii") + b"}"
+
+    def _cached(self, turn: Dict, variant: str, role: bytes, content: str) -> bytes:
+        encoded = turn.get("_encoded")
+        if encoded is None:
+            encoded = turn["_encoded"] = {}
+        fragment = encoded.get(variant)
+        if fragment is None:
+            fragment = encoded[variant] = self._message(role, content)
+        return fragment
+
+    def prepare(self, turn: Dict, compact: Optional[str] = None):
+        """Codifica un turno nuevo (y su versión compactada) antes de guardarlo"""
+        if turn["user"]:
+            self._cached(turn, "user", self.USER, turn["user"])
+        if turn["assistant"]:
+            self._cached(turn, "assistant", self.ASSISTANT, turn["assistant"])
+        if compact and compact is not turn["assistant"]:
+            self._cached(turn, "compact", self.ASSISTANT, compact)
+
+    def encode(self, message: str, selected: List, stream: bool = False, knowledge: List = ()):
+        """
+        Cuerpo de la petición para los turnos elegidos por ContextBuilder; devuelve (bytes, nº de mensajes).
+        knowledge: pasajes de KnowledgeIndex.search, ya escapados, que van en un mensaje de sistema.
+        """
+        parts = [self._prefix[stream]]
+        if knowledge:
+            parts.append(self.KNOWLEDGE + self.KNOWLEDGE_SEPARATOR.join(p.escaped for p in knowledge) + b'"}')
+        for turn, assistant, variant in selected:
+            if turn["user"]:
+                parts.append(self._cached(turn, "user", self.USER, turn["user"]))
+            if assistant:
+                if variant is None:
+                    parts.append(self._message(self.ASSISTANT, assistant))
+                else:
+                    parts.append(self._cached(turn, variant, self.ASSISTANT, assistant))
+        parts.append(self._message(self.USER, message))
+        parts.append(self.SUFFIX)
+        return b"".join(parts), len(parts) - 1
+
+
+class IntentRouter:
+    """
+    Clasificador local de consultas: un único regex compilado recorre el mensaje una sola vez
+    y unas reglas en orden eligen (intención, variante) a partir del conjunto de claves
+    encontradas. El regex es la alternancia de todas las palabras clave factorizada por
+    prefijos (un trie) y admite vocales con o sin acento, así que basta con pasar el mensaje a minúsculas.
+    """
+
+    # Clave -> formas normalizadas (sin acentos ni mayúsculas); "*" al final = prefijo
+    KEYWORDS = {
+        "ayuda": ["ayuda", "help", "que puedes", "que sabes"],
+        "hola": ["hola", "hi", "hey", "buenas", "saludos"],
+        "que_es": ["que es", "que son"],
+        "explica": ["explica*", "concepto*", "significa*"],
+        "dll": ["dll*"],
+        "tipo": ["tipo*"],
+        "math": ["matematic*", "math*", "suma*", "multiplic*", "multiply"],
+        "lenguaje": ["lenguaje*"],
+        "lang_cpp": ["c++", "c#"],
+        "callconv": ["calling convention*", "convencion de llamada", "convenciones de llamada", "stdcall", "cdecl", "fastcall"],
+        "simd": ["simd", "sse*", "avx*", "vectoriz*"],
+        "memory": ["memory", "memoria"],
+        "pool": ["pool*"],
+        "leak": ["leak*", "fuga*"],
+        "overflow": ["overflow", "desbordamiento*"],
+        "error": ["error*"],
+        "comun": ["comun*"],
+        "basica": ["basic*", "simple*"],
+        "ejemplo": ["ejemplo*", "example*", "muestra*"],
+        "optimiza": ["optimiz*", "rendimiento", "performance", "acelera*"],
+        "debug": ["debug*", "depura*", "crash*", "bug*", "corrup*", "access violation"],
+        "genera": ["crea*", "genera*", "necesito", "hazme", "construy*"]
+    }
+
+    # (intención, variante, claves obligatorias, al menos una de): gana la primera que cumple
+    RULES = [
+        ("ayuda", "menu", (), ("ayuda",)),
+        ("conceptos", "que_es_dll", ("que_es", "dll"), ()),
+        ("conceptos", "calling_convention", ("callconv",), ("que_es", "explica")),
+        ("debug", "leak", (), ("leak",)),
+        ("debug", "overflow", (), ("overflow",)),
+        ("optimizacion", "simd", (), ("simd",)),
+        ("optimizacion", "memory_pool", ("memory", "pool"), ()),
+        ("ejemplo", "error_comun", ("ejemplo", "error", "comun"), ()),
+        ("ejemplo", "basica", ("basica",), ("ejemplo", "dll")),
+        ("generacion", "tipos", ("tipo", "dll"), ()),
+        ("generacion", "math", ("math", "dll"), ()),
+        ("generacion", "lenguajes", (), ("lenguaje",)),
+        ("generacion", "lenguajes", ("lang_cpp", "dll"), ()),
+        ("generacion", "calling_conventions", (), ("callconv",)),
+        ("conceptos", "default", (), ("que_es", "explica")),
+        ("debug", "default", (), ("debug", "error")),
+        ("optimizacion", "default", (), ("optimiza", "pool")),
+        ("ejemplo", "default", (), ("ejemplo",)),
+        ("generacion", "default", (), ("genera", "dll")),
+        ("general", "saludo", (), ("hola",))
+    ]
+    DEFAULT_ROUTE = ("general", "default")
+
+    ACCENTS = {"a": "[aá]", "e": "[eé]", "i": "[ií]", "o": "[oó]", "u": "[uúü]", " ": r"\s+"}
+    WORD_END = r"(?![\w+#])"
+    MAX_CACHED_MATCHES = 4096
+
+    # Respuestas que contestan la pregunta por completo (modo LOCAL_ANSWERS=always)
+    LOCAL_ROUTES = {
+        ("ayuda", "menu"),
+        ("general", "saludo"),
+        ("conceptos", "que_es_dll"),
+        ("conceptos", "calling_convention"),
+        ("generacion", "tipos"),
+        ("generacion", "calling_conventions"),
+        ("ejemplo", "basica"),
+        ("ejemplo", "error_comun")
+    }
+
+    def __init__(self):
+        self._key_of = {}
+        trie = {}
+        for key, forms in self.KEYWORDS.items():
+            for form in forms:
+                word = form[:-1] if form.endswith("*") else form
+                if "*" in word:
+                    raise ValueError(f"IntentRouter: '*' solo puede ir al final de la palabra clave: {form!r}")
+                self._key_of[word] = key
+                node = trie
+                for ch in word:
+                    node = node.setdefault(ch, {})
+                node[""] = form.endswith("*")  # Fin de palabra; True = basta con el prefijo
+        self._pattern = re.compile(r"(?<![\w+#])" + self._trie_pattern(trie))
+        self._match_keys = {}  # Texto encontrado tal cual -> clave
+        self._rules = [(intent, variant, frozenset(required), frozenset(any_of))
+                       for intent, variant, required, any_of in self.RULES]
+        self._lock = threading.Lock()
+        self.classified = {}
+
+    @classmethod
+    def _trie_pattern(cls, node: Dict) -> str:
+        # Ramas más largas antes que el fin de palabra: la alternancia se queda con la coincidencia más larga
+        branches = [cls.ACCENTS.get(ch, re.escape(ch)) + cls._trie_pattern(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if "" in node:
+            branches.append("" if node[""] else cls.WORD_END)
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    @classmethod
+    def routes(cls) -> List:
+        """Todas las (intención, variante) posibles"""
+        return list(dict.fromkeys([(intent, variant) for intent, variant, _, _ in cls.RULES] + [cls.DEFAULT_ROUTE]))
+
+    def _key(self, text: str) -> Optional[str]:
+        key = self._match_keys.get(text)
+        if key is None:
+            # Un texto que no normaliza a ninguna forma conocida no aporta clave (nunca KeyError)
+            key = self._key_of.get(normalize_text(text))
+            if key is not None and len(self._match_keys) < self.MAX_CACHED_MATCHES:
+                self._match_keys[text] = key
+        return key
+
+    def keywords(self, message: str) -> set:
+        found = {self._key(text) for text in self._pattern.findall(message.lower())}
+        found.discard(None)
+        return found
+
+    def classify(self, message: str):
+        """(intención, variante) del mensaje"""
+        found = self.keywords(message)
+        route = self.DEFAULT_ROUTE
+        for intent, variant, required, any_of in self._rules:
+            if required <= found and (not any_of or not any_of.isdisjoint(found)):
+                route = (intent, variant)
+                break
+        with self._lock:
+            self.classified[route[0]] = self.classified.get(route[0], 0) + 1
+        return route
+
+    def stats(self) -> Dict:
+        return {"mode": LOCAL_ANSWERS, "classified": dict(self.classified)}
+
+
+class _Passage:
+    """Pasaje indexado: texto para el prompt (y ya escapado en JSON) y su longitud en términos"""
+
+    __slots__ = ("passage_id", "text", "escaped", "length")
+
+    def __init__(self, passage_id: str, text: str, length: int):
+        self.passage_id = passage_id
+        self.text = text
+        self.escaped = json.dumps(text)[1:-1].encode("ascii")
+        self.length = length
+
+
+class KnowledgeIndex:
+    """
+    Índice invertido con ranking BM25 sobre la base de conocimientos aplanada: un pasaje por
+    valor hoja o lista, incluidos los ejemplos de código. update() compara con
+    el contenido ya indexado y solo reindexa los pasajes nuevos, cambiados o eliminados.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    STOPWORDS = frozenset(
+        "de la el en y a los las del un una unos unas para con por que es como mi me se lo al o no "
+        "su sus le este esta eso tengo hay cual cuales the and of to in for "
+        "dll dlls".split()  # Toda la base trata de DLLs: no discrimina
+    )
+
+    def __init__(self, knowledge_base: Optional[Dict] = None):
+        self._lock = threading.Lock()
+        self._postings = {}  # término -> {passage_id: frecuencia}
+        self._weights = {}   # término -> [(passage_id, peso BM25 sin idf)], se rehace tras cada update
+        self._passages = {}  # passage_id -> _Passage
+        self._total_length = 0
+        self.version = 0
+        self.searches = 0
+        if knowledge_base is not None:
+            self.update(knowledge_base)
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return [term for term in normalize_text(text).split() if len(term) > 1 and term not in cls.STOPWORDS]
+
+    @classmethod
+    def flatten(cls, knowledge_base: Dict, path: str = "") -> Dict[str, str]:
+        """passage_id (ruta de claves) -> texto del pasaje"""
+        passages = {}
+        for key, value in knowledge_base.items():
+            passage_id = f"{path}/{key}" if path else str(key)
+            if isinstance(value, dict):
+                passages.update(cls.flatten(value, passage_id))
+            elif isinstance(value, list):
+                passages[passage_id] = f"{passage_id}:\n" + "\n".join(f"- {item}" for item in value)
+            elif "\n" in str(value).strip():
+                # Ejemplos de código: bloque cercado para que el modelo lo lea como código
+                passages[passage_id] = f"{passage_id}:\n```\n{str(value).strip()}\n```"
+            else:
+                passages[passage_id] = f"{passage_id}: {value}"
+        return passages
+
+    def _index_terms(self, passage_id: str, text: str) -> List[str]:
+        # La ruta (p. ej. "optimizaciones/memory_pooling") también cuenta como texto del pasaje
+        return self.tokenize(passage_id.replace("/", " ").replace("_", " ") + " " + text)
+
+    def _add(self, passage_id: str, text: str):
+        terms = self._index_terms(passage_id, text)
+        for term in terms:
+            postings = self._postings.setdefault(term, {})
+            postings[passage_id] = postings.get(passage_id, 0) + 1
+        self._passages[passage_id] = _Passage(passage_id, text, len(terms))
+        self._total_length += len(terms)
+
+    def _remove(self, passage_id: str):
+        passage = self._passages.pop(passage_id)
+        for term in set(self._index_terms(passage_id, passage.text)):
+            postings = self._postings[term]
+            del postings[passage_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= passage.length
+
+    def update(self, knowledge_base: Dict) -> int:
+        """Sincroniza el índice con la base de conocimientos; devuelve cuántos pasajes cambiaron"""
+        passages = self.flatten(knowledge_base)
+        changed = 0
+        with self._lock:
+            for passage_id in [pid for pid in self._passages if pid not in passages]:
+                self._remove(passage_id)
+                changed += 1
+            for passage_id, text in passages.items():
+                current = self._passages.get(passage_id)
+                if current is not None and current.text == text:
+                    continue
+                if current is not None:
+                    self._remove(passage_id)
+                self._add(passage_id, text)
+                changed += 1
+            if changed:
+                self.version += 1
+                self._weights = {}  # La longitud media cambió
+        return changed
+
+    def _term_weights(self, term: str, postings: Dict, avg_length: float) -> List:
+        weights = self._weights.get(term)
+        if weights is None:
+            k1, b, passages = self.K1, self.B, self._passages
+            weights = self._weights[term] = [
+                (passage_id, tf * (k1 + 1) / (tf + k1 * (1 - b + b * passages[passage_id].length / avg_length)))
+                for passage_id, tf in postings.items()
+            ]
+        return weights
+
+    def search(self, query: str, k: int = KNOWLEDGE_TOP_K, min_score: float = KNOWLEDGE_MIN_SCORE) -> List[_Passage]:
+        """Los k pasajes con mayor puntuación BM25 (al menos min_score)"""
+        terms = set(self.tokenize(query))
+        with self._lock:
+            self.searches += 1
+            count = len(self._passages)
+            if not count or not terms:
+                return []
+            avg_length = self._total_length / count
+
+            scores = {}
+            get = scores.get
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, weight in self._term_weights(term, postings, avg_length):
+                    scores[passage_id] = get(passage_id, 0.0) + idf * weight
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [self._passages[passage_id] for passage_id, score in best if score >= min_score]
+
+    def stats(self) -> Dict:
+        return {
+            "passages": len(self._passages),
+            "terms": len(self._postings),
+            "version": self.version,
+            "searches": self.searches
+        }
+
+
+def load_knowledge_base(path: Optional[str]) -> Dict:
+    """DLL_KNOWLEDGE_BASE con las secciones de `path` (JSON) fusionadas por encima"""
+    def merge(base: Dict, extra: Dict) -> Dict:
+        merged = dict(base)
+        for key, value in extra.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = merge(merged[key], value)
+            else:
+                merged[key] = value
+        return merged
+
+    if not path:
+        return DLL_KNOWLEDGE_BASE
+    with open(path, encoding="utf-8") as f:
+        return merge(DLL_KNOWLEDGE_BASE, json.load(f))
+
+
+class EncodedBody:
+    """
+    Cuerpo de respuesta serializado una sola vez, con su variante gzip precalculada y un ETag
+    fuerte (hash del contenido; la variante gzip lleva sufijo "-gz" por ser otra representación).
+    """
+
+    __slots__ = ("body", "gzipped", "etag", "content_type")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.gzipped = gzipped if len(gzipped) < len(body) else None
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.content_type = content_type
+
+    def response(self, cache_control: str) -> Response:
+        """200 (gzip si el cliente lo acepta) o 304 si If-None-Match ya tiene esta versión"""
+        use_gzip = self.gzipped is not None and "gzip" in request.accept_encodings
+        etag = self.etag + "-gz" if use_gzip else self.etag
+
+        if request.if_none_match.contains_weak(self.etag) or request.if_none_match.contains_weak(self.etag + "-gz"):
+            response = Response(status=304)
+        else:
+            response = Response(self.gzipped if use_gzip else self.body, content_type=self.content_type)
+            if use_gzip:
+                response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class AssetManifest:
+    """
+    Tabla en memoria de los archivos del frontend, construida una vez al arrancar: bytes, gzip
+    y ETag precalculados. Cada archivo se publica además con una URL con huella
+    (script.<hash>.js) cacheable como immutable; index.html se reescribe para usarlas.
+    """
+
+    INDEX = "index.html"
+
+    def __init__(self, root: str, names=STATIC_FILES):
+        self.root = root
+        self.names = names
+        self.routes = {}  # url -> (EncodedBody, Cache-Control)
+        self.fingerprinted = {}  # nombre -> nombre con huella
+        self.hits = 0
+        self.build()
+
+    @staticmethod
+    def content_type(name: str) -> str:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+            content_type += "; charset=utf-8"
+        return content_type
+
+    def _scan(self) -> Dict[str, bytes]:
+        """Solo los archivos de la lista; una ruta que saldría de la raíz se ignora"""
+        files = {}
+        root = os.path.realpath(self.root)
+        for name in self.names:
+            path = os.path.realpath(os.path.join(root, name))
+            if os.path.commonpath((root, path)) != root or not os.path.isfile(path):
+                logger.warning("Asset del frontend no encontrado u omitido: %s", name)
+                continue
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+        return files
+
+    def build(self):
+        """Lee y comprime todos los assets; los HTML se procesan al final para referenciar las URLs con huella"""
+        files = self._scan()
+        routes, fingerprinted = {}, {}
+
+        def add(name: str, data: bytes):
+            body = EncodedBody(data, self.content_type(name))
+            stem, ext = os.path.splitext(name)
+            fingerprinted[name] = f"{stem}.{body.etag[:10]}{ext}"
+            routes[name] = (body, STATIC_CACHE_CONTROL)
+            routes[fingerprinted[name]] = (body, STATIC_IMMUTABLE_CACHE_CONTROL)
+
+        for name, data in files.items():
+            if not name.endswith(".html"):
+                add(name, data)
+
+        if fingerprinted:
+            reference = re.compile(
+                r'((?:src|href)=["\'])(' + "|".join(map(re.escape, fingerprinted)) + r')(["\'])'
+            )
+            rewrite = lambda m: m.group(1) + fingerprinted[m.group(2)] + m.group(3)
+        for name, data in files.items():
+            if name.endswith(".html"):
+                if fingerprinted:
+                    data = reference.sub(rewrite, data.decode("utf-8")).encode("utf-8")
+                add(name, data)
+
+        self.routes, self.fingerprinted = routes, fingerprinted
+        logger.info("📦 Assets del frontend en memoria: %s archivos, %s bytes", len(files), sum(map(len, files.values())))
+
+    def response(self, path: str) -> Response:
+        """Respuesta del asset; rutas desconocidas sirven index.html (navegación del frontend)"""
+        self.hits += 1
+        entry = self.routes.get(path) or self.routes.get(self.INDEX)
+        if entry is None:
+            return Response("Frontend no disponible", status=404, content_type="text/plain; charset=utf-8")
+        return entry[0].response(entry[1])
+
+    def stats(self) -> Dict:
+        return {
+            "files": len(self.fingerprinted),
+            "bytes": sum(len(self.routes[name][0].body) for name in self.fingerprinted),
+            "gzip_bytes": sum(len(self.routes[name][0].gzipped or self.routes[name][0].body) for name in self.fingerprinted),
+            "hits": self.hits
+        }
+
+
+class DLLAssistantAI:
+    """
+    IA especializada en DLLs con capacidades conversacionales reales
+    """
+    
+    def __init__(self, upstream: Optional[UpstreamClient] = None):
+        self.knowledge_base = load_knowledge_base(KNOWLEDGE_BASE_PATH)
+        self.knowledge_index = KnowledgeIndex(self.knowledge_base) if KNOWLEDGE_RETRIEVAL_ENABLED else None
+        self._knowledge_mtime = os.path.getmtime(KNOWLEDGE_BASE_PATH) if KNOWLEDGE_BASE_PATH else None
+        self._knowledge_checked = time.monotonic()
+        self._knowledge_lock = threading.Lock()
+        self.knowledge_version = 0
+        self._knowledge_body = None  # (versión, EncodedBody) de /api/knowledge
+        self.conversation_history = []
+        self.sessions = create_session_store()
+        self.session_locks = SessionLocks()
+        self.async_session_locks = AsyncSessionLocks()
+        self.token_estimator = TokenEstimator()
+        self.context_builder = ContextBuilder(self.token_estimator)
+        self.encoder = RequestEncoder()
+        self.upstream = upstream or UpstreamClient()
+        self.async_upstream = None  # AsyncUpstreamClient, se crea al usar el camino async
+        self.response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+        self.similarity_cache = SimilarityCache() if SIMILARITY_CACHE_ENABLED else None
+        self.circuit_breaker = CircuitBreaker() if CIRCUIT_BREAKER_ENABLED else None
+        self.single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+        self.async_single_flight = AsyncSingleFlight() if SINGLE_FLIGHT_ENABLED else None
+        self.admission = FairScheduler() if UPSTREAM_MAX_CONCURRENCY > 0 else None
+        self.async_admission = AsyncFairScheduler() if UPSTREAM_MAX_CONCURRENCY > 0 else None
+        self.intent_router = IntentRouter()
+        self._canned = self._render_canned_responses()
+        self.local_answers = 0
+        
+    def process_message(self, user_message: str, session_id: str, use_cache: bool = True, client: str = "") -> Dict:
+        """
+        Procesa un mensaje del usuario y genera una respuesta inteligente usando MiniMax API.
+        use_cache=False fuerza una respuesta nueva (salida no determinista).
+        `client` (IP) es el flujo de la cola justa hacia MiniMax; lanza Overloaded si no hay capacidad.
+        """
+        bind_log_context(session_id=session_id)
+        try:
+            # Limpiar mensaje
+            message = user_message.strip()
+            
+            # Un mensaje a la vez por sesión: leer contexto, llamar y guardar sin intercalarse
+            with self.session_locks.hold(session_id):
+                # Obtener contexto de conversación
+                with trace_span("context"):
+                    context = self._get_conversation_context(session_id)
+                
+                # Generar respuesta usando MiniMax API
+                with trace_span("generate"):
+                    response = self._call_minimax_api(message, context, use_cache, client)
+                
+                # Actualizar historial
+                with trace_span("record_turn"):
+                    self._record_turn(session_id, message, response)
+            
+            return {
+                "success": True,
+                "response": response,
+                "session_id": session_id,
+                "timestamp": datetime.now().isoformat()
+            }
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error("Error procesando mensaje: %s", e)
+            return {
+                "success": False,
+                "error": "Error interno del sistema",
+                "response": "Lo siento, ocurrió un error. Por favor intenta de nuevo."
+            }
+    
+    def stream_message(self, user_message: str, session_id: str, use_cache: bool = True, client: str = "") -> Iterator[str]:
+        """
+        Igual que process_message pero devuelve los fragmentos de la respuesta a medida que llegan.
+        Al terminar el stream guarda la respuesta completa en el historial.
+        """
+        bind_log_context(session_id=session_id)
+        message = user_message.strip()
+        
+        with self.session_locks.hold(session_id):
+            with trace_span("context"):
+                context = self._get_conversation_context(session_id)
+            
+            parts = []
+            try:
+                with trace_span("generate"):
+                    for delta in self._stream_minimax_api(message, context, use_cache, client):
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # También se guarda si el cliente corta la conexión a mitad de respuesta
+                if parts:
+                    with trace_span("record_turn"):
+                        self._record_turn(session_id, message, "".join(parts))
+    
+    def _record_turn(self, session_id: str, message: str, response: str):
+        """Agrega un turno usuario/asistente al historial de la sesión"""
+        turn = {
+            "user": message,
+            "assistant": response,
+            "timestamp": datetime.now().isoformat()
+        }
+        # Tamaños y mensajes codificados se calculan una vez, al guardar el turno
+        compact = self.context_builder.prepare(turn)[2]
+        self.encoder.prepare(turn, compact)
+        self.sessions.append(session_id, turn)
+    
+    def _get_conversation_context(self, session_id: str) -> List[Dict]:
+        """Obtiene el contexto de conversación para mantener continuidad"""
+        return self.sessions.recent(session_id, CONTEXT_TURNS)  # Últimos 5 mensajes
     
-    def __init__(self):
-        self.knowledge_base = DLL_KNOWLEDGE_BASE
-        self.conversation_history = []
-        self.session_data = {}
+    def _build_request(self, message: str, context: List[Dict], stream: bool = False):
+        """Headers, cuerpo JSON ya serializado y tamaño del prompt (caracteres, mensajes) para MiniMax"""
+        self.refresh_knowledge()
+        knowledge = self.knowledge_index.search(message) if self.knowledge_index is not None else []
+        knowledge_chars = sum(len(passage.text) for passage in knowledge)
+        
+        selected, prompt_chars = self.context_builder.select(message, context, knowledge_chars)
+        body, message_count = self.encoder.encode(message, selected, stream, knowledge)
+        return self.encoder.headers, body, (prompt_chars, message_count)
+    
+    def reload_knowledge(self, knowledge_base: Dict):
+        """Reemplaza la base de conocimientos: reindexa solo lo que cambió y re-renderiza las respuestas locales"""
+        self.knowledge_base = knowledge_base
+        changed = self.knowledge_index.update(knowledge_base) if self.knowledge_index is not None else 0
+        self._canned = self._render_canned_responses()
+        self.knowledge_version += 1
+        logger.info("Base de conocimientos recargada: %s pasajes reindexados", changed)
+    
+    def knowledge_body(self) -> EncodedBody:
+        """Respuesta de /api/knowledge serializada y comprimida una vez por versión de la base"""
+        cached = self._knowledge_body
+        if cached is None or cached[0] != self.knowledge_version:
+            version = self.knowledge_version
+            # Mismo JSON que jsonify (compacto, claves ordenadas)
+            body = app.json.dumps({"success": True, "knowledge_base": self.knowledge_base}, separators=(",", ":")) + "\n"
+            cached = self._knowledge_body = (version, EncodedBody(body.encode("utf-8"), "application/json"))
+        return cached[1]
+    
+    def refresh_knowledge(self):
+        """Recarga KNOWLEDGE_BASE_PATH si cambió (como mucho una comprobación cada KNOWLEDGE_RELOAD_INTERVAL)"""
+        if not KNOWLEDGE_BASE_PATH or time.monotonic() - self._knowledge_checked < KNOWLEDGE_RELOAD_INTERVAL:
+            return
+        if not self._knowledge_lock.acquire(blocking=False):
+            return  # Otro hilo ya está comprobando
+        try:
+            self._knowledge_checked = time.monotonic()
+            mtime = os.path.getmtime(KNOWLEDGE_BASE_PATH)
+            if mtime != self._knowledge_mtime:
+                self.reload_knowledge(load_knowledge_base(KNOWLEDGE_BASE_PATH))
+                self._knowledge_mtime = mtime
+        except (OSError, ValueError) as e:
+            logger.error("Error recargando la base de conocimientos: %s", e)
+        finally:
+            self._knowledge_lock.release()
+    
+    def _observe_usage(self, result: Dict, prompt_size):
+        """Calibra el estimador de tokens con el `usage` que devuelve MiniMax"""
+        prompt_tokens = (result.get("usage") or {}).get("prompt_tokens")
+        if isinstance(prompt_tokens, int):
+            self.token_estimator.observe(*prompt_size, prompt_tokens)
+    
+    def _cache_lookup(self, message: str, context: List[Dict], use_cache: bool):
+        """Devuelve (clave, respuesta en caché); clave None si la caché no aplica"""
+        if not use_cache:
+            return None, None
+        cache_key = ResponseCache.make_key(message, context)
+        
+        if self.response_cache is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cache_key, cached
         
-    def process_message(self, user_message: str, session_id: str) -> Dict:
+        # Preguntas sin contexto: buscar una casi idéntica ya respondida
+        if self.similarity_cache is not None and not context:
+            return cache_key, self.similarity_cache.get(message)
+        return cache_key, None
+    
+    def _cache_store(self, cache_key: Optional[str], message: str, context: List[Dict], response: str):
+        """Guarda una respuesta real de MiniMax en las cachés"""
+        if not cache_key:
+            return
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, response)
+        if self.similarity_cache is not None and not context:
+            self.similarity_cache.put(message, response)
+    
+    def _upstream_allowed(self) -> Optional[int]:
+        """Token del circuit breaker para la llamada (0 sin breaker), o None si no puede salir"""
+        return 0 if self.circuit_breaker is None else self.circuit_breaker.allow()
+    
+    def _record_upstream(self, latency: Optional[float], started: float, status: str, token: int, stream: bool = False):
         """
-        Procesa un mensaje del usuario y genera una respuesta inteligente usando MiniMax API
+        Latencia de una llamada permitida por _upstream_allowed (con su token), o None si falló;
+        `status`: código HTTP, error o timeout
         """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(latency, token)
+        if metrics is not None:
+            elapsed = latency if latency is not None else time.monotonic() - started
+            metrics.observe("minimax_upstream_duration_seconds", elapsed,
+                            (("status", status), ("stream", "true" if stream else "false")))
+    
+    def _circuit_open_response(self, message: str, context: List[Dict]) -> str:
+        """Con el circuito abierto no se espera al upstream: respuesta en caché o de respaldo"""
+        _, cached = self._cache_lookup(message, context, True)
+        return cached if cached is not None else self._fallback_response(message)
+    
+    def _admission_slot(self, client: str):
+        """Hueco en la cola justa hacia MiniMax (sin límite si UPSTREAM_MAX_CONCURRENCY=0)"""
+        return self.admission.slot(client) if self.admission is not None else nullcontext()
+    
+    def _admitted(self, fetch, client: str) -> str:
+        with self._admission_slot(client):
+            return fetch()
+    
+    def _call_minimax_api(self, message: str, context: List[Dict], use_cache: bool = True, client: str = "") -> str:
+        """Llama a la API de MiniMax para generar respuestas inteligentes"""
+        
+        # Sin API key, o pregunta que la base de conocimientos ya responde
+        local = self._local_answer(message, context)
+        if local is not None:
+            return local
+        
+        with trace_span("cache_lookup"):
+            cache_key, cached = self._cache_lookup(message, context, use_cache)
+        if cached is not None:
+            return cached
+        
         try:
-            # Limpiar mensaje
-            message = user_message.strip()
+            # Solo la llamada real ocupa hueco: quien espera una respuesta en vuelo no hace cola
+            fetch = partial(self._admitted, partial(self._fetch_minimax, message, context, cache_key), client)
+            if self.single_flight is None or cache_key is None:
+                return fetch()
+            # Misma pregunta con el mismo contexto ya en vuelo: esperar esa respuesta
+            return self.single_flight.do(cache_key, fetch)
+            
+        except Overloaded:
+            raise
+        except CircuitOpenError:
+            return self._circuit_open_response(message, context)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error calling MiniMax API: %s", e)
+            return self._fallback_response(message)
+        except TimeoutError as e:
+            logger.error("Timeout esperando a MiniMax: %s", e)
+            return self._fallback_response(message)
+        except Exception as e:
+            logger.error("Unexpected error in MiniMax API: %s", e)
+            return self._fallback_response(message)
+    
+    def _fetch_minimax(self, message: str, context: List[Dict], cache_key: Optional[str]) -> str:
+        """Una llamada real a MiniMax; lanza la excepción si falla"""
+        breaker_token = self._upstream_allowed()
+        if breaker_token is None:
+            raise CircuitOpenError()
+        
+        started = time.monotonic()
+        latency = None
+        status = "error"
+        try:
+            with trace_span("build_request"):
+                headers, body, prompt_size = self._build_request(message, context)
+            
+            # Hacer llamada a la API
+            with trace_span("upstream"):
+                try:
+                    response = self.upstream.post(MINIMAX_API_URL, headers=headers, data=body)
+                except requests.exceptions.Timeout:
+                    status = "timeout"
+                    raise
+                status = str(response.status_code)
+                response.raise_for_status()
+                
+                # Procesar respuesta
+                result = response.json()
+            ai_response = result["choices"][0]["message"]["content"]
+            latency = time.monotonic() - started
+            self._observe_usage(result, prompt_size)
+            
+            logger.info("MiniMax API response: %s chars", len(ai_response), extra={"sampled": True})
+            self._cache_store(cache_key, message, context, ai_response)
+            return ai_response
+        finally:
+            self._record_upstream(latency, started, status, breaker_token)
+    
+    def _stream_minimax_api(self, message: str, context: List[Dict], use_cache: bool = True, client: str = "") -> Iterator[str]:
+        """Llama a MiniMax con "stream": true y devuelve los deltas de texto según llegan"""
+        
+        local = self._local_answer(message, context)
+        if local is not None:
+            yield local
+            return
+        
+        cache_key, cached = self._cache_lookup(message, context, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        
+        # El hueco se ocupa durante todo el stream
+        with self._admission_slot(client):
+            breaker_token = self._upstream_allowed()
+            if breaker_token is None:
+                yield self._circuit_open_response(message, context)
+                return
             
-            # Obtener contexto de conversación
-            context = self._get_conversation_context(session_id)
+            sent = 0
+            parts = []
+            started = time.monotonic()
+            latency = None  # Hasta los headers: la duración total depende del largo de la respuesta
+            status = "error"
+            try:
+                with trace_span("build_request"):
+                    headers, body, _ = self._build_request(message, context, stream=True)
             
-            # Generar respuesta usando MiniMax API
-            response = self._call_minimax_api(message, context)
+                with self.upstream.post(MINIMAX_API_URL, headers=headers, data=body, stream=True) as response:
+                    status = str(response.status_code)
+                    response.raise_for_status()
+                    latency = time.monotonic() - started
+                
+                    for line in response.iter_lines():
+                        delta = self._parse_stream_line(line, sent)
+                        if delta is None:
+                            break
+                        if delta:
+                            sent += len(delta)
+                            parts.append(delta)
+                            yield delta
             
-            # Actualizar historial
-            if session_id not in self.session_data:
-                self.session_data[session_id] = []
+                logger.info("MiniMax API stream: %s chars", sent, extra={"sampled": True})
+                if parts:
+                    self._cache_store(cache_key, message, context, "".join(parts))
             
-            self.session_data[session_id].append({
-                "user": message,
-                "assistant": response,
-                "timestamp": datetime.now().isoformat()
-            })
+            except requests.exceptions.RequestException as e:
+                latency = None
+                if isinstance(e, requests.exceptions.Timeout):
+                    status = "timeout"
+                logger.error("Error streaming MiniMax API: %s", e)
+                if not sent:
+                    yield self._fallback_response(message)
+            except Exception as e:
+                latency = None
+                logger.error("Unexpected error in MiniMax API stream: %s", e)
+                if not sent:
+                    yield self._fallback_response(message)
+            finally:
+                self._record_upstream(latency, started, status, breaker_token, stream=True)
+    
+    @staticmethod
+    def _parse_stream_line(line, sent: int) -> Optional[str]:
+        """
+        Extrae el delta de texto de una línea SSE del upstream ("data: {json}").
+        Devuelve None al recibir "data: [DONE]".
+        """
+        if isinstance(line, str):
+            line = line.encode()
+        if not line or not line.startswith(b"data:"):
+            return ""
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return None
+        
+        choice = json.loads(data)["choices"][0]
+        if "delta" in choice:
+            return choice["delta"].get("content") or ""
+        if not sent and "message" in choice:
+            # Chunk final con el mensaje completo (solo si no hubo deltas)
+            return choice["message"].get("content") or ""
+        return ""
+    
+    # ==================== CAMINO ASYNC (ASGI) ====================
+    # Misma lógica que process_message/stream_message, pero sin bloquear un hilo
+    # mientras MiniMax genera la respuesta. Ver asgi.py.
+    
+    def _get_async_upstream(self) -> "AsyncUpstreamClient":
+        if self.async_upstream is None:
+            self.async_upstream = AsyncUpstreamClient()
+        return self.async_upstream
+    
+    async def aprocess_message(self, user_message: str, session_id: str, use_cache: bool = True, client: str = "") -> Dict:
+        """Versión async de process_message"""
+        bind_log_context(session_id=session_id)
+        try:
+            message = user_message.strip()
+            async with self.async_session_locks.hold(session_id):
+                with trace_span("context"):
+                    context = await self._aget_conversation_context(session_id)
+                with trace_span("generate"):
+                    response = await self._acall_minimax_api(message, context, use_cache, client)
+                with trace_span("record_turn"):
+                    await self._arecord_turn(session_id, message, response)
             
             return {
                 "success": True,
@@ -167,96 +3464,205 @@ class DLLAssistantAI:
                 "timestamp": datetime.now().isoformat()
             }
             
+        except Overloaded:
+            raise
         except Exception as e:
-            logger.error(f"Error procesando mensaje: {str(e)}")
+            logger.error("Error procesando mensaje (async): %s", e)
             return {
                 "success": False,
                 "error": "Error interno del sistema",
                 "response": "Lo siento, ocurrió un error. Por favor intenta de nuevo."
             }
     
-    def _get_conversation_context(self, session_id: str) -> List[Dict]:
-        """Obtiene el contexto de conversación para mantener continuidad"""
-        return self.session_data.get(session_id, [])[-5:]  # Últimos 5 mensajes
+    async def astream_message(self, user_message: str, session_id: str, use_cache: bool = True, client: str = "") -> AsyncIterator[str]:
+        """Versión async de stream_message"""
+        bind_log_context(session_id=session_id)
+        message = user_message.strip()
+        
+        async with self.async_session_locks.hold(session_id):
+            with trace_span("context"):
+                context = await self._aget_conversation_context(session_id)
+            
+            parts = []
+            try:
+                with trace_span("generate"):
+                    async for delta in self._astream_minimax_api(message, context, use_cache, client):
+                        parts.append(delta)
+                        yield delta
+            finally:
+                if parts:
+                    with trace_span("record_turn"):
+                        await self._arecord_turn(session_id, message, "".join(parts))
     
-    def _call_minimax_api(self, message: str, context: List[Dict]) -> str:
-        """Llama a la API de MiniMax para generar respuestas inteligentes"""
+    async def _aget_conversation_context(self, session_id: str) -> List[Dict]:
+        """Acceso async al historial; los almacenes con E/S se leen desde un hilo"""
+        if getattr(self.sessions, "blocking", False):
+            return await asyncio.to_thread(self._get_conversation_context, session_id)
+        return self._get_conversation_context(session_id)
+    
+    async def _arecord_turn(self, session_id: str, message: str, response: str):
+        """Como _aget_conversation_context: con la cola de escritura llena, append espera hasta SESSION_DB_QUEUE_TIMEOUT"""
+        if getattr(self.sessions, "blocking", False):
+            await asyncio.to_thread(self._record_turn, session_id, message, response)
+        else:
+            self._record_turn(session_id, message, response)
+    
+    def _aadmission_slot(self, client: str):
+        return self.async_admission.slot(client) if self.async_admission is not None else nullcontext()
+    
+    async def _aadmitted(self, fetch, client: str) -> str:
+        async with self._aadmission_slot(client):
+            return await fetch()
+    
+    async def _acall_minimax_api(self, message: str, context: List[Dict], use_cache: bool = True, client: str = "") -> str:
+        """Versión async de _call_minimax_api"""
         
-        # Verificar si tenemos API key
-        if not MINIMAX_API_KEY:
-            return self._fallback_response(message)
+        local = self._local_answer(message, context)
+        if local is not None:
+            return local
+        
+        with trace_span("cache_lookup"):
+            cache_key, cached = self._cache_lookup(message, context, use_cache)
+        if cached is not None:
+            return cached
         
         try:
-            # Construir mensajes con contexto
-            messages = [
-                {
-                    "role": "system",
-                    "content": """Eres 'stealth-manager-ai', un asistente especializado en creación, optimización y debugging de DLLs (Dynamic Link Libraries). 
-
-Tus especialidades incluyen:
-- Generación de DLLs en C++, C#, Rust, Assembly, Python extensions
-- Optimizaciones SIMD, memory pooling, multi-threading
-- Debugging avanzado (memory leaks, buffer overflows, stack corruption)
-- Soporte multiplataforma (Windows .dll, Linux .so, macOS .dylib, Android .so)
-- Calling conventions (__stdcall, __cdecl, __fastcall)
-- Técnicas de bypass y stealth para software development
-
-Siempre proporciona:
-- Código de ejemplo funcional cuando sea relevante
-- Explicaciones técnicas precisas
-- Soluciones a problemas específicos
-- Mejores prácticas de desarrollo
-- Consideraciones de seguridad y performance
-
-Responde en español y sé experto, técnico y práctico."""
-                }
-            ]
-            
-            # Agregar contexto de conversación
-            for msg in context:
-                if msg["user"]:
-                    messages.append({"role": "user", "content": msg["user"]})
-                if msg["assistant"]:
-                    messages.append({"role": "assistant", "content": msg["assistant"]})
+            fetch = partial(self._aadmitted, partial(self._afetch_minimax, message, context, cache_key), client)
+            if self.async_single_flight is None or cache_key is None:
+                return await fetch()
+            return await self.async_single_flight.do(cache_key, fetch)
             
-            # Agregar mensaje actual
-            messages.append({"role": "user", "content": message})
+        except Overloaded:
+            raise
+        except CircuitOpenError:
+            return self._circuit_open_response(message, context)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error calling MiniMax API (async): %s", e)
+            return self._fallback_response(message)
+        except Exception as e:
+            logger.error("Unexpected error in MiniMax API (async): %s", e)
+            return self._fallback_response(message)
+    
+    async def _afetch_minimax(self, message: str, context: List[Dict], cache_key: Optional[str]) -> str:
+        """Versión async de _fetch_minimax"""
+        breaker_token = self._upstream_allowed()
+        if breaker_token is None:
+            raise CircuitOpenError()
+        
+        started = time.monotonic()
+        latency = None
+        status = "error"
+        try:
+            with trace_span("build_request"):
+                headers, body, prompt_size = self._build_request(message, context)
             
-            # Headers para la API
-            headers = {
-                "Authorization": f"Bearer {MINIMAX_API_KEY}",
-                "Content-Type": "application/json"
-            }
+            with trace_span("upstream"):
+                try:
+                    result = await self._get_async_upstream().post_json(MINIMAX_API_URL, headers=headers, data=body)
+                except aiohttp.ClientResponseError as e:
+                    status = str(e.status)
+                    raise
+                except asyncio.TimeoutError:
+                    status = "timeout"
+                    raise
+            status = "200"
+            ai_response = result["choices"][0]["message"]["content"]
+            latency = time.monotonic() - started
+            self._observe_usage(result, prompt_size)
             
-            # Payload para MiniMax API
-            payload = {
-                "model": "minimax-m2",
-                "messages": messages,
-                "max_tokens": 2000,
-                "temperature": 0.7,
-                "stream": False
-            }
+            logger.info("MiniMax API response (async): %s chars", len(ai_response), extra={"sampled": True})
+            self._cache_store(cache_key, message, context, ai_response)
+            return ai_response
+        finally:
+            self._record_upstream(latency, started, status, breaker_token)
+    
+    async def _astream_minimax_api(self, message: str, context: List[Dict], use_cache: bool = True, client: str = "") -> AsyncIterator[str]:
+        """Versión async de _stream_minimax_api"""
+        
+        local = self._local_answer(message, context)
+        if local is not None:
+            yield local
+            return
+        
+        cache_key, cached = self._cache_lookup(message, context, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        
+        async with self._aadmission_slot(client):
+            breaker_token = self._upstream_allowed()
+            if breaker_token is None:
+                yield self._circuit_open_response(message, context)
+                return
             
-            # Hacer llamada a la API
-            response = requests.post(MINIMAX_API_URL, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
+            sent = 0
+            parts = []
+            started = time.monotonic()
+            latency = None
+            status = "error"
+            try:
+                with trace_span("build_request"):
+                    headers, body, _ = self._build_request(message, context, stream=True)
             
-            # Procesar respuesta
-            result = response.json()
-            ai_response = result["choices"][0]["message"]["content"]
+                async with self._get_async_upstream().stream(MINIMAX_API_URL, headers=headers, data=body) as response:
+                    status = str(response.status)
+                    latency = time.monotonic() - started
+                    async for line in response.content:
+                        delta = self._parse_stream_line(line, sent)
+                        if delta is None:
+                            break
+                        if delta:
+                            sent += len(delta)
+                            parts.append(delta)
+                            yield delta
             
-            logger.info(f"MiniMax API response: {len(ai_response)} chars")
-            return ai_response
+                logger.info("MiniMax API stream (async): %s chars", sent, extra={"sampled": True})
+                if parts:
+                    self._cache_store(cache_key, message, context, "".join(parts))
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error calling MiniMax API: {str(e)}")
-            return self._fallback_response(message)
-        except Exception as e:
-            logger.error(f"Unexpected error in MiniMax API: {str(e)}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                latency = None
+                if isinstance(e, aiohttp.ClientResponseError):
+                    status = str(e.status)
+                elif isinstance(e, asyncio.TimeoutError):
+                    status = "timeout"
+                logger.error("Error streaming MiniMax API (async): %s", e)
+                if not sent:
+                    yield self._fallback_response(message)
+            except Exception as e:
+                latency = None
+                logger.error("Unexpected error in MiniMax API stream (async): %s", e)
+                if not sent:
+                    yield self._fallback_response(message)
+            finally:
+                self._record_upstream(latency, started, status, breaker_token, stream=True)
+    
+    def _local_answer(self, message: str, context: List[Dict]) -> Optional[str]:
+        """Respuesta sin llamar a MiniMax: sin API key, o (LOCAL_ANSWERS=always) preguntas cortas de la base de conocimientos"""
+        if not MINIMAX_API_KEY:
             return self._fallback_response(message)
+        if LOCAL_ANSWERS != 'always' or context or len(message.split()) > LOCAL_ANSWER_MAX_WORDS:
+            return None
+        
+        route = self.intent_router.classify(message)
+        if route not in IntentRouter.LOCAL_ROUTES:
+            return None
+        self.local_answers += 1
+        return self._canned[route]
     
     def _fallback_response(self, message: str) -> str:
         """Respuesta de respaldo cuando no está disponible MiniMax API"""
+        if LOCAL_ANSWERS != 'off':
+            # Si la pregunta es de la base de conocimientos, responder con ella
+            route = self.intent_router.classify(message)
+            if route != IntentRouter.DEFAULT_ROUTE:
+                self.local_answers += 1
+                if metrics is not None:
+                    metrics.inc("minimax_fallback_responses_total", (("kind", "knowledge"),))
+                return self._canned[route]
+        
+        if metrics is not None:
+            metrics.inc("minimax_fallback_responses_total", (("kind", "generic"),))
         return f"""
 🤖 **stealth-manager-ai - Sistema IA**
 
@@ -278,54 +3684,54 @@ Intenta preguntas como:
 ¡Espero que la conexión se restaure pronto!
         """
     
-    def _generate_specialized_response(self, message: str, query_type: str) -> str:
-        """Genera respuesta especializada basada en el tipo de consulta"""
-        
-        responses = {
-            "generacion": self._handle_generation_query(message),
-            "optimizacion": self._handle_optimization_query(message),
-            "debug": self._handle_debug_query(message),
-            "ejemplo": self._handle_example_query(message),
-            "conceptos": self._handle_concept_query(message),
-            "ayuda": self._handle_help_query(message),
-            "general": self._handle_general_query(message)
+    def _render_canned_responses(self) -> Dict:
+        """Renderiza una vez todas las respuestas locales: (intención, variante) -> texto"""
+        handlers = {
+            "generacion": self._handle_generation_query,
+            "optimizacion": self._handle_optimization_query,
+            "debug": self._handle_debug_query,
+            "ejemplo": self._handle_example_query,
+            "conceptos": self._handle_concept_query,
+            "ayuda": self._handle_help_query,
+            "general": self._handle_general_query
         }
-        
-        return responses.get(query_type, responses["general"])
+        return {(intent, variant): handlers[intent](variant) for intent, variant in IntentRouter.routes()}
+    
+    def _generate_specialized_response(self, message: str, query_type: Optional[str] = None) -> str:
+        """Genera respuesta especializada basada en el tipo de consulta (query_type fuerza el handler)"""
+        route = self.intent_router.classify(message)
+        if query_type is not None and route[0] != query_type:
+            route = (query_type, "default")
+        return self._canned.get(route, self._canned[("general", "default")])
     
-    def _handle_generation_query(self, message: str) -> str:
+    def _handle_generation_query(self, variant: str) -> str:
         """Maneja consultas sobre generación de DLLs"""
         
-        if "tipos" in message or "tipo" in message:
+        if variant == "tipos":
             types_info = self.knowledge_base["generacion"]["tipos_dlls"]
-            response = "🔧 **Tipos de DLLs que puedo crear:**\n\n"
-            for dll_type, description in types_info.items():
-                response += f"**{dll_type.title()} DLLs:** {description}\n\n"
-            return response
-        
-        elif ("matemática" in message or "math" in message or "suma" in message or 
-              "multiplicación" in message or "multiply" in message) and "dll" in message:
-            print(f"[DEBUG] Detected math DLL request: {message}")  # Debug
-            return self._generate_math_dll_code(message)
+            return "🔧 **Tipos de DLLs que puedo crear:**\n\n" + "".join(
+                f"**{dll_type.title()} DLLs:** {description}\n\n" for dll_type, description in types_info.items()
+            )
+        
+        elif variant == "math":
+            return self._generate_math_dll_code()
             
-        elif "lenguaje" in message or (("c++" in message or "#" in message) and "dll" in message and 
-              "matemática" not in message and "math" not in message and "suma" not in message):
+        elif variant == "lenguajes":
             langs = self.knowledge_base["generacion"]["lenguajes"]
             platforms = self.knowledge_base["generacion"]["plataformas"]
             
-            response = "💻 **Lenguajes y plataformas soportadas:**\n\n"
-            response += "**Lenguajes:** " + ", ".join(langs) + "\n\n"
-            response += "**Plataformas:**\n"
-            for platform, format_info in platforms.items():
-                response += f"• {platform.title()}: {format_info}\n"
-            return response
-        
-        elif "calling convention" in message or "stdcall" in message:
+            return (
+                "💻 **Lenguajes y plataformas soportadas:**\n\n"
+                "**Lenguajes:** " + ", ".join(langs) + "\n\n"
+                "**Plataformas:**\n"
+                + "".join(f"• {platform.title()}: {format_info}\n" for platform, format_info in platforms.items())
+            )
+        
+        elif variant == "calling_conventions":
             conv = self.knowledge_base["generacion"]["calling_conventions"]
-            response = "📋 **Calling Conventions disponibles:**\n\n"
-            for convention, description in conv.items():
-                response += f"**{convention}:** {description}\n\n"
-            return response
+            return "📋 **Calling Conventions disponibles:**\n\n" + "".join(
+                f"**{convention}:** {description}\n\n" for convention, description in conv.items()
+            )
         
         else:
             return """
@@ -344,7 +3750,7 @@ Puedo crear diferentes tipos de bibliotecas dinámicas:
 Ej: "Crea una DLL de criptografía en C++" o "Necesito una DLL de red para Windows"
             """
     
-    def _generate_math_dll_code(self, message: str) -> str:
+    def _generate_math_dll_code(self) -> str:
         """Genera código DLL con funciones matemáticas específicas"""
         
         return """
@@ -418,12 +3824,12 @@ cl /LD MathOperations.cpp /Fe:MathOperations.dll
 **¿Necesitas compilación para otro sistema o más funciones matemáticas?**
         """
     
-    def _handle_optimization_query(self, message: str) -> str:
+    def _handle_optimization_query(self, variant: str) -> str:
         """Maneja consultas sobre optimización"""
         
         optimizations = self.knowledge_base["optimizaciones"]
         
-        if "simd" in message:
+        if variant == "simd":
             return f"""
 ⚡ **Optimización SIMD:**
 
@@ -444,7 +3850,7 @@ for (int i = 0; i + 3 < size; i += 4) {{
 • Ideal para cálculos matemáticos intensivos
             """
         
-        elif "memory" in message and "pool" in message:
+        elif variant == "memory_pool":
             return f"""
 🧠 **Memory Pooling:**
 
@@ -477,15 +3883,14 @@ public:
             """
         
         else:
-            response = "🚀 **Optimizaciones disponibles:**\n\n"
-            for opt_type, description in optimizations.items():
-                response += f"**{opt_type.upper()}:** {description}\n\n"
-            return response
+            return "🚀 **Optimizaciones disponibles:**\n\n" + "".join(
+                f"**{opt_type.upper()}:** {description}\n\n" for opt_type, description in optimizations.items()
+            )
     
-    def _handle_debug_query(self, message: str) -> str:
+    def _handle_debug_query(self, variant: str) -> str:
         """Maneja consultas sobre debugging"""
         
-        if "memory leak" in message or "leak" in message:
+        if variant == "leak":
             return f"""
 🔍 **Detección de Memory Leaks:**
 
@@ -517,7 +3922,7 @@ void safeFunction() {{
 • Intel Inspector
             """
         
-        elif "buffer overflow" in message or "overflow" in message:
+        elif variant == "overflow":
             return f"""
 🚨 **Buffer Overflow Detection:**
 
@@ -543,19 +3948,18 @@ for (int i = 0; i < size; i++) {{  // Proper bounds check
         
         else:
             debug_info = self.knowledge_base["debugging"]
-            response = "🔧 **Debugging y Troubleshooting:**\n\n"
-            response += "**Errores comunes:**\n"
-            for error in debug_info["errores_comunes"]:
-                response += f"• {error}\n"
-            response += "\n**Herramientas:**\n"
-            for tool in debug_info["herramientas"]:
-                response += f"• {tool}\n"
-            return response
-    
-    def _handle_example_query(self, message: str) -> str:
+            return (
+                "🔧 **Debugging y Troubleshooting:**\n\n"
+                "**Errores comunes:**\n"
+                + "".join(f"• {error}\n" for error in debug_info["errores_comunes"])
+                + "\n**Herramientas:**\n"
+                + "".join(f"• {tool}\n" for tool in debug_info["herramientas"])
+            )
+    
+    def _handle_example_query(self, variant: str) -> str:
         """Maneja solicitudes de ejemplos de código"""
         
-        if "basic" in message or "basica" in message or "simple" in message:
+        if variant == "basica":
             return f"""
 📝 **Ejemplo DLL Básica:**
 
@@ -586,7 +3990,7 @@ BOOL APIENTRY DllMain(HMODULE hModule,
 `cl /LD MathOperations.cpp /Fe:MathOperations.dll`
             """
         
-        elif "error" in message and "comun" in message:
+        elif variant == "error_comun":
             examples = self.knowledge_base["ejemplos_codigo"]
             return f"""
 ❌ **Error Común vs Solución:**
@@ -615,10 +4019,10 @@ BOOL APIENTRY DllMain(HMODULE hModule,
 **¿Qué ejemplo específico necesitas?**
             """
     
-    def _handle_concept_query(self, message: str) -> str:
+    def _handle_concept_query(self, variant: str) -> str:
         """Maneja consultas conceptuales"""
         
-        if "dll" in message and "que es" in message:
+        if variant == "que_es_dll":
             return """
 🎯 **¿Qué es una DLL?**
 
@@ -638,7 +4042,7 @@ Una **Dynamic Link Library (DLL)** es:
 **Ejemplo:** `kernel32.dll` de Windows - muchas apps la usan
             """
         
-        elif "calling convention" in message:
+        elif variant == "calling_convention":
             return """
 📋 **Calling Conventions - ¿Qué son?**
 
@@ -672,7 +4076,7 @@ __cdecl:   Func(param3, param2, param1) // right-to-left
 **¿Qué concepto específico te interesa explorar?**
             """
     
-    def _handle_help_query(self, message: str) -> str:
+    def _handle_help_query(self, variant: str) -> str:
         """Maneja consultas de ayuda general"""
         
         return """
@@ -704,10 +4108,10 @@ __cdecl:   Func(param3, param2, param1) // right-to-left
 **¿Qué necesitas hoy?**
         """
     
-    def _handle_general_query(self, message: str) -> str:
+    def _handle_general_query(self, variant: str) -> str:
         """Maneja consultas generales"""
         
-        if any(greeting in message for greeting in ["hola", "hi", "hey", "buenas"]):
+        if variant == "saludo":
             return """
 👋 **¡Hola! Bienvenido a xpe.manager.ai**
 
@@ -749,26 +4153,347 @@ Soy tu asistente especializado en **creación, debugging y optimización de DLLs
 # Instancia global de la IA
 ai_assistant = DLLAssistantAI()
 
+# Frontend servido desde memoria
+static_assets = AssetManifest(app.root_path)
+upstream_prober = UpstreamProber() if HEALTH_PROBE_ENABLED and MINIMAX_API_KEY else None
+session_limiter = TokenBucketLimiter(SESSION_RATE_LIMIT, SESSION_RATE_BURST) if SESSION_RATE_LIMIT > 0 else None
+ip_limiter = TokenBucketLimiter(IP_RATE_LIMIT, IP_RATE_BURST) if IP_RATE_LIMIT > 0 else None
+
+
+def client_address(remote_addr: Optional[str], forwarded_for: Optional[str]) -> Optional[str]:
+    """
+    IP del cliente en la que se puede confiar, o None. Con TRUSTED_PROXY_HOPS=N, la N-ésima entrada
+    de X-Forwarded-For por la derecha (la que escribió nuestro proxy más externo). Sin proxies
+    declarados, remote_addr, salvo que llegue X-Forwarded-For: entonces remote_addr es un proxy
+    compartido por todos los usuarios y no identifica a nadie.
+    """
+    if TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+        return hops[-TRUSTED_PROXY_HOPS] if len(hops) >= TRUSTED_PROXY_HOPS else None
+    if forwarded_for:
+        return None
+    return remote_addr or None
+
+
+def admission_flow(client: Optional[str], session_id: str) -> str:
+    """Flujo de la cola justa hacia MiniMax: la IP del cliente, o su sesión si no hay IP fiable"""
+    return client if client else f"session:{session_id}"
+
+
+def check_rate_limits(session_id: str, client: Optional[str]):
+    """
+    Token buckets por sesión y por IP (sin IP fiable solo el de sesión); lanza Overloaded con el
+    tiempo hasta el próximo token
+    """
+    for reason, limiter, key in (("session_rate", session_limiter, session_id), ("ip_rate", ip_limiter, client)):
+        if limiter is None or key is None:
+            continue
+        wait = limiter.take(key)
+        if wait:
+            if metrics is not None:
+                metrics.inc("admission_rejections_total", (("reason", reason),))
+            raise Overloaded(reason, wait)
+
+
+def overloaded_body(error: Overloaded) -> Dict:
+    return {
+        "success": False,
+        "error": "Servicio saturado, reintenta más tarde",
+        "retry_after": math.ceil(error.retry_after)
+    }
+
+
+def admission_stats() -> Dict:
+    return {
+        "threads": ai_assistant.admission.stats() if ai_assistant.admission else None,
+        "async": ai_assistant.async_admission.stats() if ai_assistant.async_admission else None,
+        "session_rate_limit": session_limiter.stats() if session_limiter else None,
+        "ip_rate_limit": ip_limiter.stats() if ip_limiter else None
+    }
+
+
+def new_request_id(incoming: Optional[str]) -> str:
+    """X-Request-Id del cliente o proxy (acotado), o uno nuevo"""
+    return incoming[:64] if incoming else os.urandom(8).hex()
+
+
+@app.before_request
+def _bind_request_id():
+    request_id = new_request_id(request.headers.get("X-Request-Id"))
+    request.environ["request_id"] = request_id
+    # Contexto nuevo por petición: el hilo puede venir de una petición anterior
+    _log_context.set({"request_id": request_id})
+
+
+@app.after_request
+def _request_id_header(response):
+    response.headers["X-Request-Id"] = request.environ.get("request_id", "")
+    return response
+
+
+class WarmUp:
+    """
+    Arranque de un worker en dos fases. prepare(): cachés precalculadas y gc.freeze(); con
+    preload_app de gunicorn corre una vez en el master y los workers heredan esa memoria por
+    copy-on-write. run(): además abre las conexiones keep-alive hacia MiniMax, que son de cada
+    worker (los sockets no se comparten entre procesos). /api/ready responde 503 hasta entonces.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prepared_s = None
+        self.booted = _import_started
+        self._reset()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.booted = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.ready = False
+        self.ready_s = None
+        self.connections = None
+        self._thread = None
+
+    def prepare(self):
+        """Idempotente: lo que no depende del proceso se calcula una sola vez"""
+        with self._lock:
+            if self.prepared_s is not None:
+                return
+            ai_assistant.knowledge_body()
+            ai_assistant.intent_router.classify("warm-up")
+            ai_assistant._build_request("warm-up", [])
+            # Objetos de larga vida fuera del GC: sus recolecciones no tocan (ni copian) esas páginas
+            gc.collect()
+            gc.freeze()
+            self.prepared_s = time.monotonic() - _import_started
+
+    def run(self):
+        self.prepare()
+        opened = ai_assistant.upstream.warm(MINIMAX_API_URL, WARMUP_CONNECTIONS) \
+            if MINIMAX_API_KEY and WARMUP_CONNECTIONS > 0 else 0
+        self.mark_ready(opened)
+
+    def mark_ready(self, connections: int):
+        self.connections = connections
+        self.ready_s = time.monotonic() - self.booted
+        self.ready = True
+        if upstream_prober is not None:
+            upstream_prober.ensure_started()
+        logger.info("Worker %s listo en %.0f ms (%s conexiones a MiniMax)", os.getpid(), self.ready_s * 1000, connections)
+
+    def start_background(self):
+        """Sin el hook post_fork (gunicorn sin gunicorn.conf.py) el primer sondeo de /api/ready arranca el calentamiento"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self._thread.start()
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            "prepare_ms": round(self.prepared_s * 1000, 1) if self.prepared_s is not None else None,
+            "cold_start_ms": round(self.ready_s * 1000, 1) if self.ready_s is not None else None,
+            "upstream_connections": self.connections
+        }
+
+
+warm_up = WarmUp()
+
+
+_http_labels = {}  # (ruta, método, estado) -> labels ya construidos (cardinalidad acotada por las reglas de URL)
+
+
+def record_http_request(route: str, method: str, status: str, elapsed: float, bytes_in: int, bytes_out: Optional[int]):
+    """Métricas de una petición atendida (Flask o asgi.py)"""
+    labels = _http_labels.get((route, method, status))
+    if labels is None:
+        labels = _http_labels[(route, method, status)] = (
+            (("route", route), ("method", method), ("status", status)), (("route", route),)
+        )
+    request_labels, route_labels = labels
+    metrics.inc("http_requests_total", request_labels)
+    metrics.observe("http_request_duration_seconds", elapsed, route_labels)
+    if bytes_in:
+        metrics.inc("http_request_bytes_total", route_labels, bytes_in)
+    if bytes_out:
+        metrics.inc("http_response_bytes_total", route_labels, bytes_out)
+
+
+if metrics is not None:
+    metrics.gauge("sessions_active", "Sesiones con historial en el almacén", lambda: len(ai_assistant.sessions))
+    _schedulers = [scheduler for scheduler in (ai_assistant.admission, ai_assistant.async_admission) if scheduler]
+    metrics.gauge("upstream_queue_depth", "Peticiones esperando hueco hacia MiniMax",
+                  lambda: sum(scheduler.depth for scheduler in _schedulers))
+    metrics.gauge("upstream_slots_in_use", "Llamadas a MiniMax en curso bajo el control de admisión",
+                  lambda: sum(scheduler.in_use for scheduler in _schedulers))
+    if upstream_prober is not None:
+        metrics.gauge("minimax_upstream_up", "1 si la última sonda a MiniMax respondió",
+                      lambda: 1 if upstream_prober.status()["reachable"] else 0)
+        metrics.gauge("minimax_probe_latency_p50_seconds", "Mediana de la latencia de las sondas recientes a MiniMax",
+                      lambda: (upstream_prober.status()["p50_ms"] or 0) / 1000)
+
+    @app.before_request
+    def _metrics_start():
+        request.environ["metrics.started"] = time.perf_counter()
+        metrics.inc("http_requests_in_flight")
+
+    @app.after_request
+    def _metrics_record(response):
+        # Lecturas desde environ: cada acceso a `request` pasa por el proxy de contexto
+        environ = request.environ
+        rule = request.url_rule
+        now = time.perf_counter()
+        elapsed = now - environ.get("metrics.started", now)
+        record_http_request(rule.rule if rule is not None else "unmatched", environ["REQUEST_METHOD"],
+                            str(response.status_code), elapsed, int(environ.get("CONTENT_LENGTH") or 0),
+                            int(response.headers.get("Content-Length") or 0))
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        # En streaming, al terminar de enviar el cuerpo
+        metrics.inc("http_requests_in_flight", value=-1)
+
+
+# Endpoints con trazas y perfiles (las etapas instrumentadas con trace_span)
+TRACED_ENDPOINTS = frozenset(("chat_endpoint", "chat_stream_endpoint"))
+
+if tracer is not None or profiler is not None:
+    @app.before_request
+    def _trace_start():
+        if request.endpoint not in TRACED_ENDPOINTS:
+            return
+        environ = request.environ
+        forced = profiler is not None and profiler.authorized(request.headers.get("X-Profile"))
+        if tracer is not None:
+            environ["trace"] = tracer.start(request.endpoint, force=forced, method=request.method, path=request.path)
+        if profiler is not None:
+            profile = profiler.start(forced)
+            if profile is not None:
+                environ["trace.profile"] = (profile, forced, time.perf_counter())
+
+    @app.after_request
+    def _trace_response(response):
+        started = request.environ.get("trace")
+        if started is not None:
+            started[0].attrs["status"] = response.status_code
+            response.headers["X-Trace-Id"] = f"{started[0].trace_id:x}"
+        return response
+
+    @app.teardown_request
+    def _trace_finish(exc):
+        # En streaming, al terminar de enviar el cuerpo: la traza cubre toda la respuesta
+        environ = request.environ
+        started = environ.pop("trace", None)
+        profiled = environ.pop("trace.profile", None)
+        path = None
+        if profiled is not None:
+            profile, forced, profile_started = profiled
+            path = profiler.finish(profile, forced, time.perf_counter() - profile_started, request.endpoint)
+        if started is not None:
+            started[0].profile = path
+            tracer.finish(started)
+
 # Endpoints de la API
+@app.route('/api/ready', methods=['GET'])
+def ready_check():
+    """Readiness para el balanceador: 503 hasta que este worker tiene cachés y conexiones listas"""
+    if not warm_up.ready:
+        warm_up.start_background()
+        return jsonify(dict(warm_up.stats(), success=False)), 503
+    return jsonify(dict(warm_up.stats(), success=True))
+
+def degraded_reason() -> Optional[str]:
+    """Por qué las respuestas salen (o saldrán) sin MiniMax, o None si el upstream está operativo"""
+    if not MINIMAX_API_KEY:
+        return "not_configured"
+    breaker = ai_assistant.circuit_breaker
+    if breaker is not None and breaker.state == breaker.OPEN:
+        return "circuit_open"
+    if upstream_prober is not None and upstream_prober.down:
+        return "upstream_unreachable"
+    return None
+
+
+def minimax_status(degraded: Optional[str], upstream: Optional[Dict]) -> str:
+    if degraded == "not_configured":
+        return "❌ Not configured"
+    if degraded:
+        return f"⚠️ Degraded ({degraded})"
+    if upstream is not None and upstream["reachable"] is None:
+        return "⏳ Checking"
+    return "✅ Connected"
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Endpoint de salud del sistema"""
+    """
+    Endpoint de salud del sistema. El estado de MiniMax sale del sondeo en segundo plano
+    (nunca se llama al upstream aquí); con ?strict=1 responde 503 mientras está degradado.
+    """
+    if upstream_prober is not None:
+        upstream_prober.ensure_started()
+    upstream = upstream_prober.status() if upstream_prober is not None else None
+    degraded = degraded_reason()
     return jsonify({
-        "status": "healthy",
+        "status": "degraded" if degraded else "healthy",
         "service": "stealth-manager-ai",
         "version": "2.0.0",
         "timestamp": datetime.now().isoformat(),
         "specialization": "DLL Development, Stealth Operations & AI",
-        "minimax_api": "✅ Connected" if MINIMAX_API_KEY else "❌ Not configured",
+        "minimax_api": minimax_status(degraded, upstream),
+        "degraded": degraded is not None,
+        "degraded_reason": degraded,
+        "upstream_health": upstream,
+        "upstream_pool": ai_assistant.upstream.pool_stats(),
+        "response_cache": ai_assistant.response_cache.stats() if ai_assistant.response_cache else None,
+        "similarity_cache": ai_assistant.similarity_cache.stats() if ai_assistant.similarity_cache else None,
+        "sessions": ai_assistant.sessions.stats(),
+        "context_builder": ai_assistant.context_builder.stats(),
+        "circuit_breaker": ai_assistant.circuit_breaker.stats() if ai_assistant.circuit_breaker else None,
+        "knowledge_index": ai_assistant.knowledge_index.stats() if ai_assistant.knowledge_index else None,
+        "local_answers": dict(ai_assistant.intent_router.stats(), served=ai_assistant.local_answers),
+        "single_flight": {
+            "threads": ai_assistant.single_flight.stats(),
+            "async": ai_assistant.async_single_flight.stats()
+        } if ai_assistant.single_flight else None,
+        "admission": admission_stats(),
+        "static_assets": static_assets.stats(),
+        "logging": log_handler.stats(),
+        "warm_up": warm_up.stats(),
         "port": int(os.environ.get('PORT', 9000)),
         "environment": os.environ.get('FLASK_ENV', 'production')
-    })
+    }), 503 if degraded and request.args.get('strict') == '1' else 200
+
+def wants_cached_response(data: Dict, cache_control: Optional[str]) -> bool:
+    """El cliente puede pedir salida no determinista con {"cache": false} o Cache-Control: no-cache"""
+    if data.get('cache', True) is False:
+        return False
+    directives = (cache_control or "").lower()
+    return "no-cache" not in directives and "no-store" not in directives
+
+def parse_session_id(value) -> Optional[str]:
+    """session_id del cuerpo: sin él, 'default'; los números se aceptan como texto; otro tipo, None (400)"""
+    if value is None:
+        return 'default'
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+INVALID_SESSION_BODY = {"success": False, "error": "session_id inválido"}
 
 @app.route('/api/chat', methods=['POST'])
 def chat_endpoint():
     """Endpoint principal para chat con la IA"""
     try:
-        data = request.get_json()
+        with trace_span("parse_json"):
+            data = request.get_json()
         
         if not data or 'message' not in data:
             return jsonify({
@@ -777,55 +4502,294 @@ def chat_endpoint():
             }), 400
         
         user_message = data['message']
-        session_id = data.get('session_id', 'default')
+        session_id = parse_session_id(data.get('session_id'))
+        if session_id is None:
+            return jsonify(INVALID_SESSION_BODY), 400
+        client = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        check_rate_limits(session_id, client)
         
         # Procesar mensaje con la IA
-        result = ai_assistant.process_message(user_message, session_id)
+        use_cache = wants_cached_response(data, request.headers.get('Cache-Control'))
+        with trace_span("process_message"):
+            result = ai_assistant.process_message(user_message, session_id, use_cache, admission_flow(client, session_id))
         
-        return jsonify(result)
+        with trace_span("serialize"):
+            return jsonify(result)
         
+    except Overloaded as e:
+        return jsonify(overloaded_body(e)), 429, {"Retry-After": str(math.ceil(e.retry_after))}
     except Exception as e:
-        logger.error(f"Error en chat endpoint: {str(e)}")
+        logger.error("Error en chat endpoint: %s", e)
         return jsonify({
             "success": False,
             "error": "Error interno del servidor"
         }), 500
 
+def _sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """Formatea un evento Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Chat con la IA en modo streaming (SSE): envía los tokens según los genera MiniMax"""
+    data = request.get_json(silent=True)
+
+    if not data or 'message' not in data:
+        return jsonify({
+            "success": False,
+            "error": "Mensaje requerido"
+        }), 400
+
+    user_message = data['message']
+    session_id = parse_session_id(data.get('session_id'))
+    if session_id is None:
+        return jsonify(INVALID_SESSION_BODY), 400
+    use_cache = wants_cached_response(data, request.headers.get('Cache-Control'))
+    client = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    try:
+        check_rate_limits(session_id, client)
+    except Overloaded as e:
+        return jsonify(overloaded_body(e)), 429, {"Retry-After": str(math.ceil(e.retry_after))}
+
+    def generate():
+        try:
+            for delta in ai_assistant.stream_message(user_message, session_id, use_cache, admission_flow(client, session_id)):
+                yield _sse_event({"delta": delta})
+            yield _sse_event({
+                "success": True,
+                "session_id": session_id,
+                "timestamp": datetime.now().isoformat()
+            }, event="done")
+        except Overloaded as e:
+            # La cola se resuelve ya con el stream abierto: el 429 va como evento
+            yield _sse_event(overloaded_body(e), event="error")
+        except Exception as e:
+            logger.error("Error en chat stream: %s", e)
+            yield _sse_event({
+                "success": False,
+                "error": "Error interno del servidor"
+            }, event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evitar buffering en proxies (nginx)
+        }
+    )
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def batch_executor() -> ThreadPoolExecutor:
+    """Pool acotado de /api/chat/batch; se crea con el primer lote (después del fork de gunicorn)"""
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="chat-batch")
+    return _batch_executor
+
+
+def _batch_session(item) -> Optional[str]:
+    """session_id de un elemento del lote (como en /api/chat), o None si el elemento o el session_id no son válidos"""
+    return parse_session_id(item.get('session_id')) if isinstance(item, dict) else None
+
+
+def _batch_item_result(item, use_cache: bool, client: Optional[str]) -> Dict:
+    """Un mensaje del lote; los errores quedan en su resultado y no cortan el resto"""
+    if not isinstance(item, dict) or not isinstance(item.get('message'), str):
+        return {"success": False, "error": "Mensaje requerido"}
+    session_id = _batch_session(item)
+    if session_id is None:
+        return dict(INVALID_SESSION_BODY)
+    try:
+        check_rate_limits(session_id, client)
+        return ai_assistant.process_message(item['message'], session_id, use_cache, admission_flow(client, session_id))
+    except Overloaded as e:
+        return overloaded_body(e)
+    except Exception as e:
+        logger.error("Error en elemento de lote: %s", e)
+        return {
+            "success": False,
+            "error": "Error interno del servidor",
+            "response": ai_assistant._fallback_response(item['message'])
+        }
+
+
+def run_batch(items: List, use_cache: bool, client: Optional[str]) -> Iterator[tuple]:
+    """
+    Reparte el lote en batch_executor() y devuelve (índice, resultado) según terminan.
+    Los mensajes de una misma sesión van en orden en una sola tarea (el historial de cada
+    turno ve el anterior); sesiones distintas corren en paralelo. Si el consumidor deja de
+    leer (cliente desconectado), los mensajes aún no empezados se descartan.
+    """
+    by_session = {}
+    for index, item in enumerate(items):
+        by_session.setdefault(_batch_session(item), []).append(index)
+
+    done = queue.Queue()
+    abandoned = threading.Event()
+
+    def run_session(indexes: List[int]):
+        for index in indexes:
+            if abandoned.is_set():
+                return
+            done.put((index, _batch_item_result(items[index], use_cache, client)))
+
+    executor = batch_executor()
+    for indexes in by_session.values():
+        # Cada tarea hereda el contexto de la petición (request_id en los logs)
+        executor.submit(contextvars.copy_context().run, run_session, indexes)
+    try:
+        for _ in range(len(items)):
+            yield done.get()
+    finally:
+        abandoned.set()
+
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch_endpoint():
+    """
+    Varios mensajes en una petición: {"items": [{"message", "session_id"}, ...]}.
+    Respuesta con los resultados en el orden de entrada, o `format=ndjson` para recibir
+    cada resultado (con su "index") en cuanto termina.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            "success": False,
+            "error": "Lista de mensajes requerida"
+        }), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            "error": f"Máximo {BATCH_MAX_ITEMS} mensajes por lote"
+        }), 400
+
+    use_cache = wants_cached_response(data, request.headers.get('Cache-Control'))
+    client = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for index, result in run_batch(items, use_cache, client):
+                yield json.dumps(dict(result, index=index), ensure_ascii=False) + "\n"
+
+        return Response(generate(), content_type="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    results = [None] * len(items)
+    for index, result in run_batch(items, use_cache, client):
+        results[index] = result
+    return jsonify({
+        "success": True,
+        "count": len(results),
+        "results": results
+    })
+
+def _session_export(store, session_id: str, after: int) -> Iterator[str]:
+    """Historial en NDJSON, leído por bloques: nunca se construye el cuerpo completo en memoria"""
+    more = True
+    while more:
+        turns, more = store.page(session_id, after=after, limit=SESSION_EXPORT_CHUNK)
+        for seq, turn in turns:
+            yield json.dumps(dict(public_turn(turn), cursor=seq)) + "\n"
+            after = seq
+
+
 @app.route('/api/sessions/<session_id>', methods=['GET'])
 def get_session(session_id):
-    """Obtener historial de sesión"""
+    """
+    Obtener historial de sesión. `limit` + `cursor` paginan hacia atrás desde el turno más reciente;
+    `since=<cursor>` devuelve solo los turnos nuevos; `format=ndjson` exporta el historial en streaming.
+    ETag por versión de la sesión: sin turnos nuevos, 304.
+    """
+    store = ai_assistant.sessions
     try:
-        session_data = ai_assistant.session_data.get(session_id, [])
-        return jsonify({
-            "success": True,
-            "session_id": session_id,
-            "history": session_data
-        })
+        before = request.args.get('cursor', type=int)
+        since = request.args.get('since', type=int)
+        limit = request.args.get('limit', type=int)
+        if request.args.get('cursor') and before is None or request.args.get('since') and since is None \
+                or request.args.get('limit') and (limit is None or limit < 1):
+            return jsonify({
+                "success": False,
+                "error": "Parámetros de paginación inválidos"
+            }), 400
+
+        version = store.version(session_id)
+        etag = hashlib.sha256(f"{session_id}|{version}|".encode("utf-8", "surrogatepass") + request.query_string).hexdigest()[:32]
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        elif request.args.get('format') == 'ndjson':
+            response = Response(_session_export(store, session_id, since or 0), content_type="application/x-ndjson")
+        else:
+            limit = min(limit or store.max_turns, max(store.max_turns, SESSION_PAGE_MAX))
+            turns, has_more = store.page(session_id, before=before, after=since, limit=limit)
+            if since is not None:
+                next_cursor = turns[-1][0] if turns else since
+            else:
+                next_cursor = turns[0][0] if turns and has_more else None
+            response = jsonify({
+                "success": True,
+                "session_id": session_id,
+                "history": [public_turn(turn) for _, turn in turns],
+                "has_more": has_more,
+                "next_cursor": next_cursor,
+                "latest_cursor": version
+            })
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
     except Exception as e:
-        logger.error(f"Error obteniendo sesión: {str(e)}")
+        logger.error("Error obteniendo sesión: %s", e)
         return jsonify({
             "success": False,
             "error": "Error obteniendo sesión"
         }), 500
 
-@app.route('/api/knowledge', methods=['GET'])
-def get_knowledge_base():
-    """Obtener base de conocimientos (para debugging)"""
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    if metrics is None:
+        return jsonify({
+            "success": False,
+            "error": "Métricas deshabilitadas (METRICS_ENABLED=0)"
+        }), 404
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/api/debug/traces', methods=['GET'])
+def get_traces():
+    """Últimas trazas por petición (TRACING_ENABLED=1); `limit` y `min_ms` filtran"""
+    if tracer is None:
+        return jsonify({
+            "success": False,
+            "error": "Trazas deshabilitadas (TRACING_ENABLED=0)"
+        }), 404
+    limit = request.args.get('limit', 50, type=int)
+    min_ms = request.args.get('min_ms', 0.0, type=float)
     return jsonify({
         "success": True,
-        "knowledge_base": ai_assistant.knowledge_base
+        "tracer": tracer.stats(),
+        "profiler": profiler.stats() if profiler is not None else None,
+        "traces": tracer.recent(limit, min_ms)
     })
 
+@app.route('/api/knowledge', methods=['GET'])
+def get_knowledge_base():
+    """Obtener base de conocimientos (para debugging); 304 si el cliente ya tiene esta versión"""
+    ai_assistant.refresh_knowledge()
+    return ai_assistant.knowledge_body().response(KNOWLEDGE_CACHE_CONTROL)
+
 # Servir archivos estáticos (frontend)
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_frontend(path):
-    """Servir archivos del frontend"""
-    if path != "" and os.path.exists(path):
-        return send_from_directory('.', path)
-    else:
-        # Si no existe el archivo específico, servir index.html
-        return send_from_directory('.', 'index.html')
+    """Servir archivos del frontend desde la tabla en memoria (si no existe el archivo, index.html)"""
+    return static_assets.response(path)
 
 if __name__ == '__main__':
     # Puerto dinámico para Render.com
@@ -838,18 +4802,20 @@ if __name__ == '__main__':
     print("=" * 60)
     print(f"🚀 IA Accesible desde cualquier navegador del mundo")
     print(f"🔧 API Chat: /api/chat")
-    print(f"❤️  Health Check: /api/health")
+    print(f"⚡ API Chat (streaming SSE): /api/chat/stream")
+    print(f"❤️  Health Check: /api/health (readiness: /api/ready)")
     print(f"🤖 ¡Tu IA stealth-manager-ai está LISTA PARA EL MUNDO!")
     print(f"🌍 ACCESO GLOBAL - Deploy exitoso en Render.com")
     print(f"🔑 MiniMax API: {'✅ Configurado' if MINIMAX_API_KEY else '❌ No configurado'}")
     print(f"🌐 Puerto: {port}")
+    print("🏭 Producción: gunicorn -c gunicorn.conf.py app:app")
     print("=" * 60)
     
+    warm_up.run()
+    # Servidor de desarrollo; el reciclado de workers (max_requests) está en gunicorn.conf.py
     app.run(
         host='0.0.0.0',    # Escuchar en todas las interfaces
         port=port,         # Puerto dinámico de Render (9000)
         debug=False,       # Sin debug en producción
-        threaded=True,     # Manejar múltiples conexiones
-        max_requests=1000, # Límite de requests
-        max_requests_jitter=50
+        threaded=True      # Manejar múltiples conexiones
     )
\ No newline at end of file
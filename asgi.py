@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+xpe.manager.ai - Punto de entrada ASGI
+Sirve /api/chat y /api/chat/stream con asyncio (sin ocupar un hilo por llamada a MiniMax)
+y delega el resto de rutas a la app Flask.
+
+Uso:
+    uvicorn asgi:application --host 0.0.0.0 --port 9000
+"""
+
+import asyncio
+import json
+import math
+import time
+from datetime import datetime
+from functools import partial
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (app, ai_assistant, logger, metrics, tracer, record_http_request, wants_cached_response,
+                 AsyncUpstreamClient, Overloaded, admission_flow, client_address, check_rate_limits, overloaded_body,
+                 parse_session_id, INVALID_SESSION_BODY,
+                 bind_log_context, new_request_id, warm_up,
+                 MINIMAX_API_KEY, MINIMAX_API_URL, WARMUP_CONNECTIONS)
+
+# Resto de rutas (health, sesiones, knowledge, frontend) servidas por Flask
+flask_app = WsgiToAsgi(app)
+
+JSON_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"access-control-allow-origin", b"*")
+]
+
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+    (b"access-control-allow-origin", b"*")
+]
+
+
+async def _read_body(receive) -> bytes:
+    """Lee el cuerpo completo de la petición"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send_json(send, data: dict, status: int = 200, headers: list = ()):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": JSON_HEADERS + [(b"content-length", str(len(body)).encode())] + list(headers)
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _sse_event(data: dict, event: str = None) -> bytes:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def _send_overloaded(send, error: Overloaded):
+    await _send_json(send, overloaded_body(error), status=429,
+                     headers=[(b"retry-after", str(math.ceil(error.retry_after)).encode())])
+
+
+async def _parse_chat_request(scope, receive, send):
+    """
+    Valida el JSON de entrada y los límites de ritmo; devuelve (mensaje, session_id, use_cache, cliente)
+    o None si ya se respondió 400/429
+    """
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict) or 'message' not in data:
+        await _send_json(send, {
+            "success": False,
+            "error": "Mensaje requerido"
+        }, status=400)
+        return None
+
+    session_id = parse_session_id(data.get('session_id'))
+    if session_id is None:
+        await _send_json(send, INVALID_SESSION_BODY, status=400)
+        return None
+    client = client_address((scope.get("client") or ("",))[0], _header(scope, b"x-forwarded-for"))
+    try:
+        check_rate_limits(session_id, client)
+    except Overloaded as e:
+        await _send_overloaded(send, e)
+        return None
+
+    use_cache = wants_cached_response(data, _header(scope, b"cache-control"))
+    return data['message'], session_id, use_cache, admission_flow(client, session_id)
+
+
+async def chat_endpoint(scope, receive, send):
+    """Endpoint principal para chat con la IA (async)"""
+    parsed = await _parse_chat_request(scope, receive, send)
+    if parsed is None:
+        return
+
+    try:
+        result = await ai_assistant.aprocess_message(*parsed)
+        await _send_json(send, result)
+    except Overloaded as e:
+        await _send_overloaded(send, e)
+    except Exception as e:
+        logger.error("Error en chat endpoint (async): %s", e)
+        await _send_json(send, {
+            "success": False,
+            "error": "Error interno del servidor"
+        }, status=500)
+
+
+async def chat_stream_endpoint(scope, receive, send):
+    """Chat en modo streaming SSE (async)"""
+    parsed = await _parse_chat_request(scope, receive, send)
+    if parsed is None:
+        return
+
+    user_message, session_id, use_cache, client = parsed
+    await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+
+    try:
+        async for delta in ai_assistant.astream_message(user_message, session_id, use_cache, client):
+            await send({"type": "http.response.body", "body": _sse_event({"delta": delta}), "more_body": True})
+        final = _sse_event({
+            "success": True,
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        }, event="done")
+    except Overloaded as e:
+        final = _sse_event(overloaded_body(e), event="error")
+    except Exception as e:
+        logger.error("Error en chat stream (async): %s", e)
+        final = _sse_event({
+            "success": False,
+            "error": "Error interno del servidor"
+        }, event="error")
+
+    await send({"type": "http.response.body", "body": final})
+
+
+# Rutas servidas de forma nativa en asyncio (solo POST; OPTIONS/CORS lo maneja Flask)
+ASYNC_ROUTES = {
+    "/api/chat": chat_endpoint,
+    "/api/chat/stream": chat_stream_endpoint
+}
+
+
+async def lifespan(scope, receive, send):
+    """
+    Crea y cierra el cliente async de MiniMax con el ciclo de vida del servidor. El arranque
+    calienta cachés y conexiones antes de completar: uvicorn no acepta tráfico hasta entonces.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            ai_assistant.async_upstream = AsyncUpstreamClient()
+            await asyncio.to_thread(warm_up.prepare)
+            opened = 0
+            if MINIMAX_API_KEY and WARMUP_CONNECTIONS > 0:
+                opened = await ai_assistant.async_upstream.warm(MINIMAX_API_URL, WARMUP_CONNECTIONS)
+            warm_up.mark_ready(opened)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if ai_assistant.async_upstream is not None:
+                await ai_assistant.async_upstream.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _instrumented(handler, scope, receive, send):
+    """Mismas métricas que las rutas Flask (estado, latencia hasta los headers, bytes)"""
+    started = time.perf_counter()
+    response = {"status": "500", "elapsed": None, "bytes_out": 0}
+    bytes_in = 0
+
+    async def counting_receive():
+        nonlocal bytes_in
+        message = await receive()
+        bytes_in += len(message.get("body", b""))
+        return message
+
+    async def recording_send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = str(message["status"])
+            response["elapsed"] = time.perf_counter() - started
+        elif message["type"] == "http.response.body":
+            response["bytes_out"] += len(message.get("body", b""))
+        await send(message)
+
+    metrics.inc("http_requests_in_flight")
+    try:
+        await handler(scope, counting_receive, recording_send)
+    finally:
+        metrics.inc("http_requests_in_flight", value=-1)
+        elapsed = response["elapsed"] if response["elapsed"] is not None else time.perf_counter() - started
+        record_http_request(scope["path"], scope["method"], response["status"], elapsed, bytes_in, response["bytes_out"])
+
+
+async def _traced(handler, scope, receive, send):
+    """Traza de la petición (la traza activa vive en el ContextVar de esta tarea)"""
+    started = tracer.start(handler.__name__, method=scope["method"], path=scope["path"])
+    if started is None:
+        await handler(scope, receive, send)
+        return
+
+    trace = started[0]
+
+    async def tracing_send(message):
+        if message["type"] == "http.response.start":
+            trace.attrs["status"] = message["status"]
+            message = dict(message, headers=list(message.get("headers", [])) + [
+                (b"x-trace-id", f"{trace.trace_id:x}".encode())
+            ])
+        await send(message)
+
+    try:
+        await handler(scope, receive, tracing_send)
+    finally:
+        tracer.finish(started)
+
+
+async def _identified(handler, scope, receive, send):
+    """request_id en los logs de la tarea y en la cabecera X-Request-Id, como en las rutas Flask"""
+    request_id = new_request_id(_header(scope, b"x-request-id"))
+    bind_log_context(request_id=request_id)
+
+    async def identified_send(message):
+        if message["type"] == "http.response.start":
+            message = dict(message, headers=list(message.get("headers", [])) + [
+                (b"x-request-id", request_id.encode("latin-1"))
+            ])
+        await send(message)
+
+    await handler(scope, receive, identified_send)
+
+
+async def application(scope, receive, send):
+    """Aplicación ASGI"""
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        handler = ASYNC_ROUTES.get(scope["path"])
+        if handler is not None:
+            if tracer is not None:
+                handler = partial(_traced, handler)
+            handler = partial(_identified, handler)
+            if metrics is not None:
+                await _instrumented(handler, scope, receive, send)
+            else:
+                await handler(scope, receive, send)
+            return
+
+    await flask_app(scope, receive, send)
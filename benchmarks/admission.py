@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Latencia de clientes tranquilos mientras un cliente ruidoso satura MiniMax, con la cola justa
+por IP (--fair 1) o con una sola cola FIFO (--fair 0). Stub local con latencia fija y
+UPSTREAM_MAX_CONCURRENCY bajo para que la cola se forme enseguida.
+
+Uso:
+    python benchmarks/admission.py --fair 1 [--capacity 4] [--queue-timeout 2] [--noisy-threads 32]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+def percentile(values, q):
+    return round(values[max(int(len(values) * q) - 1, 0)] * 1000, 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fair", choices=("0", "1"), default="1")
+    parser.add_argument("--capacity", type=int, default=4, help="UPSTREAM_MAX_CONCURRENCY durante la prueba")
+    parser.add_argument("--queue-timeout", type=float, default=2.0, help="ADMISSION_QUEUE_TIMEOUT durante la prueba")
+    parser.add_argument("--latency", default="fixed:0.1", help="Latencia del stub")
+    parser.add_argument("--noisy-threads", type=int, default=32, help="Hilos del cliente ruidoso (una IP)")
+    parser.add_argument("--noisy-requests", type=int, default=6, help="Peticiones por hilo ruidoso")
+    parser.add_argument("--quiet-clients", type=int, default=3, help="Clientes tranquilos (una IP cada uno)")
+    parser.add_argument("--quiet-requests", type=int, default=5)
+    parser.add_argument("--quiet-interval", type=float, default=0.2, help="Pausa entre peticiones de un cliente tranquilo")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"),
+        "MINIMAX_API_URL": MiniMaxStub(latency=args.latency).start().url,
+        "UPSTREAM_MAX_CONCURRENCY": str(args.capacity),
+        "ADMISSION_QUEUE_TIMEOUT": str(args.queue_timeout),
+        "RESPONSE_CACHE_ENABLED": "0",
+        "SIMILARITY_CACHE_ENABLED": "0"
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app as app_module
+
+    if args.fair == "0":
+        # Todos los clientes en el mismo flujo: la cola justa degenera en FIFO por llegada
+        app_module.admission_flow = lambda client, session_id: ""
+
+    results = {"noisy": ([], {}), "quiet": ([], {})}
+    lock = threading.Lock()
+
+    def worker(kind, address, worker_id, requests, interval):
+        client = app_module.app.test_client()
+        for i in range(requests):
+            started = time.perf_counter()
+            response = client.post("/api/chat", json={"message": f"{kind} {worker_id}-{i}", "session_id": f"{kind}-{worker_id}"},
+                                   environ_base={"REMOTE_ADDR": address})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies, statuses = results[kind]
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            time.sleep(interval)
+
+    threads = [threading.Thread(target=worker, args=("noisy", "10.0.0.1", w, args.noisy_requests, 0))
+               for w in range(args.noisy_threads)]
+    threads += [threading.Thread(target=worker, args=("quiet", f"10.0.1.{w}", w, args.quiet_requests, args.quiet_interval))
+                for w in range(args.quiet_clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    report = {"fair": args.fair == "1", "capacity": args.capacity, "wall_s": round(wall, 2)}
+    for kind, (latencies, statuses) in results.items():
+        latencies.sort()
+        report[kind] = {
+            "statuses": statuses,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "max_ms": percentile(latencies, 1.0)
+        }
+    report["admission"] = app_module.ai_assistant.admission.stats()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Concurrencia frente a un MiniMax lento: N POST /api/chat simultáneos contra el camino threaded
+(gunicorn gthread con app:app) y contra el camino async (uvicorn con asgi:application), con el
+stub en su propio proceso y una latencia fija alta. Con hilos, las esperas al upstream ocupan un
+hilo cada una y la concurrencia queda limitada a workers × threads; en el event loop no.
+
+Uso:
+    python benchmarks/async_concurrency.py [--latency fixed:1] [--threaded 100] [--asgi 100,1000,3000]
+                                           [--workers 2] [--threads 8]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_PATH = "/v1/text/chatcompletion_v2"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El proceso terminó antes de responder en {url}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+async def burst(base: str, concurrency: int, run_id: str) -> dict:
+    """`concurrency` peticiones a la vez; latencias por petición y tiempo total"""
+    latencies, statuses = [], {}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+                                     timeout=aiohttp.ClientTimeout(total=600)) as session:
+        async def one(i: int):
+            started = time.perf_counter()
+            async with session.post(base + "/api/chat", json={"message": f"{run_id} {i}", "session_id": f"{run_id}-{i}"}) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "wall_s": round(wall, 2),
+        "p50_s": round(latencies[len(latencies) // 2], 2),
+        "max_s": round(latencies[-1], 2),
+        "req_per_s": round(concurrency / wall, 1)
+    }
+
+
+def serve(mode: str, args, env: dict) -> subprocess.Popen:
+    port = free_port()
+    if mode == "threaded":
+        # -c /dev/null: sin el gunicorn.conf.py del repo (preload y calentamiento no son lo que se mide)
+        command = [sys.executable, "-m", "gunicorn", "app:app", "-c", "/dev/null", "-w", str(args.workers),
+                   "-k", "gthread", "--threads", str(args.threads), "-b", f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi:application", "--host", "127.0.0.1", "--port", str(port),
+                   "--log-level", "warning", "--no-access-log", "--backlog", "4096"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.base = f"http://127.0.0.1:{port}"
+    wait_ready(process.base + "/api/health", process)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", default="fixed:1", help="Latencia del stub")
+    parser.add_argument("--threaded", default="100", help="Concurrencias a probar con gunicorn gthread")
+    parser.add_argument("--asgi", default="100,1000,3000", help="Concurrencias a probar con uvicorn")
+    parser.add_argument("--workers", type=int, default=2, help="Workers de gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos por worker de gunicorn")
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "minimax_stub.py"),
+                             "--port", str(stub_port), "--latency", args.latency],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ,
+               MINIMAX_API_KEY=os.environ.get("MINIMAX_API_KEY", "bench"),
+               MINIMAX_API_URL=f"http://127.0.0.1:{stub_port}{STUB_PATH}",
+               LOG_LEVEL="WARNING",
+               HEALTH_PROBE_ENABLED="0",
+               RESPONSE_CACHE_ENABLED="0",
+               SIMILARITY_CACHE_ENABLED="0",
+               LOCAL_ANSWERS="off",
+               # Se mide el modelo de servicio, no el control de admisión hacia MiniMax
+               UPSTREAM_MAX_CONCURRENCY="0")
+    results = []
+    try:
+        wait_ready(f"http://127.0.0.1:{stub_port}/", stub)
+        for mode, levels in (("threaded", args.threaded), ("asgi", args.asgi)):
+            server = serve(mode, args, env)
+            try:
+                for concurrency in (int(value) for value in levels.split(",") if value):
+                    result = asyncio.run(burst(server.base, concurrency, f"{mode}-{concurrency}"))
+                    results.append(dict(mode=mode, **result))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+    finally:
+        stub.send_signal(signal.SIGINT)
+        stub.wait(timeout=10)
+
+    print(json.dumps({"latency": args.latency, "workers": args.workers, "threads": args.threads, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+N prompts de evaluación: una petición /api/chat por prompt (en serie) frente a un solo
+/api/chat/batch, con un stub local de MiniMax y sin aciertos de caché.
+
+Uso:
+    python benchmarks/chat_batch.py [--prompts 300] [--sessions 50] [--latency fixed:0.05] [--workers 16]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=300)
+    parser.add_argument("--sessions", type=int, default=50, help="Sesiones distintas entre las que se reparten los prompts")
+    parser.add_argument("--latency", default="fixed:0.05", help="Latencia del stub")
+    parser.add_argument("--workers", type=int, default=16, help="BATCH_MAX_WORKERS durante la prueba")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"),
+        "MINIMAX_API_URL": MiniMaxStub(latency=args.latency).start().url,
+        "BATCH_MAX_WORKERS": str(args.workers),
+        "SESSION_STORE": "memory"
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    from app import app
+
+    client = app.test_client()
+
+    def items(run):
+        return [{"message": f"{run} prompt {i}", "session_id": f"{run}-{i % args.sessions}"} for i in range(args.prompts)]
+
+    report = {"prompts": args.prompts, "sessions": args.sessions, "latency": args.latency, "workers": args.workers}
+
+    started = time.perf_counter()
+    serial = [client.post("/api/chat", json=item).get_json() for item in items("serial")]
+    report["serial_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    batch = client.post("/api/chat/batch", json={"items": items("batch")}).get_json()["results"]
+    report["batch_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    first = None
+    response = client.post("/api/chat/batch?format=ndjson", json={"items": items("ndjson")})
+    for line in response.response:
+        first = first or time.perf_counter() - started
+    report["ndjson_s"] = round(time.perf_counter() - started, 2)
+    report["ndjson_first_result_ms"] = round(first * 1000, 1)
+
+    report["speedup"] = round(report["serial_s"] / report["batch_s"], 1)
+    report["ok"] = {
+        "serial": sum(result["success"] for result in serial),
+        "batch": sum(result["success"] for result in batch)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
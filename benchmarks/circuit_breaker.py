@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Latencia de /api/chat durante una caída de MiniMax, con y sin circuit breaker.
+Levanta un stub local que no responde a tiempo (o devuelve 503) y lanza peticiones
+concurrentes con mensajes distintos (sin aciertos de caché).
+
+Uso:
+    python benchmarks/circuit_breaker.py --breaker 1 [--fault hang|error] [--threads 16] [--requests 25]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+def start_faulty_stub(fault: str, hang_seconds: float) -> str:
+    """Stub de MiniMax que falla siempre; devuelve su URL"""
+    if fault == "hang":
+        stub = MiniMaxStub(hang_rate=1.0, hang_seconds=hang_seconds)
+    else:
+        stub = MiniMaxStub(error_rate=1.0, error_status=503)
+    return stub.start().url
+
+
+def percentile(values, q):
+    return round(values[max(int(len(values) * q) - 1, 0)] * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--breaker", choices=("0", "1"), default="1")
+    parser.add_argument("--fault", choices=("hang", "error"), default="hang")
+    parser.add_argument("--timeout", type=float, default=1.0, help="MINIMAX_API_TIMEOUT durante la prueba")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=25, help="Peticiones por hilo")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"),
+        "MINIMAX_API_URL": start_faulty_stub(args.fault, args.timeout * 3),
+        "MINIMAX_API_TIMEOUT": str(args.timeout),
+        "CIRCUIT_BREAKER_ENABLED": args.breaker
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    from app import app
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        client = app.test_client()
+        for i in range(args.requests):
+            started = time.perf_counter()
+            client.post("/api/chat", json={"message": f"pregunta {worker_id}-{i}", "session_id": f"bench-{worker_id}-{i}"}).data
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "breaker": args.breaker == "1",
+        "fault": args.fault,
+        "requests": len(latencies),
+        "wall_s": round(wall, 2),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "circuit_breaker": app.test_client().get("/api/health").get_json()["circuit_breaker"]
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Arranque en producción: tiempo desde lanzar gunicorn hasta que /api/ready responde 200, latencia
+de las primeras peticiones a /api/chat y memoria privada por worker. Compara gunicorn.conf.py
+(preload + calentamiento) con un gunicorn sin configuración, contra el stub de MiniMax con un
+coste por conexión nueva que simula el handshake TLS.
+
+Uso:
+    python benchmarks/cold_start.py [--mode both|conf|bare] [--workers 2] [--connect-delay 0.15]
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def private_kb(pid: int) -> int:
+    """Memoria privada del proceso (Private_Clean + Private_Dirty): lo que no comparte por copy-on-write"""
+    total = 0
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean", "Private_Dirty")):
+                total += int(line.split()[1])
+    return total
+
+
+def worker_pids(master: int) -> list:
+    with open(f"/proc/{master}/task/{master}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def run(mode: str, args, stub_url: str) -> dict:
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), MINIMAX_API_KEY="bench", MINIMAX_API_URL=stub_url,
+               WEB_CONCURRENCY=str(args.workers), LOG_LEVEL="WARNING")
+    command = [sys.executable, "-m", "gunicorn", "app:app"]
+    if mode == "conf":
+        command += ["-c", "gunicorn.conf.py"]
+    else:
+        # -c /dev/null: gunicorn carga ./gunicorn.conf.py por defecto
+        command += ["-c", "/dev/null", "-w", str(args.workers), "-k", "gthread", "--threads", "16", "-b", f"127.0.0.1:{port}"]
+
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Sin configuración el balanceador solo tenía /api/health: responde en cuanto el worker acepta
+        probe = "/api/ready" if mode == "conf" else "/api/health"
+        while True:
+            try:
+                if requests.get(base + probe, timeout=1).status_code == 200:
+                    break
+            except requests.exceptions.ConnectionError:
+                pass
+            if time.perf_counter() - started > 60:
+                raise RuntimeError(f"gunicorn ({mode}) no quedó listo")
+            time.sleep(0.01)
+        ready_ms = (time.perf_counter() - started) * 1000
+        if mode == "conf":
+            # Todos los workers calientan antes de aceptar; esperar a que estén todos
+            time.sleep(0.5)
+
+        first = []
+        for i in range(args.requests):
+            request_started = time.perf_counter()
+            response = requests.post(base + "/api/chat", json={"message": f"cold {i}", "session_id": f"cold-{i}", "cache": False},
+                                     headers={"Connection": "close"})
+            first.append(round((time.perf_counter() - request_started) * 1000, 1))
+            response.raise_for_status()
+
+        workers = worker_pids(server.pid)
+        return {
+            "mode": mode,
+            "ready_ms": round(ready_ms, 1),
+            "worker_warm_up": requests.get(base + "/api/ready").json() if mode == "conf" else None,
+            "first_requests_ms": first,
+            "master_private_kb": private_kb(server.pid),
+            "worker_private_kb": [private_kb(pid) for pid in workers]
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("both", "conf", "bare"), default="both")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=4, help="Primeras peticiones medidas (cada una con conexión nueva al servidor)")
+    parser.add_argument("--latency", default="fixed:0.05", help="Latencia del stub")
+    parser.add_argument("--connect-delay", type=float, default=0.15, help="Coste de cada conexión nueva al stub")
+    args = parser.parse_args()
+
+    stub = MiniMaxStub(latency=args.latency, connect_delay=args.connect_delay).start()
+    modes = ("bare", "conf") if args.mode == "both" else (args.mode,)
+    print(json.dumps([run(mode, args, stub.url) for mode in modes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
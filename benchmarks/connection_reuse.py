@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Comprobación de reutilización de conexiones hacia MiniMax: N llamadas seguidas, primero con
+UpstreamClient directamente y después por /api/chat completo, contra el stub local. Cada fase
+debe abrir exactamente una conexión TCP nueva; si no, termina con código de salida 1.
+
+Uso:
+    python benchmarks/connection_reuse.py [--calls 50] [--latency fixed:0.005]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--latency", default="fixed:0.005", help="Latencia del stub")
+    args = parser.parse_args()
+
+    stub = MiniMaxStub(latency=args.latency).start()
+    os.environ.update({
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"),
+        "MINIMAX_API_URL": stub.url,
+        # Nada más debe abrir conexiones al stub: ni la sonda de salud ni las cachés que evitarían la llamada
+        "HEALTH_PROBE_ENABLED": "0",
+        "RESPONSE_CACHE_ENABLED": "0",
+        "SIMILARITY_CACHE_ENABLED": "0",
+        "LOCAL_ANSWERS": "off",
+        "SESSION_BACKEND": "memory"
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app as app_module
+
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "ping"}]}
+    report = {"calls": args.calls}
+    failed = False
+
+    # Fase 1: el cliente compartido a secas
+    upstream = app_module.UpstreamClient()
+    before = stub.counts["connections"]
+    started = time.perf_counter()
+    for _ in range(args.calls):
+        upstream.post(stub.url, json=payload).raise_for_status()
+    report["upstream_client"] = {
+        "new_connections": stub.counts["connections"] - before,
+        "ms_per_call": round((time.perf_counter() - started) / args.calls * 1000, 2),
+        "pool": upstream.stats.snapshot()
+    }
+
+    # Fase 2: el camino completo de /api/chat (DLLAssistantAI con su propio UpstreamClient)
+    client = app_module.app.test_client()
+    before = stub.counts["connections"]
+    requests_before = stub.counts["requests"]
+    started = time.perf_counter()
+    for i in range(args.calls):
+        response = client.post("/api/chat", json={"message": f"reuse {i}", "session_id": f"reuse-{i}"})
+        assert response.status_code == 200, response.status_code
+    report["api_chat"] = {
+        "new_connections": stub.counts["connections"] - before,
+        "upstream_requests": stub.counts["requests"] - requests_before,
+        "ms_per_call": round((time.perf_counter() - started) / args.calls * 1000, 2),
+        "pool": app_module.ai_assistant.upstream.stats.snapshot()
+    }
+
+    for phase in ("upstream_client", "api_chat"):
+        report[phase]["ok"] = report[phase]["new_connections"] == 1
+        failed = failed or not report[phase]["ok"]
+    if report["api_chat"]["upstream_requests"] != args.calls:
+        # Alguna respuesta no pasó por MiniMax: la comprobación no mediría nada
+        report["api_chat"]["ok"] = False
+        failed = True
+
+    print(json.dumps(report, indent=2))
+    stub.stop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
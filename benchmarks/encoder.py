@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del cuerpo de la petición a MiniMax: camino anterior (dicts + json= de requests)
+frente a RequestEncoder (prefijo estático en bytes + turnos ya codificados).
+
+Uso:
+    python benchmarks/encoder.py [--turns 5] [--iterations 20000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import SYSTEM_PROMPT, MINIMAX_API_KEY, ContextBuilder, RequestEncoder, TokenEstimator  # noqa: E402
+
+CODE_REPLY = "Aquí tienes la implementación:\n```cpp\n" + "    result += compute(a, b, c); // paso\n" * 40 + "```\nListo."
+
+
+def legacy_body(message, selected, stream=False):
+    """Camino anterior: headers y payload nuevos por llamada, serializados como lo hace requests (json=)"""
+    headers = {
+        "Authorization": f"Bearer {MINIMAX_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for turn, assistant, _ in selected:
+        if turn["user"]:
+            messages.append({"role": "user", "content": turn["user"]})
+        if assistant:
+            messages.append({"role": "assistant", "content": assistant})
+    messages.append({"role": "user", "content": message})
+    payload = {
+        "model": "minimax-m2",
+        "messages": messages,
+        "max_tokens": 2000,
+        "temperature": 0.7,
+        "stream": stream
+    }
+    return headers, json.dumps(payload, allow_nan=False).encode("utf-8")
+
+
+def encoder_body(encoder, message, selected, stream=False):
+    body, _ = encoder.encode(message, selected, stream)
+    return encoder.headers, body
+
+
+def measure(fn, iterations):
+    """CPU por petición (µs) y bytes asignados por petición"""
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+
+    tracemalloc.start()
+    fn()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return round(cpu_us, 2), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    builder = ContextBuilder(TokenEstimator())
+    encoder = RequestEncoder()
+    context = []
+    for i in range(args.turns):
+        turn = {"user": f"¿Cómo optimizo la función número {i} de mi DLL?", "assistant": CODE_REPLY, "timestamp": ""}
+        encoder.prepare(turn, builder.prepare(turn)[2])
+        context.append(turn)
+
+    message = "¿Y si además necesito que sea thread-safe?"
+    selected, _ = builder.select(message, context)
+    assert json.loads(legacy_body(message, selected)[1]) == json.loads(encoder_body(encoder, message, selected)[1])
+
+    results = {}
+    for name, fn in (("legacy", lambda: legacy_body(message, selected)),
+                     ("encoder", lambda: encoder_body(encoder, message, selected))):
+        cpu_us, alloc = measure(fn, args.iterations)
+        results[name] = {"cpu_us_per_request": cpu_us, "peak_alloc_bytes": alloc}
+    results["speedup"] = round(results["legacy"]["cpu_us_per_request"] / results["encoder"]["cpu_us_per_request"], 2)
+    results["turns"] = args.turns
+    results["body_bytes"] = len(encoder_body(encoder, message, selected)[1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Throughput por núcleo del camino de respuesta local: clasificar el mensaje con IntentRouter
+(un solo regex compilado) y devolver la respuesta ya renderizada.
+
+Uso:
+    python benchmarks/intent_router.py [--seconds 3]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ai_assistant  # noqa: E402
+
+MESSAGES = [
+    "¿Cómo crear una DLL básica?",
+    "Optimiza esta función para SIMD",
+    "Tengo un memory leak, ¿cómo solucionarlo?",
+    "Crea una DLL de criptografía en C++",
+    "¿Qué es una DLL?",
+    "¿Qué es una calling convention?",
+    "Muéstrame un ejemplo de DLL básica",
+    "Explica el memory pooling",
+    "Hola, buenas tardes",
+    "Necesito una DLL de suma y multiplicación para mi juego en Unity con C#",
+    "Debug este error de stack overflow que aparece al cargar el plugin",
+    "¿Qué tipos de DLL puedo crear?"
+]
+
+
+def throughput(fn, seconds):
+    """Llamadas por segundo en un solo hilo (un núcleo)"""
+    calls = 0
+    cpu_start = time.process_time()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for message in MESSAGES:
+            fn(message)
+        calls += len(MESSAGES)
+    cpu = time.process_time() - cpu_start
+    return {"per_second": round(calls / cpu), "us_per_call": round(cpu / calls * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    router = ai_assistant.intent_router
+    print(json.dumps({
+        "classify": throughput(router.classify, args.seconds),
+        "classify_and_respond": throughput(ai_assistant._generate_specialized_response, args.seconds),
+        "routes": {message: "/".join(router.classify(message)) for message in MESSAGES}
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
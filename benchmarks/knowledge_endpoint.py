@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+/api/knowledge antes y después de la respuesta precalculada: peticiones por segundo y bytes
+enviados con jsonify en cada petición, con el cuerpo cacheado (identidad y gzip) y con 304.
+
+Uso:
+    python benchmarks/knowledge_endpoint.py [--requests 2000] [--entries 0]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+
+from app import app, ai_assistant  # noqa: E402
+from knowledge_index import synthetic_knowledge_base  # noqa: E402
+
+
+def legacy_knowledge():
+    """Implementación anterior: serializa la base completa en cada petición"""
+    return jsonify({
+        "success": True,
+        "knowledge_base": ai_assistant.knowledge_base
+    })
+
+
+app.add_url_rule('/bench/knowledge-legacy', 'bench_knowledge_legacy', legacy_knowledge)
+
+
+def run(client, path: str, requests: int, headers: dict = None) -> dict:
+    response = client.get(path, headers=headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    elapsed = time.perf_counter() - start
+    return {
+        "status": response.status_code,
+        "requests_per_second": round(requests / elapsed),
+        "bytes": len(response.get_data())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--entries", type=int, default=0, help="entradas sintéticas añadidas a la base")
+    args = parser.parse_args()
+
+    if args.entries:
+        ai_assistant.reload_knowledge(synthetic_knowledge_base(args.entries))
+
+    client = app.test_client()
+    etag = client.get('/api/knowledge', headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    print(json.dumps({
+        "legacy_jsonify": run(client, '/bench/knowledge-legacy', args.requests),
+        "cached_identity": run(client, '/api/knowledge', args.requests),
+        "cached_gzip": run(client, '/api/knowledge', args.requests, {"Accept-Encoding": "gzip"}),
+        "not_modified": run(client, '/api/knowledge', args.requests,
+                            {"Accept-Encoding": "gzip", "If-None-Match": etag})
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
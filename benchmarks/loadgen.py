@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de /api/chat, /api/sessions/<id> y los assets del frontend a distintos niveles
+de concurrencia (bucle cerrado: cada hilo lanza la siguiente petición al recibir la anterior).
+Informa RPS y p50/p95/p99, guarda los resultados en JSON y los compara con una ejecución anterior.
+
+Sin --target levanta en este proceso el stub de MiniMax y la app en un servidor HTTP threaded
+(cómodo, pero cliente y servidor comparten GIL). Para cifras representativas, arrancar la app
+aparte contra el stub y pasar --target:
+
+    python benchmarks/minimax_stub.py --port 8999 --latency lognormal:0.3,0.5 &
+    MINIMAX_API_KEY=bench MINIMAX_API_URL=http://127.0.0.1:8999/v1/text/chatcompletion_v2 \\
+        gunicorn -w 4 --threads 16 -b 127.0.0.1:9000 app:app &
+    python benchmarks/loadgen.py --target http://127.0.0.1:9000
+
+Uso:
+    python benchmarks/loadgen.py [--scenarios chat,sessions,static] [--concurrency 1,8,32]
+                                 [--duration 10] [--env RESPONSE_CACHE_ENABLED=0]
+                                 [--output resultados.json] [--baseline anterior.json] [--tolerance 0.1]
+    python benchmarks/loadgen.py --current nueva.json --baseline anterior.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from minimax_stub import add_stub_arguments, stub_from_args  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+STATIC_PATHS = ("/", "/script.js", "/styles.css")
+
+
+def percentile(values, q: float) -> float:
+    """Percentil por rango más cercano, en ms"""
+    if not values:
+        return None
+    return round(values[min(max(int(len(values) * q + 0.5) - 1, 0), len(values) - 1)] * 1000, 2)
+
+
+def start_inprocess(args) -> str:
+    """Stub + app en este proceso; devuelve la URL base de la app"""
+    stub = stub_from_args(args).start()
+    os.environ.update({"MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"), "MINIMAX_API_URL": stub.url})
+    os.environ.update(dict(item.split("=", 1) for item in args.env))
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, ROOT)
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server.handle_error = lambda request, client_address: None  # Conexiones keep-alive cerradas por el cliente
+    threading.Thread(target=server.serve_forever, name="loadgen-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Scenario:
+    """Genera las peticiones de un escenario; `request(session, worker, i)` devuelve la respuesta"""
+
+    def __init__(self, base: str, args):
+        self.base = base
+        self.args = args
+
+    def setup(self, run):
+        pass
+
+    def request(self, http: requests.Session, worker: int, i: int) -> requests.Response:
+        raise NotImplementedError
+
+
+class ChatScenario(Scenario):
+    """POST /api/chat; una fracción --repeat-ratio repite preguntas frecuentes (aciertos de caché)"""
+
+    COMMON = ("¿Cómo crear una DLL básica?", "¿Cómo optimizar con SIMD?", "Tengo un memory leak en mi DLL")
+
+    def request(self, http, worker, i):
+        if (i * 7919 + worker) % 1000 < self.args.repeat_ratio * 1000:
+            message, session_id = self.COMMON[i % len(self.COMMON)], f"load-common-{worker}-{i}"
+        else:
+            message, session_id = f"pregunta {worker}-{i} sobre exportar símbolos de una DLL", f"load-{worker}"
+        return http.post(f"{self.base}/api/chat", json={"message": message, "session_id": session_id},
+                         timeout=self.args.request_timeout)
+
+
+class StreamScenario(ChatScenario):
+    """POST /api/chat/stream; la latencia incluye el stream completo (--stream-chunks, --chunk-delay)"""
+
+    def request(self, http, worker, i):
+        return http.post(f"{self.base}/api/chat/stream", json={
+            "message": f"pregunta {worker}-{i} en streaming", "session_id": f"load-stream-{worker}"
+        }, timeout=self.args.request_timeout)
+
+
+class SessionsScenario(Scenario):
+    """GET /api/sessions/<id> sobre sesiones con --session-turns turnos creados antes de medir"""
+
+    def setup(self, run):
+        self.session_ids = [f"load-history-{n}" for n in range(self.args.sessions)]
+        jobs = itertools.product(self.session_ids, range(self.args.session_turns))
+        lock = threading.Lock()
+
+        def create(http, worker, i):
+            with lock:
+                job = next(jobs, None)
+            if job is None:
+                return None
+            session_id, turn = job
+            return http.post(f"{self.base}/api/chat", json={
+                "message": f"turno {turn} de la sesión {session_id}: ejemplo de DllMain", "session_id": session_id
+            }, timeout=self.args.request_timeout)
+
+        run(create, 16, total=len(self.session_ids) * self.args.session_turns)
+
+    def request(self, http, worker, i):
+        session_id = self.session_ids[(worker + i) % len(self.session_ids)]
+        return http.get(f"{self.base}/api/sessions/{session_id}", timeout=self.args.request_timeout)
+
+
+class StaticScenario(Scenario):
+    """GET de index.html, script.js y styles.css como un navegador (gzip)"""
+
+    def request(self, http, worker, i):
+        return http.get(self.base + STATIC_PATHS[i % len(STATIC_PATHS)],
+                        headers={"Accept-Encoding": "gzip, deflate, br"}, timeout=self.args.request_timeout)
+
+
+SCENARIOS = {"chat": ChatScenario, "stream": StreamScenario, "sessions": SessionsScenario, "static": StaticScenario}
+
+
+def run_closed_loop(fn, concurrency: int, duration: float = None, total: int = None, warmup: float = 0.0):
+    """`concurrency` hilos llamando a fn(http, worker, i) durante `duration` segundos (o `total` llamadas)"""
+    latencies = [[] for _ in range(concurrency)]
+    statuses = [{} for _ in range(concurrency)]
+    counter = itertools.count()
+    stop = threading.Event()
+    measuring = threading.Event()
+    if not warmup:
+        measuring.set()
+
+    def worker(w):
+        http = requests.Session()
+        i = 0
+        while not stop.is_set():
+            if total is not None and next(counter) >= total:
+                break
+            started = time.perf_counter()
+            try:
+                response = fn(http, w, i)
+                if response is None:
+                    break
+                response.content
+                status = str(response.status_code)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if measuring.is_set():
+                latencies[w].append(elapsed)
+                statuses[w][status] = statuses[w].get(status, 0) + 1
+            i += 1
+        http.close()
+
+    threads = [threading.Thread(target=worker, args=(w,), daemon=True) for w in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if warmup:
+        time.sleep(warmup)
+        measuring.set()
+    started = time.perf_counter()
+    if duration is not None:
+        time.sleep(duration)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    merged_statuses = {}
+    for counts in statuses:
+        for status, count in counts.items():
+            merged_statuses[status] = merged_statuses.get(status, 0) + count
+    return sorted(itertools.chain.from_iterable(latencies)), merged_statuses, wall
+
+
+def summarize(scenario: str, concurrency: int, latencies, statuses, wall: float) -> dict:
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "statuses": statuses
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Filas con la variación de RPS y p99 respecto a la línea base; marca las regresiones"""
+    previous = {(row["scenario"], row["concurrency"]): row for row in baseline["results"]}
+    rows = []
+    for row in current["results"]:
+        old = previous.get((row["scenario"], row["concurrency"]))
+        if old is None:
+            continue
+        rps_change = (row["rps"] - old["rps"]) / old["rps"] if old["rps"] else 0.0
+        p99_change = (row["p99_ms"] - old["p99_ms"]) / old["p99_ms"] if old["p99_ms"] else 0.0
+        rows.append({
+            "scenario": row["scenario"],
+            "concurrency": row["concurrency"],
+            "rps": [old["rps"], row["rps"]],
+            "rps_change": round(rps_change, 3),
+            "p99_ms": [old["p99_ms"], row["p99_ms"]],
+            "p99_change": round(p99_change, 3),
+            "regression": rps_change < -tolerance or p99_change > tolerance
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL base de una app ya arrancada (sin él: stub + app en este proceso)")
+    parser.add_argument("--scenarios", default="chat,sessions,static", help="chat, stream, sessions, static")
+    parser.add_argument("--concurrency", default="1,8,32", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos medidos por escenario y nivel")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Segundos de calentamiento sin medir")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="Fracción de preguntas de chat repetidas")
+    parser.add_argument("--sessions", type=int, default=20, help="Sesiones del escenario sessions")
+    parser.add_argument("--session-turns", type=int, default=20, help="Turnos por sesión del escenario sessions")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Configuración de la app en modo en proceso (repetible)")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/<fecha>.json)")
+    parser.add_argument("--current", help="No ejecutar: usar estos resultados guardados para --baseline")
+    parser.add_argument("--baseline", help="Resultados anteriores con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Variación relativa de RPS/p99 tolerada antes de marcar una regresión")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        base = args.target.rstrip("/") if args.target else start_inprocess(args)
+        current = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "git_commit": git_commit(),
+                "target": args.target or "inprocess",
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "duration_s": args.duration,
+                "stub": None if args.target else {
+                    "latency": args.latency, "error_rate": args.error_rate, "hang_rate": args.hang_rate,
+                    "stream_chunks": args.stream_chunks, "chunk_delay": args.chunk_delay
+                },
+                "env": args.env
+            },
+            "results": []
+        }
+        for name in args.scenarios.split(","):
+            scenario = SCENARIOS[name](base, args)
+            scenario.setup(lambda fn, concurrency, total: run_closed_loop(fn, concurrency, total=total))
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                row = summarize(name, concurrency, *run_closed_loop(
+                    scenario.request, concurrency, duration=args.duration, warmup=args.warmup
+                ))
+                current["results"].append(row)
+                print(json.dumps(row), flush=True)
+
+        output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Resultados: {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.tolerance)
+        for row in rows:
+            print(json.dumps(row))
+        regressions = [row for row in rows if row["regression"]]
+        if regressions:
+            print(f"{len(regressions)} regresiones por encima de ±{args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
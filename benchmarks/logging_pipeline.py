@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Coste en el hilo de la petición de un logger.info/error: StreamHandler síncrono (lo que hacía
+logging.basicConfig) frente a BackgroundLogHandler, con un destino rápido (/dev/null) y con uno
+que se atasca de vez en cuando (disco o pipe lento).
+
+Uso:
+    python benchmarks/logging_pipeline.py [--records 50000] [--stall-every 500] [--stall-ms 20]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StallingHandler(logging.StreamHandler):
+    """StreamHandler cuyo destino se bloquea `stall_ms` cada `every` registros"""
+
+    def __init__(self, stream, every: int, stall_ms: float):
+        super().__init__(stream)
+        self.every = every
+        self.stall = stall_ms / 1000
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+        if self.every and self.count % self.every == 0:
+            time.sleep(self.stall)
+        super().emit(record)
+
+
+def measure(handler, records: int) -> dict:
+    logger = logging.getLogger(f"bench.{id(handler)}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    timings = []
+    started = time.perf_counter()
+    for i in range(records):
+        t = time.perf_counter()
+        if i % 10:
+            logger.info("MiniMax API response: %s chars", i, extra={"sampled": True})
+        else:
+            logger.error("Error calling MiniMax API: %s", "503 Server Error")
+        timings.append(time.perf_counter() - t)
+    wall = time.perf_counter() - started
+    timings.sort()
+    return {
+        "us_per_call": round(wall / records * 1e6, 2),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 2),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 2),
+        "max_ms": round(timings[-1] * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--stall-every", type=int, default=500, help="El destino lento se bloquea cada N registros")
+    parser.add_argument("--stall-ms", type=float, default=20.0)
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="LOG_SAMPLE_RATE del handler en cola")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MINIMAX_API_KEY", "")
+    logging.disable(logging.CRITICAL)
+    from app import BackgroundLogHandler, JsonLogFormatter
+    logging.disable(logging.NOTSET)
+
+    sink = open(os.devnull, "w")
+    report = {"records": args.records}
+    for name, every in (("fast_sink", 0), ("stalling_sink", args.stall_every)):
+        sync = StallingHandler(sink, every, args.stall_ms)
+        sync.setFormatter(JsonLogFormatter())
+        report[name] = {"sync": measure(sync, args.records)}
+
+        target = StallingHandler(sink, every, args.stall_ms)
+        target.setFormatter(JsonLogFormatter())
+        queued = BackgroundLogHandler(target, sample_rate=args.sample_rate)
+        report[name]["queued"] = measure(queued, args.records)
+        queued.stop()
+        report[name]["queued"].update(dropped=queued.dropped, sampled_out=queued.sampled_out)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
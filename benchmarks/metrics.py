@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Coste por petición de las métricas: inc/observe sueltos, los tres hooks de Flask de una petición
+y una ruta trivial con y sin hooks (test client). También el tiempo de exportar /api/metrics.
+
+Uso:
+    python benchmarks/metrics.py [--iterations 200000] [--requests 5000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("METRICS_ENABLED", "1")
+
+from flask import Response  # noqa: E402
+
+from app import app, metrics, record_http_request, _metrics_start, _metrics_record, _metrics_finish  # noqa: E402
+
+app.add_url_rule('/bench/ping', 'bench_ping', lambda: "ok")
+
+
+def per_call_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 3)
+
+
+def seconds_per_request(client, requests: int) -> float:
+    client.get('/bench/ping')
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/bench/ping')
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    labels = (("route", "/api/chat"), ("method", "POST"), ("status", "200"))
+    results = {
+        "inc_us": per_call_us(lambda: metrics.inc("http_requests_total", labels), args.iterations),
+        "observe_us": per_call_us(lambda: metrics.observe("http_request_duration_seconds", 0.042, labels[:1]),
+                                  args.iterations),
+        "record_http_request_us": per_call_us(
+            lambda: record_http_request("/api/chat", "POST", "200", 0.042, 120, 900), args.iterations
+        )
+    }
+
+    response = Response("ok")
+
+    def hooks_once():
+        _metrics_start()
+        _metrics_record(response)
+        _metrics_finish(None)
+
+    with app.test_request_context('/api/chat', method='POST', data=b'{"message": "hola"}'):
+        results["flask_hooks_us"] = per_call_us(hooks_once, args.iterations // 4)
+
+    client = app.test_client()
+    hooks = (app.before_request_funcs[None], app.after_request_funcs[None], app.teardown_request_funcs[None])
+    enabled = [list(funcs) for funcs in hooks]
+    disabled = [[f for f in funcs if not f.__name__.startswith("_metrics")] for funcs in hooks]
+
+    # Rondas alternadas, mejor de cada una: el test client tiene mucho ruido entre ejecuciones
+    with_hooks = without_hooks = float("inf")
+    for _ in range(5):
+        for funcs, selected in zip(hooks, enabled):
+            funcs[:] = selected
+        with_hooks = min(with_hooks, seconds_per_request(client, args.requests))
+        for funcs, selected in zip(hooks, disabled):
+            funcs[:] = selected
+        without_hooks = min(without_hooks, seconds_per_request(client, args.requests))
+    for funcs, selected in zip(hooks, enabled):
+        funcs[:] = selected
+
+    results["request_with_metrics_us"] = round(with_hooks * 1e6, 1)
+    results["request_without_metrics_us"] = round(without_hooks * 1e6, 1)
+    results["per_request_overhead_us"] = round((with_hooks - without_hooks) * 1e6, 1)
+    results["render_ms"] = round(per_call_us(metrics.render, 200) / 1000, 3)
+    results["series"] = len(metrics.collect())
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Stub local del endpoint de chat completion de MiniMax para benchmarks y pruebas de carga:
+latencia según una distribución, inyección de errores y cuelgues, y modo streaming (SSE).
+
+Uso:
+    python benchmarks/minimax_stub.py [--port 8999] [--latency lognormal:0.3,0.5] [--error-rate 0.05]
+                                      [--hang-rate 0.01] [--stream-chunks 20] [--chunk-delay 0.01]
+
+    MINIMAX_API_KEY=bench MINIMAX_API_URL=http://127.0.0.1:8999/v1/text/chatcompletion_v2 python app.py
+
+Distribuciones de latencia (segundos): fixed:S, uniform:MIN,MAX, normal:MEDIA,DESV,
+lognormal:MEDIANA,SIGMA, exp:MEDIA.
+"""
+
+import argparse
+import json
+import math
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_PATH = "/v1/text/chatcompletion_v2"
+
+
+def latency_sampler(spec: str, rng: random.Random):
+    """Función sin argumentos que devuelve una latencia en segundos según `spec`"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(rng.gauss(values[0], values[1]), 0.0)
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Distribución de latencia desconocida: {spec}")
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # El backlog por defecto (5) tira SYNs con miles de conexiones simultáneas: reintentos de 1 s, 3 s...
+    request_queue_size = 4096
+
+
+class MiniMaxStub:
+    """Servidor HTTP del stub en un hilo; `url` es el endpoint para MINIMAX_API_URL"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0",
+                 error_rate: float = 0.0, error_status: int = 503, hang_rate: float = 0.0,
+                 hang_seconds: float = 60.0, stream_chunks: int = 20, chunk_delay: float = 0.0,
+                 response_chars: int = 600, connect_delay: float = 0.0, seed: int = None):
+        self.rng = random.Random(seed)
+        self.sample_latency = latency_sampler(latency, self.rng)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.stream_chunks = max(stream_chunks, 1)
+        self.chunk_delay = chunk_delay
+        self.response_chars = response_chars
+        self.connect_delay = connect_delay
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "streams": 0, "errors": 0, "hangs": 0, "connections": 0}
+
+        self.server = _StubServer((host, port), self._handler())
+        self.url = f"http://{host}:{self.server.server_port}{STUB_PATH}"
+
+    def start(self) -> "MiniMaxStub":
+        threading.Thread(target=self.server.serve_forever, name="minimax-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _plan(self):
+        """Qué hace esta petición: (latencia, "ok" | "error" | "hang")"""
+        with self._lock:
+            roll = self.rng.random()
+            delay = self.sample_latency()
+        if roll < self.hang_rate:
+            return self.hang_seconds, "hang"
+        if roll < self.hang_rate + self.error_rate:
+            return delay, "error"
+        return delay, "ok"
+
+    def _content(self, payload: dict) -> str:
+        """Texto de respuesta determinista para el mismo último mensaje"""
+        question = payload.get("messages", [{}])[-1].get("content", "")
+        seed = f"Respuesta del stub a: {question[:80]}. "
+        return (seed * (self.response_chars // len(seed) + 1))[:self.response_chars]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers y cuerpo van en escrituras separadas: sin esto Nagle + ACK retardado suman ~40 ms
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                stub._count("connections")
+                if stub.connect_delay:
+                    time.sleep(stub.connect_delay)  # Coste de una conexión nueva (handshake TLS del upstream real)
+
+            def do_HEAD(self):
+                # Como la API real: método no permitido, pero la conexión sigue viva (calentamiento del pool)
+                self.send_response(405)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub._count("requests")
+                delay, outcome = stub._plan()
+                try:
+                    if outcome == "hang":
+                        stub._count("hangs")
+                        time.sleep(delay)
+                        self._send_json(503, {"error": "stub hang"})
+                    elif outcome == "error":
+                        stub._count("errors")
+                        time.sleep(delay)
+                        self._send_json(stub.error_status, {"error": "stub error"})
+                    elif payload.get("stream"):
+                        stub._count("streams")
+                        self._stream(payload, delay)
+                    else:
+                        time.sleep(delay)
+                        content = stub._content(payload)
+                        self._send_json(200, {
+                            "choices": [{"message": {"role": "assistant", "content": content}}],
+                            "usage": {"prompt_tokens": len(json.dumps(payload)) // 4,
+                                      "completion_tokens": len(content) // 4,
+                                      "total_tokens": (len(json.dumps(payload)) + len(content)) // 4}
+                        })
+                except OSError:
+                    pass  # El cliente abandonó (timeout)
+
+            def _send_json(self, status: int, data: dict):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, payload: dict, delay: float):
+                """Latencia hasta el primer chunk y luego stream_chunks deltas separados por chunk_delay"""
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                content = stub._content(payload)
+                size = -(-len(content) // stub.stream_chunks)
+                for start in range(0, len(content), size):
+                    event = {"choices": [{"delta": {"content": content[start:start + size]}}]}
+                    self._chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+                    if stub.chunk_delay:
+                        time.sleep(stub.chunk_delay)
+                self._chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Opciones del stub compartidas con loadgen.py"""
+    parser.add_argument("--latency", default="fixed:0.05", help="Distribución de latencia del upstream")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas con --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fracción de peticiones que no responden a tiempo")
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--stream-chunks", type=int, default=20, help="Deltas por respuesta en modo streaming")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Segundos entre deltas en modo streaming")
+    parser.add_argument("--response-chars", type=int, default=600)
+    parser.add_argument("--connect-delay", type=float, default=0.0, help="Segundos extra por conexión nueva (handshake TLS)")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_from_args(args, host: str = "127.0.0.1", port: int = 0) -> MiniMaxStub:
+    return MiniMaxStub(host=host, port=port, latency=args.latency, error_rate=args.error_rate,
+                       error_status=args.error_status, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+                       stream_chunks=args.stream_chunks, chunk_delay=args.chunk_delay,
+                       response_chars=args.response_chars, connect_delay=args.connect_delay, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = stub_from_args(args, args.host, args.port).start()
+    print(f"Stub de MiniMax en {stub.url} (latencia {args.latency}, errores {args.error_rate}, cuelgues {args.hang_rate})")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(stub.counts))
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Prueba de estrés del orden por sesión: cientos de hilos envían mensajes a /api/chat a la vez,
+repartidos entre pocas sesiones (muchos hilos por sesión) o entre muchas (casi sin contención),
+con SessionLocks y con una línea base sin sincronizar. Se comprueba la integridad del historial:
+ningún turno perdido y cada llamada a MiniMax lleva como último mensaje del asistente la
+respuesta del turno anterior de su sesión. Termina con código 1 si hay violaciones con locks.
+
+Uso:
+    python benchmarks/session_locks.py [--threads 300] [--messages 5] [--sessions 30,1500] [--latency fixed:0.005]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minimax_stub import MiniMaxStub  # noqa: E402
+
+
+class NoLocks:
+    """Línea base: lo que había antes de SessionLocks"""
+
+    def hold(self, session_id: str):
+        return nullcontext()
+
+
+def run(app_module, sessions: int, args, locked: bool) -> dict:
+    assistant = app_module.ai_assistant
+    assistant.session_locks = app_module.SessionLocks() if locked else NoLocks()
+    run_id = f"{'locked' if locked else 'nolock'}-{sessions}"
+
+    # Último mensaje del asistente que llevó cada llamada a MiniMax, por mensaje del usuario
+    sent_context = {}
+    post = assistant.upstream.post
+
+    def recording_post(url, **kwargs):
+        messages = json.loads(kwargs["data"])["messages"]
+        previous = [m["content"] for m in messages if m["role"] == "assistant"]
+        sent_context[messages[-1]["content"]] = previous[-1] if previous else None
+        return post(url, **kwargs)
+
+    assistant.upstream.post = recording_post
+    errors = []
+
+    def worker(worker_id: int):
+        client = app_module.app.test_client()
+        session_id = f"{run_id}-s{worker_id % sessions}"
+        for i in range(args.messages):
+            response = client.post("/api/chat", json={"message": f"{run_id} w{worker_id} m{i}", "session_id": session_id})
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    assistant.upstream.post = post
+
+    sent = args.threads * args.messages
+    lost = violations = unchecked = 0
+    for s in range(sessions):
+        history = assistant.sessions.history(f"{run_id}-s{s}")
+        expected = sum(1 for w in range(args.threads) if w % sessions == s) * args.messages
+        lost += expected - len(history)
+        for i, turn in enumerate(history):
+            previous = history[i - 1]["assistant"] if i else None
+            if turn["user"] not in sent_context:
+                unchecked += 1  # El turno no pasó por MiniMax
+            elif sent_context[turn["user"]] != previous:
+                violations += 1
+
+    return {
+        "sessions": sessions,
+        "locks": locked,
+        "messages": sent,
+        "http_errors": len(errors),
+        "lost_turns": lost,
+        "context_violations": violations,
+        "unchecked_turns": unchecked,
+        "msg_per_s": round(sent / wall, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=5, help="Mensajes por hilo")
+    parser.add_argument("--sessions", default="30,1500", help="Números de sesiones a probar, separados por comas")
+    parser.add_argument("--latency", default="fixed:0.005", help="Latencia del stub")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MINIMAX_API_KEY": os.environ.get("MINIMAX_API_KEY", "bench"),
+        "MINIMAX_API_URL": MiniMaxStub(latency=args.latency).start().url,
+        "HEALTH_PROBE_ENABLED": "0",
+        "RESPONSE_CACHE_ENABLED": "0",
+        "SIMILARITY_CACHE_ENABLED": "0",
+        "LOCAL_ANSWERS": "off",
+        # Solo se miden los locks de sesión: sin control de admisión ni recorte del historial
+        "UPSTREAM_MAX_CONCURRENCY": "0",
+        "SESSION_BACKEND": "memory",
+        "SESSION_MAX_TURNS": str(args.threads * args.messages)
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app as app_module
+
+    results = []
+    for sessions in (int(value) for value in args.sessions.split(",")):
+        for locked in (False, True):
+            results.append(run(app_module, sessions, args, locked))
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if any(r["locks"] and (r["context_violations"] or r["lost_turns"] or r["http_errors"] or r["unchecked_turns"]) for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
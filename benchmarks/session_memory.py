@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Memoria con 1M sesiones de un turno (respuesta de ~800 bytes, como una página cargada y
+abandonada): el dict sin límites que era session_data frente a SessionStore con sus topes
+por defecto. Cada variante corre en un proceso aparte y mide el RSS antes y después.
+
+Uso:
+    python benchmarks/session_memory.py [--sessions 1000000] [--reply-bytes 800] [--variant both|dict|store]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(variant: str, sessions: int, reply_bytes: int) -> dict:
+    os.environ.setdefault("MINIMAX_API_KEY", "")
+    import logging
+    logging.disable(logging.CRITICAL)
+    from app import SessionStore
+
+    def reply(i: int) -> str:
+        # Cada respuesta es un str distinto, como las que llegan de MiniMax (compartir uno falsearía la medida)
+        return f"{i:012d}" + "x" * (reply_bytes - 12)
+
+    base = rss_mb()
+    started = time.perf_counter()
+    if variant == "dict":
+        # Lo que hacía session_data: una lista por session_id, para siempre
+        store = {}
+        for i in range(sessions):
+            session_id = f"session_{i}"
+            if session_id not in store:
+                store[session_id] = []
+            store[session_id].append({"user": "hola", "assistant": reply(i), "timestamp": "2024-01-01T00:00:00"})
+        retained = len(store)
+    else:
+        store = SessionStore()
+        for i in range(sessions):
+            store.append(f"session_{i}", {"user": "hola", "assistant": reply(i), "timestamp": "2024-01-01T00:00:00"})
+        retained = len(store)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "variant": variant,
+        "sessions": sessions,
+        "retained_sessions": retained,
+        "rss_delta_mb": round(rss_mb() - base, 1),
+        "appends_per_s": round(sessions / elapsed)
+    }
+    if variant == "store":
+        result["store"] = store.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--reply-bytes", type=int, default=800)
+    parser.add_argument("--variant", choices=("both", "dict", "store"), default="both")
+    args = parser.parse_args()
+
+    if args.variant != "both":
+        print(json.dumps(measure(args.variant, args.sessions, args.reply_bytes)))
+        return
+
+    # Un proceso por variante: el RSS de una no contamina la otra
+    results = []
+    for variant in ("dict", "store"):
+        output = subprocess.run([sys.executable, __file__, "--variant", variant, "--sessions", str(args.sessions),
+                                 "--reply-bytes", str(args.reply_bytes)], capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
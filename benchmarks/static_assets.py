@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Frontend antes y después de la tabla de assets en memoria: peticiones por segundo, accesos al
+sistema de archivos por petición (stat/open) y bytes de la primera carga y de las recargas.
+
+Uso:
+    python benchmarks/static_assets.py [--requests 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import send_from_directory  # noqa: E402
+
+from app import app, static_assets  # noqa: E402
+
+FIRST_LOAD = ["", "styles.css", "script.js"]
+filesystem_calls = 0
+
+
+def legacy_frontend(path):
+    """Implementación anterior de serve_frontend"""
+    if path != "" and os.path.exists(path):
+        return send_from_directory('.', path)
+    else:
+        return send_from_directory('.', 'index.html')
+
+
+app.add_url_rule('/bench/legacy/', 'bench_legacy_root', legacy_frontend, defaults={'path': ''})
+app.add_url_rule('/bench/legacy/<path:path>', 'bench_legacy', legacy_frontend)
+
+
+def count_filesystem_calls():
+    """Cuenta os.stat (exists/isfile/send_file) y open() durante el benchmark"""
+    real_stat = os.stat
+
+    def stat(*args, **kwargs):
+        global filesystem_calls
+        filesystem_calls += 1
+        return real_stat(*args, **kwargs)
+
+    def audit(event, args):
+        global filesystem_calls
+        if event == "open":
+            filesystem_calls += 1
+
+    os.stat = stat
+    sys.addaudithook(audit)
+
+
+def load(client, prefix: str, paths, headers: dict, previous: dict = None) -> dict:
+    """Carga la página completa; con `previous`, cada petición revalida con el ETag de la carga anterior"""
+    total, responses = 0, {}
+    for path in paths:
+        conditional = dict(headers)
+        if previous is not None and previous[path].headers.get("ETag"):
+            conditional["If-None-Match"] = previous[path].headers["ETag"]
+        response = client.get(prefix + path, headers=conditional)
+        total += len(response.get_data())
+        responses[path] = response
+    return {"requests": len(paths), "bytes": total, "responses": responses}
+
+
+def run(client, prefix: str, paths, requests: int, headers: dict) -> dict:
+    global filesystem_calls
+    load(client, prefix, paths, headers)
+    filesystem_calls = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        client.get(prefix + paths[i % len(paths)], headers=headers)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": round(requests / elapsed),
+        "filesystem_calls_per_request": round(filesystem_calls / requests, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.chdir(app.root_path)
+    count_filesystem_calls()
+    client = app.test_client()
+    browser = {"Accept-Encoding": "gzip, deflate, br"}
+    fingerprinted = [""] + [static_assets.fingerprinted[name] for name in FIRST_LOAD[1:]]
+
+    legacy = load(client, "/bench/legacy/", FIRST_LOAD, browser)
+    legacy_reload = load(client, "/bench/legacy/", FIRST_LOAD, browser, legacy["responses"])
+    manifest = load(client, "/", fingerprinted, browser)
+    # En la recarga los assets con huella salen de la caché del navegador (immutable): solo se revalida index.html
+    manifest_reload = load(client, "/", [""], browser, manifest["responses"])
+
+    print(json.dumps({
+        "legacy": dict(run(client, "/bench/legacy/", FIRST_LOAD, args.requests, browser),
+                       first_load_bytes=legacy["bytes"], reload_requests=legacy_reload["requests"],
+                       reload_bytes=legacy_reload["bytes"]),
+        "manifest": dict(run(client, "/", fingerprinted, args.requests, browser),
+                         first_load_bytes=manifest["bytes"], reload_requests=manifest_reload["requests"],
+                         reload_bytes=manifest_reload["bytes"])
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
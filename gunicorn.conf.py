@@ -0,0 +1,37 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+La app, la base de conocimientos y las cachés precalculadas se cargan una vez en el master
+(preload_app) y los workers las comparten por copy-on-write. Cada worker abre sus conexiones
+keep-alive hacia MiniMax antes de aceptar tráfico; /api/ready lo refleja para el balanceador.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 9000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+preload_app = True
+
+# Reciclado de workers (antes pasado por error a app.run)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 50))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    # En el master, antes del primer fork: cachés y gc.freeze() (idempotente en los siguientes)
+    from app import warm_up
+    warm_up.prepare()
+
+
+def post_fork(server, worker):
+    # En el worker, antes de aceptar conexiones: pool hacia MiniMax y readiness
+    from app import warm_up
+    warm_up.run()
@@ -68,8 +68,49 @@ async function sendMessage() {
     hideTypingIndicator();
 }
 
-// Enviar mensaje a la IA real
+// Servidor saturado (429 o evento de error con retry_after): reintentar más tarde, no ya
+class RetryLaterError extends Error {
+    constructor(retryAfter) {
+        super(`Servicio saturado, reintentar en ${retryAfter}s`);
+        this.retryAfter = retryAfter;
+    }
+}
+
+// Segundos de espera de una respuesta 429 (cuerpo JSON o cabecera Retry-After)
+async function retryAfterOf(response) {
+    let seconds = parseInt(response.headers.get('Retry-After'), 10);
+    try {
+        const data = await response.json();
+        if (data.retry_after) seconds = data.retry_after;
+    } catch (error) {
+        // Cuerpo no JSON: basta con la cabecera
+    }
+    return seconds > 0 ? seconds : 1;
+}
+
+function showRetryLater(error) {
+    addAIMessage(`⏳ El servicio está saturado. Reintenta en ${error.retryAfter}s.`, 'error');
+}
+
+// Enviar mensaje a la IA real (streaming SSE con fallback a JSON)
 async function sendToAI(message) {
+    try {
+        const streamed = await streamFromAI(message);
+        if (streamed) return;
+    } catch (error) {
+        if (error instanceof RetryLaterError) {
+            showRetryLater(error);
+            return;
+        }
+        if (error.afterFirstToken) {
+            // Ya se mostró parte de la respuesta: reenviar por /api/chat duplicaría el turno en el historial
+            console.error('Streaming interrumpido:', error);
+            addAIMessage('❌ La respuesta se interrumpió. Por favor intenta de nuevo.', 'error');
+            return;
+        }
+        console.warn('⚠️ Streaming no disponible, usando /api/chat:', error);
+    }
+    
     try {
         const response = await fetch(`${CHAT_CONFIG.backendUrl}/api/chat`, {
             method: 'POST',
@@ -82,6 +123,11 @@ async function sendToAI(message) {
             })
         });
         
+        if (response.status === 429) {
+            showRetryLater(new RetryLaterError(await retryAfterOf(response)));
+            return;
+        }
+        
         const data = await response.json();
         
         if (data.success) {
@@ -96,6 +142,76 @@ async function sendToAI(message) {
     }
 }
 
+// Recibir la respuesta token a token desde /api/chat/stream.
+// Devuelve false si no llegó ningún token (para reintentar con /api/chat). Los errores
+// posteriores al primer token llevan afterFirstToken: ese turno ya no se puede reenviar.
+async function streamFromAI(message) {
+    const response = await fetch(`${CHAT_CONFIG.backendUrl}/api/chat/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify({
+            message: message,
+            session_id: CHAT_CONFIG.sessionId
+        })
+    });
+    
+    if (response.status === 429) throw new RetryLaterError(await retryAfterOf(response));
+    if (!response.ok || !response.body) return false;
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullText = '';
+    let messageText = null;
+    
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+        
+            // Los eventos SSE se separan por una línea en blanco
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+            
+                let eventName = 'message';
+                let dataLine = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLine += line.slice(5).trim();
+                }
+                if (!dataLine) continue;
+            
+                const data = JSON.parse(dataLine);
+                if (eventName === 'error') {
+                    if (data.retry_after && messageText === null) throw new RetryLaterError(data.retry_after);
+                    throw new Error(data.error || 'Error en streaming');
+                }
+                if (eventName !== 'message' || !data.delta) continue;
+            
+                fullText += data.delta;
+                if (!messageText) {
+                    // Primer token: reemplazar el indicador de typing por el mensaje
+                    hideTypingIndicator();
+                    messageText = addAIMessage('', 'ai');
+                }
+                messageText.innerHTML = processMarkdown(fullText);
+                scrollToBottom();
+            }
+        }
+    } catch (error) {
+        error.afterFirstToken = messageText !== null;
+        throw error;
+    }
+    
+    return messageText !== null;
+}
+
 // Respuestas offline cuando el backend no está disponible
 async function sendOfflineResponse(message) {
     const responses = {
@@ -162,6 +278,8 @@ function addAIMessage(message, type = 'ai') {
     
     chatMessages.appendChild(messageDiv);
     scrollToBottom();
+    
+    return messageDiv.querySelector('.message-text');
 }
 
 // Mostrar indicador de typing